@@ -0,0 +1,393 @@
+import os
+import sys
+import hashlib
+import time
+import asyncio
+import argparse
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request, Response
+from pydantic import BaseModel
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(SRC_DIR, "dataset-generation"))
+sys.path.append(os.path.join(SRC_DIR, "search"))
+from corpus import load_doc_ids, load_summary, summary_path, record_summary  # noqa: E402
+from corpus_store import CorpusStore, CORPUS_DIR  # noqa: E402
+from pdf_text import COURT_DIR, get_text  # noqa: E402
+from bm25_index import BM25Index, BM25_INDEX_DIR  # noqa: E402
+from vector_index import VectorIndex, VECTOR_INDEX_DIR  # noqa: E402
+from citation_graph import CitationGraph, CITATION_GRAPH_DIR, RERANK_DEPTH  # noqa: E402
+
+HOST = "127.0.0.1"
+PORT = 8000
+CACHE_SIZE = 1024
+# Summarization requests arriving within this window share one BART batch
+MAX_BATCH_WAIT_SECONDS = 0.05
+MAX_BATCH_DOCUMENTS = 16
+# A doc ID missing from the manifests triggers at most one rescan per interval
+LOCATOR_REFRESH_SECONDS = 30.0
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class LRUCache:
+    """A thread-safe least-recently-used cache of responses."""
+
+    def __init__(self, capacity=CACHE_SIZE):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+
+class LatencyHistogram:
+    """Per-route request latencies, rendered in the Prometheus text format.
+
+    Each uvicorn worker process keeps its own histogram.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = defaultdict(lambda: [0] * (len(buckets) + 1))
+        self.sums = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def observe(self, route, seconds):
+        with self.lock:
+            self.counts[route][bisect_left(self.buckets, seconds)] += 1
+            self.sums[route] += seconds
+
+    def render(self):
+        lines = ["# TYPE nyay_request_seconds histogram"]
+        with self.lock:
+            for route, counts in sorted(self.counts.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f'nyay_request_seconds_bucket{{route="{route}",le="{le}"}} {cumulative}')
+                lines.append(f'nyay_request_seconds_sum{{route="{route}"}} {self.sums[route]:.6f}')
+                lines.append(f'nyay_request_seconds_count{{route="{route}"}} {cumulative}')
+        return "\n".join(lines) + "\n"
+
+
+class MicroBatcher:
+    """Collects concurrent summarization requests into shared batches.
+
+    Requests that arrive within max_wait of the first are summarized
+    together on one inference thread, so BART fills its batches across
+    callers instead of running one document at a time.
+    """
+
+    def __init__(self, summarize_batch, max_batch=MAX_BATCH_DOCUMENTS, max_wait=MAX_BATCH_WAIT_SECONDS):
+        self.summarize_batch = summarize_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        # The model is not shared between threads
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, text):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(items) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                summaries = await loop.run_in_executor(self.executor, self.summarize_batch,
+                                                       [text for text, _ in items])
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), summary in zip(items, summaries):
+                if not future.done():
+                    future.set_result(summary)
+
+
+def summarize_batch(texts):
+    """Summarize several documents through summarizer_bart's shared batch queue."""
+    from summarizer_bart import summarize_documents_bart
+    reports = dict(summarize_documents_bart(enumerate(texts)))
+    return [reports[i] for i in range(len(texts))]
+
+
+class DocumentLocator:
+    """Resolves doc IDs to (court, year, PDF path) from the downloader manifests."""
+
+    def __init__(self, court_dir=COURT_DIR, refresh_interval=LOCATOR_REFRESH_SECONDS):
+        self.court_dir = court_dir
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.locations = {}
+        self.refreshed_at = 0.0
+        self.refresh()
+
+    def refresh(self):
+        locations = {}
+        courts = os.listdir(self.court_dir) if os.path.isdir(self.court_dir) else []
+        for court in courts:
+            for (year, filename), doc_id in load_doc_ids(court, self.court_dir).items():
+                locations[doc_id] = (court, int(year), os.path.join(self.court_dir, court, year, filename))
+        with self.lock:
+            self.locations = locations
+            self.refreshed_at = time.monotonic()
+
+    def locate(self, doc_id):
+        """Return (court, year, pdf_path) for a doc ID, rescanning the manifests on a miss at most once per interval."""
+        location = self.locations.get(doc_id)
+        if location is None:
+            with self.lock:
+                # Concurrent misses share one rescan: the first claims the interval before scanning
+                due = time.monotonic() - self.refreshed_at >= self.refresh_interval
+                if due:
+                    self.refreshed_at = time.monotonic()
+            if due:
+                self.refresh()
+                location = self.locations.get(doc_id)
+        return location
+
+
+def save_summary(store, store_lock, doc_id, court, year, pdf_path, summary):
+    """Write a summary file next to the batch summarizers' and record it in the corpus store."""
+    filename = os.path.basename(pdf_path)
+    os.makedirs(os.path.dirname(summary_path(court, year, filename)), exist_ok=True)
+    with open(summary_path(court, year, filename), "w", encoding="utf-8") as f:
+        f.write(summary)
+    if store is not None:
+        with store_lock:
+            record_summary(store, court, year, pdf_path, summary, {(str(year), filename): doc_id})
+            store.flush()
+
+
+class SummarizeRequest(BaseModel):
+    text: Optional[str] = None
+    doc_id: Optional[str] = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    state = app.state
+    state.cache = LRUCache(int(os.environ.get("NYAY_CACHE_SIZE", CACHE_SIZE)))
+    state.latency = LatencyHistogram()
+    state.locator = DocumentLocator()
+    bm25_dir = os.environ.get("NYAY_BM25_INDEX_DIR", BM25_INDEX_DIR)
+    state.bm25 = BM25Index(bm25_dir) if os.path.exists(os.path.join(bm25_dir, "manifest.json")) else None
+    vector_dir = os.environ.get("NYAY_VECTOR_INDEX_DIR", VECTOR_INDEX_DIR)
+    state.vectors = VectorIndex(vector_dir) if os.path.exists(os.path.join(vector_dir, "passages.faiss")) else None
+    state.vector_lock = threading.Lock()
+    citation_dir = os.environ.get("NYAY_CITATION_GRAPH_DIR", CITATION_GRAPH_DIR)
+    state.citations = CitationGraph(citation_dir) if os.path.exists(os.path.join(citation_dir, "meta.json")) else None
+    store_dir = os.environ.get("NYAY_CORPUS_DIR", CORPUS_DIR)
+    state.store = CorpusStore(store_dir) if store_dir else None
+    state.store_lock = threading.Lock()
+    state.batcher = None
+    if os.environ.get("NYAY_SUMMARIZER", "1") == "1":
+        # summarizer_bart loads lazily; warm it up so the first request does not pay for loading
+        import summarizer_bart
+        await asyncio.get_running_loop().run_in_executor(None, summarizer_bart.load_model)
+        state.batcher = MicroBatcher(summarize_batch)
+        state.batcher.start()
+    try:
+        yield
+    finally:
+        if state.batcher is not None:
+            await state.batcher.stop()
+        if state.bm25 is not None:
+            state.bm25.close()
+        if state.vectors is not None:
+            state.vectors.close()
+
+
+app = FastAPI(title="Nyay search and summaries", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    start_time = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    request.app.state.latency.observe(route.path if route is not None else "unmatched",
+                                      time.perf_counter() - start_time)
+    return response
+
+
+@app.get("/health")
+def health():
+    state = app.state
+    return {"status": "ok", "bm25": state.bm25 is not None, "vector": state.vectors is not None,
+            "citations": state.citations is not None, "summarizer": state.batcher is not None}
+
+
+@app.get("/metrics")
+def metrics():
+    state = app.state
+    lines = [state.latency.render(),
+             f"nyay_response_cache_hits {state.cache.hits}\n",
+             f"nyay_response_cache_misses {state.cache.misses}\n"]
+    return Response("".join(lines), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/search")
+def search(q: str, k: int = 10, mode: str = "bm25", court: Optional[str] = None,
+           start_year: Optional[int] = None, end_year: Optional[int] = None, precedent: float = 0.0):
+    """Full-text (BM25) or semantic (vector) search over the indexed judgments.
+
+    A positive precedent weight boosts judgments that are cited more often.
+    """
+    state = app.state
+    key = ("search", q, k, mode, court, start_year, end_year, precedent)
+    if precedent > 0 and state.citations is None:
+        raise HTTPException(503, "Citation graph has not been built")
+    depth = k * RERANK_DEPTH if precedent > 0 else k
+    cached = state.cache.get(key)
+    if cached is not None:
+        return cached
+
+    if mode == "bm25":
+        if state.bm25 is None:
+            raise HTTPException(503, "BM25 index has not been built")
+        results = state.bm25.search(q, depth, court, start_year, end_year)
+    elif mode == "vector":
+        if state.vectors is None:
+            raise HTTPException(503, "Vector index has not been built")
+        with state.vector_lock:
+            results = state.vectors.search(q, depth, court, start_year, end_year)
+    else:
+        raise HTTPException(400, f"Unknown search mode {mode!r}")
+    if precedent > 0:
+        results = state.citations.rerank(results, precedent)[:k]
+
+    response = {"query": q, "mode": mode, "results": results}
+    state.cache.put(key, response)
+    return response
+
+
+@app.get("/cases/{doc_id}/summary")
+def case_summary(doc_id: str):
+    """Return the saved summary of a judgment."""
+    location = app.state.locator.locate(doc_id)
+    if location is None:
+        raise HTTPException(404, f"Unknown document {doc_id}")
+    court, year, pdf_path = location
+    summary = load_summary(court, year, os.path.basename(pdf_path))
+    if summary is None:
+        raise HTTPException(404, f"Document {doc_id} has not been summarized")
+    return {"doc_id": doc_id, "court": court, "year": year, "summary": summary}
+
+
+@app.get("/cases/{doc_id}/citations")
+def case_citations(doc_id: str, limit: int = 50):
+    """Return the judgments a case cites and is cited by (most cited first), and the statutes it refers to."""
+    graph = app.state.citations
+    if graph is None:
+        raise HTTPException(503, "Citation graph has not been built")
+    if doc_id not in graph.nodes:
+        raise HTTPException(404, f"Document {doc_id} is not in the citation graph")
+    return {"doc_id": doc_id, "cited_by_count": graph.citation_count(doc_id), "cites": graph.cites(doc_id, limit),
+            "cited_by": graph.cited_by(doc_id, limit), "statutes": graph.statutes(doc_id)}
+
+
+@app.post("/summarize")
+async def summarize(request: SummarizeRequest):
+    """Summarize posted text, or a downloaded judgment by doc ID (saving its summary)."""
+    state = app.state
+    if state.batcher is None:
+        raise HTTPException(503, "Summarizer is disabled")
+    if (request.text is None) == (request.doc_id is None):
+        raise HTTPException(400, "Provide exactly one of text or doc_id")
+
+    if request.text is not None:
+        key = ("summarize", hashlib.sha256(request.text.encode("utf-8")).hexdigest())
+    else:
+        key = ("summarize", f"doc:{request.doc_id}")
+    cached = state.cache.get(key)
+    if cached is not None:
+        return cached
+
+    if request.doc_id is not None:
+        location = state.locator.locate(request.doc_id)
+        if location is None:
+            raise HTTPException(404, f"Unknown document {request.doc_id}")
+        court, year, pdf_path = location
+        filename = os.path.basename(pdf_path)
+        summary = load_summary(court, year, filename)
+        if summary is None:
+            text = await asyncio.get_running_loop().run_in_executor(None, get_text, pdf_path)
+            summary = await state.batcher.submit(text)
+            await asyncio.get_running_loop().run_in_executor(None, save_summary, state.store, state.store_lock,
+                                                             request.doc_id, court, year, pdf_path, summary)
+        response = {"doc_id": request.doc_id, "court": court, "year": year, "summary": summary}
+    else:
+        response = {"summary": await state.batcher.submit(request.text)}
+    state.cache.put(key, response)
+    return response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve search, case summaries and on-demand summarization.')
+    parser.add_argument('--host', type=str, default=HOST, help='Interface to bind')
+    parser.add_argument('--port', type=int, default=PORT, help='Port to listen on')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes, each loading its own copy of the models and indexes')
+    parser.add_argument('--bm25-index-dir', type=str, default=BM25_INDEX_DIR, help='BM25 index directory')
+    parser.add_argument('--vector-index-dir', type=str, default=VECTOR_INDEX_DIR, help='Vector index directory')
+    parser.add_argument('--citation-graph-dir', type=str, default=CITATION_GRAPH_DIR, help='Citation graph directory')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help='Responses kept in the LRU cache')
+    parser.add_argument('--no-summarizer', action='store_true', help='Do not load the BART summarizer')
+    parser.add_argument('--store-dir', type=str, default=CORPUS_DIR, help='Corpus store recording new summaries')
+    parser.add_argument('--no-store', action='store_true', help='Do not record new summaries in the corpus store')
+    args = parser.parse_args()
+
+    # Workers are separate processes that re-import this module, so settings travel through the environment
+    os.environ["NYAY_BM25_INDEX_DIR"] = os.path.abspath(args.bm25_index_dir)
+    os.environ["NYAY_VECTOR_INDEX_DIR"] = os.path.abspath(args.vector_index_dir)
+    os.environ["NYAY_CITATION_GRAPH_DIR"] = os.path.abspath(args.citation_graph_dir)
+    os.environ["NYAY_CACHE_SIZE"] = str(args.cache_size)
+    os.environ["NYAY_SUMMARIZER"] = "0" if args.no_summarizer else "1"
+    os.environ["NYAY_CORPUS_DIR"] = "" if args.no_store else os.path.abspath(args.store_dir)
+    uvicorn.run("service:app", host=args.host, port=args.port, workers=args.workers)
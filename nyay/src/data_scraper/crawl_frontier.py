@@ -0,0 +1,146 @@
+import calendar
+import json
+import os
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+
+FRONTIER_DB = "../links/frontier.db"
+# A month is only considered final once it was crawled this long after it ended,
+# since judgments are often published on the site weeks after they are delivered.
+SETTLE_DAYS = 90
+
+# Month labels are matched on their first three letters, so "Sept" and "SEPTEMBER" parse too
+MONTH_NUMBERS = {name.lower(): num for num, name in enumerate(calendar.month_abbr) if name}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS months (
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    year TEXT NOT NULL,
+    month TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    href TEXT NOT NULL,
+    PRIMARY KEY (type, name, year, month)
+);
+CREATE TABLE IF NOT EXISTS pages (
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    year TEXT NOT NULL,
+    month TEXT NOT NULL,
+    pagenum INTEGER NOT NULL,
+    doc_ids TEXT NOT NULL,
+    is_last INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (type, name, year, month, pagenum)
+);
+CREATE TABLE IF NOT EXISTS month_lists (
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    year TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (type, name, year)
+);
+"""
+
+
+class CrawlFrontier:
+    """Persistent record of every (court, year, month, pagenum) unit the scraper has fetched."""
+
+    def __init__(self, path=FRONTIER_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def record_months(self, type, name, year, months):
+        """Remember the (label, href) months listed on a year page."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO months VALUES (?, ?, ?, ?, ?, ?)",
+                [(type, name, year, label, position, href) for position, (label, href) in enumerate(months)])
+            self.conn.execute("INSERT OR REPLACE INTO month_lists VALUES (?, ?, ?, ?)", (type, name, year, time.time()))
+
+    def months(self, type, name, year):
+        """Return the (label, href) months recorded for a year, in page order."""
+        rows = self.conn.execute(
+            "SELECT month, href FROM months WHERE type = ? AND name = ? AND year = ? ORDER BY position",
+            (type, name, year))
+        return rows.fetchall()
+
+    def months_settled(self, type, name, year):
+        """Return True if the year's month list was fetched long enough after December to be complete."""
+        row = self.conn.execute(
+            "SELECT fetched_at FROM month_lists WHERE type = ? AND name = ? AND year = ?",
+            (type, name, year)).fetchone()
+        return row is not None and is_settled(year, "December", row[0])
+
+    def record_page(self, type, name, year, month, pagenum, doc_ids, is_last):
+        """Checkpoint one fetched result page and the doc IDs found on it."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (type, name, year, month, pagenum, json.dumps(doc_ids), int(is_last), time.time()))
+
+    def pages(self, type, name, year, month):
+        """Return (pagenum, doc_ids, is_last, fetched_at) rows for a month, in page order."""
+        rows = self.conn.execute(
+            "SELECT pagenum, doc_ids, is_last, fetched_at FROM pages "
+            "WHERE type = ? AND name = ? AND year = ? AND month = ? ORDER BY pagenum",
+            (type, name, year, month))
+        return [(pagenum, json.loads(doc_ids), bool(is_last), fetched_at)
+                for pagenum, doc_ids, is_last, fetched_at in rows]
+
+    def resume_page(self, type, name, year, month):
+        """Return the page to continue a month from, or None if the month needs no more fetching."""
+        pages = self.pages(type, name, year, month)
+        if not pages:
+            return 0
+        last_pagenum, _, is_last, fetched_at = pages[-1]
+        if not is_last:
+            # Interrupted mid-month: pick up at the page after the last checkpoint.
+            return last_pagenum + 1
+        if is_settled(year, month, fetched_at):
+            return None
+        # The month was still open when last crawled, so re-check from its last non-empty page.
+        non_empty = [pagenum for pagenum, doc_ids, _, _ in pages if doc_ids]
+        return non_empty[-1] if non_empty else 0
+
+    def month_doc_ids(self, type, name, year, month):
+        """Return the unique doc IDs found for a month, in page order."""
+        doc_ids = {}
+        for _, page_doc_ids, _, _ in self.pages(type, name, year, month):
+            doc_ids.update(dict.fromkeys(page_doc_ids))
+        return list(doc_ids)
+
+    def year_doc_ids(self, type, name, year):
+        """Return the unique doc IDs found for a year, in month and page order."""
+        doc_ids = {}
+        for month, _ in self.months(type, name, year):
+            doc_ids.update(dict.fromkeys(self.month_doc_ids(type, name, year, month)))
+        return list(doc_ids)
+
+    def has_year(self, type, name, year):
+        return bool(self.months(type, name, year))
+
+    def year_settled(self, type, name, year):
+        """Return True once the year's month list and every month in it have been crawled after settling."""
+        months = self.months(type, name, year)
+        return bool(months) and self.months_settled(type, name, year) and all(
+            self.resume_page(type, name, year, month) is None for month, _ in months)
+
+
+def is_settled(year, month, fetched_at):
+    """Return True if a crawl at fetched_at happened long enough after the month ended.
+
+    A month label that cannot be parsed is treated as December, so it settles once its whole year has.
+    """
+    if not year.isdigit():
+        return False
+    month_num = MONTH_NUMBERS.get(month.strip()[:3].lower(), 12)
+    last_day = calendar.monthrange(int(year), month_num)[1]
+    settled_on = date(int(year), month_num, last_day) + timedelta(days=SETTLE_DAYS)
+    return datetime.fromtimestamp(fetched_at).date() >= settled_on
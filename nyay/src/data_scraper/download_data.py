@@ -1,14 +1,46 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 import json
+import hashlib
+import sqlite3
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 import pikepdf
 import argparse
 import re
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dataset-generation"))
+from corpus_store import CorpusStore, CORPUS_DIR  # noqa: E402
+
 COURT_DIR = "../links/Court_PDFs"
 COURT_DIR_SAVE = "../data/Court_PDFs"
+MANIFEST_NAME = "manifest.db"
+MAX_WORKERS = 8
+CHUNK_SIZE = 1024 * 1024
+
+HEADERS = {
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
+    "User-Agent": "Mozilla/5.0",
+    "Cache-Control": "no-cache",
+    "Accept-Encoding": "gzip, deflate, br, zstd",
+    "Connection": "keep-alive",
+    "Content-Type": "application/x-www-form-urlencoded",
+    "Accept-Language": "en-GB,en;q=0.9,en-US;q=0.8,hi;q=0.7",
+    "Origin": "https://indiankanoon.org",
+    "upgrade-insecure-requests": "1",
+}
+PARAMS = {
+    'switchLocale': 'y',
+    'siteEntryPassthrough': 'true'
+}
+
+_thread_local = threading.local()
+
 
 def changefile(file_path):
     print("Processing {0}".format(file_path))
@@ -25,62 +57,193 @@ def changefile(file_path):
         print(f"Error processing {file_path}: {e}")
 
 
-def download_pdf(url, directory="."):
+class DownloadManifest:
+    """SQLite record of downloaded documents keyed by doc ID and content hash."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "doc_id TEXT PRIMARY KEY, year TEXT NOT NULL, path TEXT NOT NULL, "
+            "sha256 TEXT NOT NULL, size INTEGER NOT NULL, downloaded_at REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS documents_sha256 ON documents (sha256)")
+        # Doc IDs whose bytes matched an already stored file; they keep no file of their own
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS duplicates ("
+            "doc_id TEXT PRIMARY KEY, year TEXT NOT NULL, canonical_id TEXT NOT NULL, "
+            "sha256 TEXT NOT NULL, size INTEGER NOT NULL, downloaded_at REAL NOT NULL)")
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, doc_id):
+        """Return (path, sha256, size) for a doc ID, or None if it was never downloaded."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT path, sha256, size FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+
+    def canonical_for_hash(self, sha256):
+        """Return (doc_id, path) of an already stored file with this content hash, if any. Caller holds the lock."""
+        rows = self.conn.execute(
+            "SELECT doc_id, path FROM documents WHERE sha256 = ? ORDER BY downloaded_at", (sha256,)).fetchall()
+        return next(((doc_id, path) for doc_id, path in rows if os.path.exists(path)), None)
+
+    def get_duplicate(self, doc_id):
+        """Return (canonical_id, sha256) for a doc ID whose bytes another doc's file holds, or None."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT canonical_id, sha256 FROM duplicates WHERE doc_id = ?", (doc_id,)).fetchone()
+
+    def add(self, doc_id, year, path, sha256, size):
+        """Record a stored file. Caller holds the lock inside a transaction."""
+        self.conn.execute("DELETE FROM duplicates WHERE doc_id = ?", (doc_id,))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?)",
+            (doc_id, year, path, sha256, size, time.time()))
+
+    def store(self, doc_id, year, tmp_path, path, sha256, size):
+        """Move a finished download into place, or record it as a duplicate of a stored file with its hash.
+
+        The hash lookup, the rename and the insert happen under one lock, so two workers fetching the same
+        bytes cannot both become canonical. Returns the canonical doc ID when the download was a duplicate.
+        """
+        with self.lock, self.conn:
+            canonical = self.canonical_for_hash(sha256)
+            if canonical and canonical[0] != doc_id:
+                os.unlink(tmp_path)
+                self.add_duplicate(doc_id, year, canonical[0], sha256, size)
+                return canonical[0]
+            os.replace(tmp_path, path)
+            self.add(doc_id, year, path, sha256, size)
+            return None
+
+    def add_duplicate(self, doc_id, year, canonical_id, sha256, size):
+        """Record a doc ID whose bytes another doc's file holds. Caller holds the lock inside a transaction."""
+        self.conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO duplicates VALUES (?, ?, ?, ?, ?, ?)",
+            (doc_id, year, canonical_id, sha256, size, time.time()))
+
+
+def get_session(pool_size=MAX_WORKERS):
+    """Return this thread's keep-alive session, creating it on first use."""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(HEADERS)
+        _thread_local.session = session
+    return session
+
+
+def doc_id_from_url(url):
+    match = re.search(r'/doc/(\d+)/', url)
+    # Fall back to a hash of the URL: the ID names the .part and .pdf files, so it must be filename-safe
+    return match.group(1) if match else hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+
+
+def is_downloaded(manifest, doc_id):
+    """Return True if the manifest has the document and its file, or its duplicate's, is still on disk intact."""
+    entry = manifest.get(doc_id)
+    if entry is None:
+        duplicate = manifest.get_duplicate(doc_id)
+        return duplicate is not None and is_downloaded(manifest, duplicate[0])
+    path, _, size = entry
+    return os.path.exists(path) and os.path.getsize(path) == size
+
+
+def download_pdf(url, directory=".", manifest=None, year=""):
+    """Stream one PDF to a temp file, then rename it into place and record it in the manifest."""
+    doc_id = doc_id_from_url(url)
+    if manifest is not None and is_downloaded(manifest, doc_id):
+        return "skipped"
+    tmp_path = os.path.join(directory, f".{doc_id}.part")
     try:
-        headers = {
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
-            "User-Agent": "Mozilla/5.0",
-            "Cache-Control": "no-cache",
-            "Accept-Encoding": "gzip, deflate, br, zstd",
-            "Connection": "keep-alive",
-            "Content-Type": "application/x-www-form-urlencoded",
-            "Accept-Language": "en-GB,en;q=0.9,en-US;q=0.8,hi;q=0.7",
-            "Origin": "https://indiankanoon.org",
-            "referer": url,
-            "upgrade-insecure-requests": "1",
-        }
-        params = {
-            'switchLocale': 'y',
-            'siteEntryPassthrough': 'true'
-        }
         data = {"type": "pdf"}
-        response = requests.post(url, data, headers=headers, params=params, stream=True)
-        if response.status_code == 200:
-            total_size = int(response.headers.get('content-length', 0))
-            d = response.headers['content-disposition']
-            filename = re.findall("filename=\"(.+)\"", d)[0]
-            filepath = os.path.join(directory, filename)
-            with open(filepath, 'wb') as f, tqdm(
-                desc=filename,
-                total=total_size,
-                unit='B',
-                unit_scale=True,
-                unit_divisor=1024,
-            ) as progress_bar:
-                for chunk in response.iter_content(chunk_size=1024):
+        response = get_session().post(url, data, headers={"referer": url}, params=PARAMS, stream=True)
+        with response:
+            if response.status_code != 200:
+                print(f"Failed to download from: {url}")
+                return "failed"
+            # Named by doc ID: content-disposition names are not unique across judgments
+            filepath = os.path.join(directory, f"{doc_id}.pdf")
+            digest = hashlib.sha256()
+            size = 0
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
                     f.write(chunk)
-                    progress_bar.update(len(data))
-            print(f"Downloaded: {filename}")
-            # changefile(filepath)  # Process the downloaded PDF file
-        else:
-            print(f"Failed to download from: {url}")
+                    digest.update(chunk)
+                    size += len(chunk)
+
+        sha256 = digest.hexdigest()
+        if manifest is None:
+            os.replace(tmp_path, filepath)
+            return "downloaded"
+        # Same bytes already stored under another doc ID are recorded as a duplicate instead of kept twice
+        manifest.store(doc_id, year, tmp_path, filepath, sha256, size)
+        # changefile(filepath)  # Process the downloaded PDF file
+        return "downloaded"
     except Exception as e:
         print(f"Error occurred while downloading from {url}: {e}")
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        return "failed"
 
 
-def download_court_pdfs(data_item, year_range, court_name):
-    court_dir = os.path.join(COURT_DIR_SAVE, court_name)
-    for year in year_range:
-        year_str = str(year)
-        if year_str in data_item:
-            links = data_item[year_str]
-            print(f"Downloading PDFs for the year {year_str} of {court_name}:")
-            directory = os.path.join(court_dir, year_str)
-            os.makedirs(directory, exist_ok=True)
-            for link in links:
-                download_pdf(link, directory)
+def record_year(store, manifest, court_name, year_str, links, failed):
+    """Record every listed link of a year in the corpus store with its file and hash once downloaded."""
+    for link in links:
+        doc_id = doc_id_from_url(link)
+        entry = manifest.get(doc_id)
+        if entry is not None:
+            path, sha256, _ = entry
+            store.update(court_name, year_str, doc_id, url=link, pdf_path=path, file_hash=sha256,
+                         status="downloaded")
+        elif manifest.get_duplicate(doc_id) is not None:
+            # The canonical doc's row carries the file; this one keeps only its hash
+            _, sha256 = manifest.get_duplicate(doc_id)
+            store.update(court_name, year_str, doc_id, url=link, file_hash=sha256, status="downloaded")
         else:
-            print(f"No data found for the year {year_str}")
+            store.update(court_name, year_str, doc_id, url=link, status="failed" if link in failed else "listed")
+    store.flush()
+
+
+def download_court_pdfs(data_item, year_range, court_name, max_workers=MAX_WORKERS, store_dir=CORPUS_DIR):
+    court_dir = os.path.join(COURT_DIR_SAVE, court_name)
+    manifest = DownloadManifest(os.path.join(court_dir, MANIFEST_NAME))
+    store = CorpusStore(store_dir) if store_dir else None
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for year in year_range:
+                year_str = str(year)
+                if year_str not in data_item:
+                    print(f"No data found for the year {year_str}")
+                    continue
+                links = data_item[year_str]
+                directory = os.path.join(court_dir, year_str)
+                os.makedirs(directory, exist_ok=True)
+
+                pending = [link for link in links if not is_downloaded(manifest, doc_id_from_url(link))]
+                print(f"Downloading PDFs for the year {year_str} of {court_name}: "
+                      f"{len(pending)} new, {len(links) - len(pending)} already downloaded")
+                futures = {executor.submit(download_pdf, link, directory, manifest, year_str): link for link in pending}
+                counts = {"downloaded": 0, "skipped": 0, "failed": 0}
+                failed = set()
+                for future in tqdm(as_completed(futures), total=len(futures), desc=year_str, unit="pdf"):
+                    result = future.result()
+                    counts[result] += 1
+                    if result == "failed":
+                        failed.add(futures[future])
+                print(f"Year {year_str}: {counts['downloaded']} downloaded, {counts['failed']} failed")
+                if store is not None:
+                    record_year(store, manifest, court_name, year_str, links, failed)
+    finally:
+        manifest.close()
 
 
 def load_existing_data(court_name):
@@ -102,10 +265,12 @@ if __name__ == "__main__":
     parser.add_argument('--court-name', type=str, required=True, help='Name of the court')
     parser.add_argument('--start-year', type=int, required=True, help='Start year for the range of PDFs to download')
     parser.add_argument('--end-year', type=int, required=True, help='End year for the range of PDFs to download')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help='Number of concurrent downloads')
+    parser.add_argument('--store-dir', type=str, default=CORPUS_DIR, help='Corpus store recording every document')
+    parser.add_argument('--no-store', action='store_true', help='Do not record downloads in the corpus store')
     args = parser.parse_args()
 
     year_range = range(args.start_year, args.end_year + 1)
     court_name = args.court_name
     existing_data = load_existing_data(court_name)
-    download_court_pdfs(existing_data, year_range, court_name)
-
+    download_court_pdfs(existing_data, year_range, court_name, args.workers, None if args.no_store else args.store_dir)
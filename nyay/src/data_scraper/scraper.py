@@ -1,79 +1,183 @@
-import requests
+import aiohttp
+import asyncio
 from bs4 import BeautifulSoup
+from urllib.parse import urlsplit
 import time
 import json
 import re
 import os
 import argparse
+from crawl_frontier import CrawlFrontier, FRONTIER_DB
 
 BASE_URL = 'https://indiankanoon.org'
 PAGINATION_LIMIT = 1000
-SLEEP_TIME = 1
-
-
-def get_soup(url, session):
-    """Retrieve and parse the HTML content of a URL."""
-    response = session.get(url)
-    response.raise_for_status()
-    return BeautifulSoup(response.content, 'html.parser')
-
-
-def scrape_links(court_or_act_name, valid_years, type):
-    """Scrape links from the website."""
+MAX_CONCURRENCY = 8
+REQUESTS_PER_SECOND = 1.0
+BURST_SIZE = 2
+
+
+class TokenBucket:
+    """Token-bucket rate limiter shared by every request sent to one host."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Fetcher:
+    """Bounded pool of in-flight requests with a per-host politeness budget."""
+
+    def __init__(self, session, concurrency=MAX_CONCURRENCY, rate=REQUESTS_PER_SECOND, burst=BURST_SIZE):
+        self.session = session
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+
+    def bucket_for(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+        return self.buckets[host]
+
+    async def get_soup(self, url):
+        """Retrieve and parse the HTML content of a URL."""
+        async with self.semaphore:
+            await self.bucket_for(url).acquire()
+            async with self.session.get(url) as response:
+                response.raise_for_status()
+                content = await response.read()
+        return BeautifulSoup(content, 'html.parser')
+
+
+async def scrape_month(fetcher, frontier, court_or_act_name, year_text, month_label, month_href, type,
+                       base_url=BASE_URL):
+    """Walk the result pages of one month, checkpointing each page in the frontier."""
+    start_page = frontier.resume_page(type, court_or_act_name, year_text, month_label)
+    if start_page is None:
+        print(f"{month_label} {year_text} is already complete. Skipping.")
+        return frontier.month_doc_ids(type, court_or_act_name, year_text, month_label)
+    if start_page:
+        print(f"Resuming {month_label} {year_text} at page {start_page}")
+
+    for page_num in range(start_page, PAGINATION_LIMIT):
+        month_url = f"{base_url}{month_href}&pagenum={page_num}"
+        month_soup = await fetcher.get_soup(month_url)
+
+        doc_links = [a for a in month_soup.find_all('a', href=True) if
+                     a['href'].startswith('/doc' if type == "act" else '/docfragment')]
+
+        doc_ids = []
+        for doc in doc_links:
+            match = re.search(r'/docfragment/(\d+)/\?formInput', doc['href']) if type == "court" else re.search(r'/doc/(\d+)/', doc['href'])
+            if match:
+                doc_ids.append(match.group(1))
+                print(doc_url(match.group(1), base_url))
+            else:
+                print("Document number not found in the URL.")
+
+        frontier.record_page(type, court_or_act_name, year_text, month_label, page_num, doc_ids, not doc_links)
+        if not doc_links:
+            break
+    return frontier.month_doc_ids(type, court_or_act_name, year_text, month_label)
+
+
+async def scrape_year(fetcher, frontier, court_or_act_name, year_text, year_url, type, base_url=BASE_URL):
+    """Scrape every month of a year concurrently and save the links in month order."""
     DIR = os.path.join("../links", "Court_PDFs" if type == "court" else "Constitution_ACTs", court_or_act_name)
-    base_browse_url = f'{BASE_URL}/browse/' if type == "court" else f'{BASE_URL}/browselaws/'
-    with requests.Session() as session:
-        soup = get_soup(base_browse_url, session)
-        results = [a for a in soup.find_all('a', href=True) if a['href'].startswith('/browse')]
-
-        final_list = {}
-        for court_or_act in results:
-            if court_or_act.get_text() != court_or_act_name:
-                continue
-            court_or_act_url = BASE_URL + court_or_act['href']
-
-            court_or_act_soup = get_soup(court_or_act_url, session)
-            years = [a for a in court_or_act_soup.find_all('a', href=True) if a['href'].startswith('/browse')]
-
-            for year in years:
-                year_text = year.get_text()
-                if not year_text.isdigit() or int(year_text) not in valid_years:
+    months = frontier.months(type, court_or_act_name, year_text)
+    if not frontier.months_settled(type, court_or_act_name, year_text):
+        # An open year gains months as the site publishes them, so its month list is re-read on every run
+        year_soup = await fetcher.get_soup(year_url)
+        months = [a for a in year_soup.find_all('a', href=True) if a['href'].startswith('/search/?')]
+        months = [(x.get_text().strip(), x['href']) for x in months if x.contents[0] != 'Entire Year']
+        frontier.record_months(type, court_or_act_name, year_text, months)
+
+    await asyncio.gather(*[scrape_month(fetcher, frontier, court_or_act_name, year_text, label, href, type, base_url)
+                           for label, href in months])
+    year_links = [doc_url(doc_id, base_url) for doc_id in frontier.year_doc_ids(type, court_or_act_name, year_text)]
+    print(f"Completed scraping for year {year_text} in court {court_or_act_name}")
+    save_to_json(year_links, os.path.join(DIR, f"{year_text}.json"))
+    return year_links
+
+
+async def scrape_links_async(court_or_act_name, valid_years, type, base_url=BASE_URL,
+                             concurrency=MAX_CONCURRENCY, rate=REQUESTS_PER_SECOND, burst=BURST_SIZE,
+                             frontier_path=FRONTIER_DB):
+    """Scrape links from the website, fanning out across years and months."""
+    base_browse_url = f'{base_url}/browse/' if type == "court" else f'{base_url}/browselaws/'
+    frontier = CrawlFrontier(frontier_path)
+    try:
+        async with aiohttp.ClientSession() as session:
+            fetcher = Fetcher(session, concurrency, rate, burst)
+            soup = await fetcher.get_soup(base_browse_url)
+            results = [a for a in soup.find_all('a', href=True) if a['href'].startswith('/browse')]
+
+            final_list = {}
+            pending = {}
+            for court_or_act in results:
+                if court_or_act.get_text() != court_or_act_name:
                     continue
+                court_or_act_url = base_url + court_or_act['href']
+
+                court_or_act_soup = await fetcher.get_soup(court_or_act_url)
+                years = [a for a in court_or_act_soup.find_all('a', href=True) if a['href'].startswith('/browse')]
+
+                for year in years:
+                    year_text = year.get_text()
+                    if not year_text.isdigit() or int(year_text) not in valid_years:
+                        continue
+
+                    if frontier.has_year(type, court_or_act_name, year_text):
+                        if frontier.year_settled(type, court_or_act_name, year_text):
+                            print(f"Data for year {year_text} is complete. Skipping download.")
+                            final_list[year_text] = [doc_url(doc_id, base_url) for doc_id in
+                                                     frontier.year_doc_ids(type, court_or_act_name, year_text)]
+                            continue
+                    else:
+                        # Years crawled before the frontier existed only have their JSON file.
+                        year_data = load_existing_data(court_or_act_name, year_text, type)
+                        if year_data:
+                            print(f"Data for year {year_text} already exists. Skipping download.")
+                            final_list[year_text] = year_data
+                            continue
+
+                    year_url = base_url + year['href']
+                    pending[year_text] = scrape_year(fetcher, frontier, court_or_act_name, year_text, year_url,
+                                                     type, base_url)
+
+            year_results = await asyncio.gather(*pending.values())
+            final_list.update(zip(pending.keys(), year_results))
+            return final_list
+    finally:
+        frontier.close()
+
+
+def scrape_links(court_or_act_name, valid_years, type, base_url=BASE_URL,
+                 concurrency=MAX_CONCURRENCY, rate=REQUESTS_PER_SECOND, burst=BURST_SIZE,
+                 frontier_path=FRONTIER_DB):
+    """Scrape links from the website."""
+    return asyncio.run(scrape_links_async(court_or_act_name, valid_years, type, base_url,
+                                          concurrency, rate, burst, frontier_path))
 
-                year_url = BASE_URL + year['href']
-                year_data = load_existing_data(court_or_act_name, year_text, type)
-                if year_data:
-                    print(f"Data for year {year_text} already exists. Skipping download.")
-                    final_list[year_text] = year_data
-                    continue
-                final_list[year_text] = []
-
-                year_soup = get_soup(year_url, session)
-                months = [a for a in year_soup.find_all('a', href=True) if a['href'].startswith('/search/?')]
-                months = [x for x in months if x.contents[0] != 'Entire Year']
-                for month in months:
-                    for page_num in range(PAGINATION_LIMIT):
-                        time.sleep(SLEEP_TIME)
-                        month_url = f"{BASE_URL}{month['href']}&pagenum={page_num}"
-                        month_soup = get_soup(month_url, session)
-
-                        doc_links = [a for a in month_soup.find_all('a', href=True) if
-                                     a['href'].startswith('/doc' if type == "act" else '/docfragment')]
-                        if not doc_links:
-                            break
-
-                        for doc in doc_links:
-                            match = re.search(r'/docfragment/(\d+)/\?formInput', doc['href']) if type == "court" else re.search(r'/doc/(\d+)/', doc['href'])
-                            if match:
-                                doc_number = match.group(1)
-                                doc_url = f"{BASE_URL}/doc/{doc_number}/"
-                                final_list[year_text].append(doc_url)
-                                print(doc_url)
-                            else:
-                                print("Document number not found in the URL.")
-                print(f"Completed scraping for year {year_text} in court {court_or_act_name}")
-                save_to_json(final_list[year_text], os.path.join(DIR, f"{year_text}.json"))
-        return final_list
+
+def doc_url(doc_id, base_url=BASE_URL):
+    return f"{base_url}/doc/{doc_id}/"
 
 
 def load_existing_data(name, year, type):
@@ -100,7 +204,18 @@ if __name__ == "__main__":
     parser.add_argument('--name', type=str, required=True, help="Name of the court or act to scrape data for")
     parser.add_argument('--start-year', type=int, required=True, help="Start year for scraping data")
     parser.add_argument('--end-year', type=int, required=True, help="End year for scraping data")
+    parser.add_argument('--base-url', type=str, default=BASE_URL,
+                        help="Site to crawl (point at a local stand-in server for testing)")
+    parser.add_argument('--concurrency', type=int, default=MAX_CONCURRENCY,
+                        help="Maximum number of requests in flight at once")
+    parser.add_argument('--rate', type=float, default=REQUESTS_PER_SECOND,
+                        help="Requests per second allowed per host")
+    parser.add_argument('--burst', type=int, default=BURST_SIZE,
+                        help="Number of requests a host may receive back to back")
+    parser.add_argument('--frontier', type=str, default=FRONTIER_DB,
+                        help="SQLite file that checkpoints every crawled page")
     args = parser.parse_args()
 
     valid_years = range(args.start_year, args.end_year + 1)
-    scraped_links = scrape_links(args.name, valid_years, args.type)
+    scraped_links = scrape_links(args.name, valid_years, args.type, args.base_url.rstrip('/'),
+                                 args.concurrency, args.rate, args.burst, args.frontier)
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+from aiohttp import ClientResponseError, ClientSession, web
+from aiohttp.test_utils import TestServer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from crawl_frontier import CrawlFrontier  # noqa: E402
+from scraper import Fetcher, doc_url, scrape_year  # noqa: E402
+
+COURT = "Test_Court"
+YEAR = "2020"
+YEAR_PATH = f"/browse/court/{COURT}/{YEAR}/"
+MONTHS = {"1": "January", "2": "February"}
+PAGES_PER_MONTH = 2
+RATE = 20.0
+BURST = 2
+# Allowance for scheduling jitter between the client taking a token and the server seeing the request
+JITTER = 0.02
+
+
+def month_doc_ids(month, pagenum):
+    return [f"{month}{pagenum}{i}" for i in range(2)] if pagenum < PAGES_PER_MONTH else []
+
+
+class LocalSite:
+    """Stand-in for the site's year and month result pages, logging every request it serves."""
+
+    def __init__(self):
+        self.requests = []
+        self.fail = set()
+        self.app = web.Application()
+        self.app.router.add_get(YEAR_PATH, self.year_page)
+        self.app.router.add_get("/search/", self.month_page)
+
+    async def year_page(self, request):
+        self.requests.append((time.monotonic(), "year", None))
+        links = ['<a href="/search/?month=0">Entire Year</a>']
+        links += [f'<a href="/search/?month={month}">{label}</a>' for month, label in MONTHS.items()]
+        return web.Response(text="".join(links), content_type="text/html")
+
+    async def month_page(self, request):
+        month, pagenum = request.query["month"], int(request.query["pagenum"])
+        self.requests.append((time.monotonic(), month, pagenum))
+        if (month, pagenum) in self.fail:
+            raise web.HTTPInternalServerError()
+        links = [f'<a href="/docfragment/{doc_id}/?formInput=x">doc</a>' for doc_id in month_doc_ids(month, pagenum)]
+        return web.Response(text="".join(links), content_type="text/html")
+
+
+class ScrapeYearTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        # scrape_year writes to ../links, relative to the working directory
+        self.cwd = os.getcwd()
+        os.makedirs(os.path.join(self.tmp.name, "work"))
+        os.chdir(os.path.join(self.tmp.name, "work"))
+        self.site = LocalSite()
+        self.server = TestServer(self.site.app)
+        await self.server.start_server()
+        self.base_url = str(self.server.make_url("")).rstrip("/")
+        self.frontier = CrawlFrontier(os.path.join(self.tmp.name, "frontier.db"))
+
+    async def asyncTearDown(self):
+        self.frontier.close()
+        await self.server.close()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    async def scrape(self):
+        async with ClientSession() as session:
+            fetcher = Fetcher(session, concurrency=4, rate=RATE, burst=BURST)
+            return await scrape_year(fetcher, self.frontier, COURT, YEAR, self.base_url + YEAR_PATH, "court",
+                                     self.base_url)
+
+    def expected_links(self):
+        return [doc_url(doc_id, self.base_url) for month in MONTHS for pagenum in range(PAGES_PER_MONTH)
+                for doc_id in month_doc_ids(month, pagenum)]
+
+    async def test_requests_respect_token_bucket(self):
+        links = await self.scrape()
+
+        self.assertEqual(links, self.expected_links())
+        times = [t for t, _, _ in self.site.requests]
+        self.assertEqual(len(times), 1 + len(MONTHS) * (PAGES_PER_MONTH + 1))
+        # After the initial burst every request waits for a token refilled at RATE per second
+        for k, t in enumerate(times):
+            self.assertGreaterEqual(t - times[0], (k + 1 - BURST) / RATE - JITTER)
+        with open(os.path.join("../links/Court_PDFs", COURT, f"{YEAR}.json")) as f:
+            self.assertEqual(json.load(f), links)
+
+    async def test_resumes_interrupted_month_from_frontier(self):
+        self.site.fail = {("1", 1)}
+        with self.assertRaises(ClientResponseError):
+            await self.scrape()
+        # Let the other month's task wind down before reading what was checkpointed
+        while len(asyncio.all_tasks()) > 1:
+            await asyncio.sleep(0.01)
+        self.assertEqual([row[0] for row in self.frontier.pages("court", COURT, YEAR, "January")], [0])
+        resume = {month: self.frontier.resume_page("court", COURT, YEAR, label) for month, label in MONTHS.items()}
+
+        self.site.fail = set()
+        self.site.requests = []
+        links = await self.scrape()
+
+        # The settled month list and every checkpointed page come from the frontier, not the site
+        self.assertEqual(sorted((month, pagenum) for _, month, pagenum in self.site.requests),
+                         [(month, pagenum) for month, start in resume.items() if start is not None
+                          for pagenum in range(start, PAGES_PER_MONTH + 1)])
+        self.assertEqual(links, self.expected_links())
+
+
+if __name__ == "__main__":
+    unittest.main()
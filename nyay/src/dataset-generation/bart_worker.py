@@ -0,0 +1,185 @@
+import os
+import io
+import sys
+import json
+import time
+import socket
+import argparse
+import socketserver
+from contextlib import redirect_stdout
+
+# Only the standard library is imported at module level so the client starts in milliseconds
+BART_WORKER_SOCKET = "../data/bart_worker.sock"
+
+
+class SocketLog(io.TextIOBase):
+    """Forward printed lines to the client as {"log": line} messages."""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.buffer = ""
+
+    def write(self, text):
+        self.buffer += text
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            self.send({"log": line + "\n"})
+        return len(text)
+
+    def flush(self):
+        if self.buffer:
+            self.send({"log": self.buffer})
+            self.buffer = ""
+
+    def send(self, message):
+        self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    """Run one newline-delimited JSON job and reply with its log lines and a final status message."""
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        log = SocketLog(self.wfile)
+        start = time.perf_counter()
+        try:
+            job = json.loads(line)
+            with redirect_stdout(log):
+                result = self.server.run(job)
+            log.flush()
+            log.send({"status": "ok", "elapsed": time.perf_counter() - start, **result})
+        except Exception as e:
+            log.flush()
+            log.send({"status": "error", "message": f"{e.__class__.__name__}: {e}"})
+
+
+class BartWorker(socketserver.UnixStreamServer):
+    """A long-lived process that keeps the BART model loaded and runs summarization jobs one at a time."""
+
+    def __init__(self, socket_path=BART_WORKER_SOCKET, num_threads=None, quantize=False):
+        if is_running(socket_path):
+            raise RuntimeError(f"A BART worker is already listening on {socket_path}")
+        import summarizer_bart
+        self.summarizer = summarizer_bart
+        summarizer_bart.configure_model(num_threads, quantize)
+        summarizer_bart.load_model()
+        if os.path.exists(socket_path):
+            # Nothing answered the ping, so this socket was left behind by a worker that did not shut down cleanly
+            os.unlink(socket_path)
+        os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+        self.socket_path = socket_path
+        super().__init__(socket_path, WorkerHandler)
+
+    def run(self, job):
+        command = job.get("command")
+        if command == "ping":
+            return {}
+        if command == "summarize_year_range":
+            self.summarizer.generate_summaries_for_year_range(
+                job["court_name"], job["start_year"], job["end_year"],
+                job.get("overlap", self.summarizer.CHUNK_OVERLAP),
+                self.summarizer.DEDUPE_DB if job.get("dedupe", True) else None,
+                self.summarizer.CORPUS_DIR if job.get("store", True) else None, job.get("skip_summarized", False))
+            return {}
+        if command == "summarize_text":
+            reports = dict(self.summarizer.summarize_documents_bart([(0, job["text"])],
+                                                                    overlap=job.get("overlap", 0)))
+            return {"summary": reports[0]}
+        if command == "shutdown":
+            # shutdown() blocks until serve_forever returns, so it must not run on the serving thread
+            import threading
+            threading.Thread(target=self.shutdown).start()
+            return {}
+        raise ValueError(f"Unknown command {command!r}")
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+def request(job, socket_path=BART_WORKER_SOCKET):
+    """Send a job to the running worker, echo its log, and return its final message."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(job) + "\n").encode("utf-8"))
+        for line in sock.makefile("r", encoding="utf-8"):
+            message = json.loads(line)
+            if "log" in message:
+                print(message["log"], end="")
+            elif message["status"] == "error":
+                raise RuntimeError(message["message"])
+            else:
+                return message
+    raise RuntimeError("Worker closed the connection without a result")
+
+
+def is_running(socket_path=BART_WORKER_SOCKET):
+    try:
+        request({"command": "ping"}, socket_path)
+        return True
+    except (OSError, RuntimeError):
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Keep BART loaded in a worker process and send it summarization jobs.')
+    parser.add_argument('--socket', type=str, default=BART_WORKER_SOCKET, help='Unix socket of the worker')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Load the model and serve jobs until shut down")
+    serve_parser.add_argument('--num-threads', type=int, default=None, help='Number of torch CPU threads')
+    serve_parser.add_argument('--quantize', action='store_true', help='Use a dynamic int8 quantized model on CPU')
+    summarize_parser = subparsers.add_parser("summarize", help="Summarize a court's PDFs for a year range")
+    summarize_parser.add_argument('--court-name', type=str, required=True, help='Name of the court')
+    summarize_parser.add_argument('--start-year', type=int, required=True, help='Start year of the documents')
+    summarize_parser.add_argument('--end-year', type=int, required=True, help='End year of the documents')
+    summarize_parser.add_argument('--overlap', type=int, default=0, help='Tokens shared between consecutive chunks')
+    summarize_parser.add_argument('--no-dedupe', action='store_true', help='Also summarize near-duplicate judgments')
+    summarize_parser.add_argument('--skip-summarized', action='store_true',
+                                  help='Skip documents that already have a summary in the corpus store')
+    summarize_parser.add_argument('--no-store', action='store_true', help='Do not record summaries in the corpus store')
+    summarize_parser.add_argument('--fallback', action='store_true',
+                                  help='Summarize in this process when no worker is running')
+    summarize_parser.add_argument('--num-threads', type=int, default=None,
+                                  help='Number of torch CPU threads when summarizing in this process')
+    summarize_parser.add_argument('--quantize', action='store_true',
+                                  help='Use a dynamic int8 quantized model when summarizing in this process')
+    subparsers.add_parser("status", help="Report whether a worker is running")
+    subparsers.add_parser("stop", help="Shut the worker down")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        if is_running(args.socket):
+            sys.exit(f"A BART worker is already listening on {args.socket}")
+        with BartWorker(args.socket, args.num_threads, args.quantize) as worker:
+            print(f"BART worker listening on {args.socket}")
+            try:
+                worker.serve_forever()
+            except KeyboardInterrupt:
+                pass
+    elif args.command == "status":
+        print("running" if is_running(args.socket) else "not running")
+    elif args.command == "stop":
+        request({"command": "shutdown"}, args.socket)
+    else:
+        try:
+            result = request({"command": "summarize_year_range", "court_name": args.court_name,
+                              "start_year": args.start_year, "end_year": args.end_year,
+                              "overlap": args.overlap, "dedupe": not args.no_dedupe, "store": not args.no_store,
+                              "skip_summarized": args.skip_summarized}, args.socket)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if not args.fallback:
+                sys.exit(f"No BART worker at {args.socket}; start one with: python bart_worker.py serve")
+            print(f"No BART worker at {args.socket}; summarizing in this process.")
+            # Only now pay for the model, PDF and corpus store imports
+            import summarizer_bart
+            summarizer_bart.configure_model(args.num_threads, args.quantize)
+            summarizer_bart.generate_summaries_for_year_range(
+                args.court_name, args.start_year, args.end_year, args.overlap,
+                None if args.no_dedupe else summarizer_bart.DEDUPE_DB,
+                None if args.no_store else summarizer_bart.CORPUS_DIR, args.skip_summarized)
+            sys.exit(0)
+        print(f"Done in {result['elapsed']:.1f}s")
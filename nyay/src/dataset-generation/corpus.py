@@ -0,0 +1,79 @@
+import os
+import sqlite3
+from collections import namedtuple
+from pdf_text import COURT_DIR, extract_texts, list_pdfs
+
+SUMMARY_DIR = "../summary/Court_Summary"
+MANIFEST_NAME = "manifest.db"
+
+Document = namedtuple("Document", ["doc_id", "court", "year", "pdf_path", "text"])
+
+
+def summary_path(court_name, year, pdf_filename, summary_dir=SUMMARY_DIR):
+    """Where save_summary writes the summary of a PDF."""
+    return os.path.join(summary_dir, court_name, str(year), f"{pdf_filename.replace('.pdf', '')}_summary.txt")
+
+
+def load_summary(court_name, year, pdf_filename, summary_dir=SUMMARY_DIR):
+    """Return the saved summary of a PDF, or None if it has not been summarized."""
+    path = summary_path(court_name, year, pdf_filename, summary_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def load_doc_ids(court_name, court_dir=COURT_DIR):
+    """Map (year, filename) to the Indian Kanoon doc ID recorded by the downloader's manifest."""
+    path = os.path.join(court_dir, court_name, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("SELECT doc_id, year, path FROM documents ORDER BY downloaded_at").fetchall()
+    finally:
+        conn.close()
+    return {(str(year), os.path.basename(pdf_path)): doc_id for doc_id, year, pdf_path in rows}
+
+
+def doc_id_for(doc_ids, year, pdf_path):
+    """The manifest's doc ID for a PDF, falling back to its file name for PDFs downloaded before the manifest."""
+    filename = os.path.basename(pdf_path)
+    return doc_ids.get((str(year), filename), os.path.splitext(filename)[0])
+
+
+def iter_documents(court_name, start_year, end_year, workers=None, cache=None, dedupe=None):
+    """Yield a Document for every PDF of a court in a year range, one year's extraction at a time.
+
+    With a DedupeIndex only canonical documents are yielded.
+    """
+    doc_ids = load_doc_ids(court_name)
+    for year in range(start_year, end_year + 1):
+        year_dir = os.path.join(COURT_DIR, court_name, str(year))
+        if not os.path.exists(year_dir):
+            print(f"No directory found for {court_name} in {year}")
+            continue
+        texts = extract_texts(list_pdfs(year_dir), workers, cache)
+        for pdf_path, text in texts.items():
+            doc_id = doc_id_for(doc_ids, year, pdf_path)
+            if dedupe is not None and dedupe.classify(doc_id, court_name, year, pdf_path, text) != doc_id:
+                continue
+            yield Document(doc_id, court_name, year, pdf_path, text)
+
+
+def record_texts(store, court_name, year, texts, doc_ids):
+    """Record a year's extracted {pdf_path: text} in a CorpusStore."""
+    for pdf_path, text in texts.items():
+        store.update(court_name, year, doc_id_for(doc_ids, year, pdf_path), pdf_path=pdf_path, text=text,
+                     status="extracted")
+
+
+def record_summary(store, court_name, year, pdf_path, summary, doc_ids):
+    store.update(court_name, year, doc_id_for(doc_ids, year, pdf_path), pdf_path=pdf_path, summary=summary,
+                 status="summarized")
+
+
+def drop_summarized(store, court_name, year, texts, doc_ids):
+    """Return the {pdf_path: text} entries whose documents have no summary in the store yet."""
+    done = store.summarized_doc_ids(court_name, year)
+    return {pdf_path: text for pdf_path, text in texts.items() if doc_id_for(doc_ids, year, pdf_path) not in done}
@@ -0,0 +1,365 @@
+import os
+import re
+import json
+import time
+import fcntl
+import hashlib
+import argparse
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+CORPUS_DIR = "../data/Corpus"
+LINKS_DIR = "../links/Court_PDFs"
+# Appended part files a partition may collect before flush() compacts it into one
+MAX_PARTS = 16
+# Buffered rows that trigger a flush, bounding the text and summaries held in memory
+FLUSH_ROWS = 500
+DOC_URL_RE = re.compile(r"/doc/(\d+)/")
+
+# Pipeline stages in order; a row's status only moves forward unless its file changes
+STATUSES = ["listed", "failed", "downloaded", "extracted", "summarized"]
+STATUS_RANK = {status: rank for rank, status in enumerate(STATUSES)}
+
+SCHEMA = pa.schema([
+    ("doc_id", pa.string()),
+    ("court", pa.string()),
+    ("year", pa.int32()),
+    ("url", pa.string()),
+    ("pdf_path", pa.string()),
+    ("file_hash", pa.string()),
+    ("text", pa.large_string()),
+    ("summary", pa.large_string()),
+    ("status", pa.string()),
+    ("updated_at", pa.float64()),
+])
+FIELDS = SCHEMA.names
+# Columns an update part only carries when the update sets them; unchanged values stay in the part that wrote them
+LARGE_FIELDS = ["text", "summary"]
+LOCK_NAME = ".lock"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def latest_rows(table):
+    """Keep only the last row written for each doc ID; parts are concatenated oldest first."""
+    if table.num_rows == 0:
+        return table
+    doc_ids = table.column("doc_id").to_numpy(zero_copy_only=False)[::-1]
+    _, first = np.unique(doc_ids, return_index=True)
+    return table.take(pa.array(np.sort(table.num_rows - 1 - first)))
+
+
+def written_values(table, current, column):
+    """Each current row's value of a large column, from the last row that wrote it for the current file hash.
+
+    A value written for an older file hash is stale, which is how a new hash drops the old text and summary.
+    """
+    written = table.select(["doc_id", "file_hash", column]).filter(pc.is_valid(table.column(column)))
+    if written.num_rows:
+        positions = pc.index_in(written.column("doc_id"), value_set=current.column("doc_id").combine_chunks())
+        current_hash = current.column("file_hash").take(positions)
+        same = pc.or_(pc.fill_null(pc.equal(written.column("file_hash"), current_hash), False),
+                      pc.and_(pc.is_null(written.column("file_hash")), pc.is_null(current_hash)))
+        written = latest_rows(written.filter(same))
+    positions = pc.index_in(current.column("doc_id"), value_set=written.column("doc_id").combine_chunks())
+    return written.column(column).take(positions)
+
+
+def merge_row(old, new):
+    """Apply a partial update to a stored row.
+
+    A new file hash invalidates the old text and summary; otherwise missing
+    fields keep their stored values and the status never moves backwards.
+    """
+    row = dict(old) if old else {field: None for field in FIELDS}
+    if new.get("file_hash") and row.get("file_hash") and new["file_hash"] != row["file_hash"]:
+        row.update(text=None, summary=None, status=None)
+    status = row.get("status")
+    row.update({field: value for field, value in new.items() if value is not None})
+    if status and STATUS_RANK.get(status, -1) > STATUS_RANK.get(row["status"], -1):
+        row["status"] = status
+    row["updated_at"] = time.time()
+    return row
+
+
+class CorpusStore:
+    """Columnar record of every judgment keyed by doc ID, partitioned by court and year.
+
+    Each {court}/{year} partition is a series of Arrow IPC part files that are
+    memory-mapped on read, so a scan only touches the pages of the columns it
+    uses. Updates append a new part holding the rows they change; the last row
+    written for a doc ID wins, except that text and summary are only written
+    when they change and are read from the last row that set them. flush()
+    compacts partitions that have collected MAX_PARTS parts.
+
+    Writers in any process hold an exclusive flock on the partition's lock
+    file from reading the stored rows until their part is in place, and
+    readers hold a shared one, so parts are never overwritten or deleted
+    under a reader.
+    """
+
+    def __init__(self, root=CORPUS_DIR, flush_rows=FLUSH_ROWS):
+        self.root = root
+        self.flush_rows = flush_rows
+        self.pending = {}
+        self.pending_rows = 0
+
+    def partition_dir(self, court, year):
+        return os.path.join(self.root, quote(court, safe=""), str(year))
+
+    def partitions(self, court=None, start_year=None, end_year=None):
+        """Return the (court, year) partitions on disk, optionally restricted to a court and year range."""
+        if not os.path.isdir(self.root):
+            return []
+        courts = [quote(court, safe="")] if court else sorted(os.listdir(self.root))
+        found = []
+        for court_dir in courts:
+            path = os.path.join(self.root, court_dir)
+            if not os.path.isdir(path):
+                continue
+            for name in sorted(os.listdir(path)):
+                if name.isdigit() and (start_year is None or int(name) >= start_year) \
+                        and (end_year is None or int(name) <= end_year):
+                    found.append((unquote(court_dir), int(name)))
+        return found
+
+    def parts(self, court, year):
+        directory = self.partition_dir(court, year)
+        if not os.path.isdir(directory):
+            return []
+        return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(".arrow")]
+
+    @contextmanager
+    def partition_lock(self, court, year, exclusive=True):
+        """Hold a flock on a partition across processes; a shared lock on a missing partition is a no-op."""
+        directory = self.partition_dir(court, year)
+        if not exclusive and not os.path.isdir(directory):
+            yield
+            return
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, LOCK_NAME), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def read_partition(self, court, year, columns=None):
+        """Return the current rows of one partition, reading only the requested columns."""
+        with self.partition_lock(court, year, exclusive=False):
+            return self._read_partition(court, year, columns)
+
+    def _read_partition(self, court, year, columns=None):
+        names = FIELDS if columns is None else ["doc_id"] + [c for c in columns if c != "doc_id"]
+        large = [c for c in names if c in LARGE_FIELDS]
+        read = list(dict.fromkeys(names + (["file_hash"] if large else [])))
+        tables = []
+        for path in self.parts(court, year):
+            with pa.memory_map(path) as source:
+                tables.append(pa.ipc.open_file(source).read_all().select(read))
+        if not tables:
+            return SCHEMA.empty_table().select(names)
+        table = pa.concat_tables(tables)
+        current = latest_rows(table.select([c for c in read if c not in LARGE_FIELDS]))
+        for column in large:
+            current = current.append_column(column, written_values(table, current, column))
+        return current.select(names)
+
+    def scan(self, court=None, start_year=None, end_year=None, columns=None, status=None):
+        """Return the current rows of every matching partition as one table."""
+        names = FIELDS if columns is None else ["doc_id"] + [c for c in columns if c != "doc_id"]
+        read = names if status is None or "status" in names else names + ["status"]
+        tables = [self.read_partition(c, y, read) for c, y in self.partitions(court, start_year, end_year)]
+        table = pa.concat_tables(tables) if tables else SCHEMA.empty_table().select(read)
+        if status is not None:
+            table = table.filter(pc.equal(table.column("status"), status))
+        return table.select(names)
+
+    def missing_summaries(self, court=None, start_year=None, end_year=None):
+        """Return (doc_id, court, year, pdf_path) of every document that has no summary yet."""
+        table = self.scan(court, start_year, end_year, ["court", "year", "pdf_path", "summary"])
+        return table.filter(pc.is_null(table.column("summary"))).select(["doc_id", "court", "year", "pdf_path"])
+
+    def summaries(self, court=None, start_year=None, end_year=None):
+        """Return (doc_id, pdf_path, summary) of every summarized document."""
+        table = self.scan(court, start_year, end_year, ["pdf_path", "summary"])
+        return table.filter(pc.is_valid(table.column("summary")))
+
+    def summarized_doc_ids(self, court, year):
+        table = self.read_partition(court, year, ["summary"])
+        return set(table.filter(pc.is_valid(table.column("summary"))).column("doc_id").to_pylist())
+
+    def status_counts(self, court=None, start_year=None, end_year=None):
+        table = self.scan(court, start_year, end_year, ["court", "year", "status"])
+        return table.group_by(["court", "year", "status"]).aggregate([("doc_id", "count")]) \
+            .sort_by([("court", "ascending"), ("year", "ascending"), ("status", "ascending")])
+
+    def update(self, court, year, doc_id, **fields):
+        """Buffer a partial update of one document; it is written on the next flush()."""
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown corpus columns: {sorted(unknown)}")
+        rows = self.pending.setdefault((court, int(year)), {})
+        if doc_id not in rows:
+            self.pending_rows += 1
+        # Same rules as flush(): the status never moves backwards and a new file hash drops buffered text
+        row = merge_row(rows.get(doc_id), fields)
+        rows[doc_id] = {field: value for field, value in row.items() if value is not None and field != "updated_at"}
+        if self.pending_rows >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        """Write every buffered update as one appended part per partition."""
+        for (court, year), updates in self.pending.items():
+            with self.partition_lock(court, year):
+                self._flush_partition(court, year, updates)
+        self.pending.clear()
+        self.pending_rows = 0
+
+    def _flush_partition(self, court, year, updates):
+        doc_ids = pa.array(list(updates), pa.string())
+        current = self._read_partition(court, year, [f for f in FIELDS if f not in LARGE_FIELDS])
+        stored = {row["doc_id"]: row for row in current.filter(pc.is_in(current.column("doc_id"), doc_ids)).to_pylist()}
+        # Text and summary written before the file had a hash are carried over, stamped with the hash it now gets
+        restamp = [doc_id for doc_id, fields in updates.items()
+                   if fields.get("file_hash") and doc_id in stored and stored[doc_id]["file_hash"] is None]
+        carried = {}
+        if restamp:
+            large = self._read_partition(court, year, LARGE_FIELDS)
+            large = large.filter(pc.is_in(large.column("doc_id"), pa.array(restamp, pa.string())))
+            carried = {row["doc_id"]: row for row in large.to_pylist()}
+        rows = []
+        for doc_id, fields in updates.items():
+            row = merge_row({**stored.get(doc_id, {}), **carried.get(doc_id, {})} or None,
+                            {**fields, "doc_id": doc_id, "court": court, "year": year})
+            if doc_id not in carried:
+                row.update({field: fields.get(field) for field in LARGE_FIELDS})
+            rows.append(row)
+        self.append_part(court, year, pa.Table.from_pylist(rows, schema=SCHEMA))
+        if len(self.parts(court, year)) >= MAX_PARTS:
+            self._compact_partition(court, year)
+
+    def append_part(self, court, year, table):
+        """Write a table as the partition's next part; the caller holds the partition's exclusive lock."""
+        directory = self.partition_dir(court, year)
+        os.makedirs(directory, exist_ok=True)
+        existing = self.parts(court, year)
+        number = int(os.path.basename(existing[-1])[5:11]) + 1 if existing else 0
+        path = os.path.join(directory, f"part-{number:06d}.arrow")
+        tmp_path = path + ".tmp"
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, SCHEMA) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, path)
+        return path
+
+    def compact_partition(self, court, year):
+        """Rewrite a partition's parts as a single part holding only the current rows."""
+        with self.partition_lock(court, year):
+            self._compact_partition(court, year)
+
+    def _compact_partition(self, court, year):
+        old_parts = self.parts(court, year)
+        if len(old_parts) <= 1:
+            return
+        # The compacted part is numbered after the old ones, so it wins even if the deletes are interrupted
+        self.append_part(court, year, self._read_partition(court, year))
+        for path in old_parts:
+            os.unlink(path)
+
+    def compact(self, court=None, start_year=None, end_year=None):
+        for partition in self.partitions(court, start_year, end_year):
+            self.compact_partition(*partition)
+
+    def export_parquet(self, path, court=None, start_year=None, end_year=None, columns=None):
+        """Write the current rows to a single Parquet file for use outside the pipeline."""
+        import pyarrow.parquet as pq
+        pq.write_table(self.scan(court, start_year, end_year, columns), path, compression="zstd")
+
+    def close(self):
+        self.flush()
+
+
+def import_court(store, court_name, start_year=None, end_year=None, with_text=False):
+    """Backfill a court's partitions from the link lists, download manifest, text cache and summary files."""
+    from corpus import load_doc_ids, doc_id_for, load_summary
+    from pdf_text import COURT_DIR, TextCache, list_pdfs
+
+    links_dir = os.path.join(LINKS_DIR, court_name)
+    if os.path.isdir(links_dir):
+        for filename in sorted(os.listdir(links_dir)):
+            year = filename.split(".")[0]
+            if not filename.endswith(".json") or not year.isdigit() \
+                    or (start_year and int(year) < start_year) or (end_year and int(year) > end_year):
+                continue
+            with open(os.path.join(links_dir, filename)) as f:
+                for url in json.load(f):
+                    match = DOC_URL_RE.search(url)
+                    store.update(court_name, year, match.group(1) if match else url, url=url, status="listed")
+
+    manifest = {}
+    manifest_path = os.path.join(COURT_DIR, court_name, "manifest.db")
+    if os.path.exists(manifest_path):
+        import sqlite3
+        conn = sqlite3.connect(manifest_path)
+        manifest = {path: sha256 for path, sha256 in conn.execute("SELECT path, sha256 FROM documents")}
+        conn.close()
+
+    doc_ids = load_doc_ids(court_name)
+    cache = TextCache() if with_text else None
+    court_dir = os.path.join(COURT_DIR, court_name)
+    years = sorted(int(name) for name in os.listdir(court_dir) if name.isdigit()) if os.path.isdir(court_dir) else []
+    for year in years:
+        if (start_year and year < start_year) or (end_year and year > end_year):
+            continue
+        for pdf_path in list_pdfs(os.path.join(court_dir, str(year))):
+            filename = os.path.basename(pdf_path)
+            summary = load_summary(court_name, year, filename)
+            text = cache.get(pdf_path) if cache is not None else None
+            status = "summarized" if summary is not None else "extracted" if text is not None else "downloaded"
+            store.update(court_name, year, doc_id_for(doc_ids, year, pdf_path), pdf_path=pdf_path,
+                         file_hash=manifest.get(pdf_path) or file_sha256(pdf_path), text=text, summary=summary,
+                         status=status)
+        print(f"Imported {court_name} ({year})")
+    store.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Inspect and maintain the columnar corpus store.')
+    parser.add_argument('--store-dir', type=str, default=CORPUS_DIR, help='Root directory of the corpus store')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in [("import", "Backfill from links, PDFs, the text cache and summary files"),
+                            ("status", "Count documents per court, year and status"),
+                            ("missing", "List documents without a summary"),
+                            ("compact", "Merge each partition's parts into one"),
+                            ("export", "Write the current rows to a Parquet file")]:
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument('--court-name', type=str, required=name == "import", default=None,
+                               help='Name of the court')
+        subparser.add_argument('--start-year', type=int, default=None, help='First year')
+        subparser.add_argument('--end-year', type=int, default=None, help='Last year')
+        if name == "import":
+            subparser.add_argument('--with-text', action='store_true', help='Also copy cached extracted text')
+        if name == "export":
+            subparser.add_argument('--output', type=str, required=True, help='Parquet file to write')
+    args = parser.parse_args()
+
+    store = CorpusStore(args.store_dir)
+    if args.command == "import":
+        import_court(store, args.court_name, args.start_year, args.end_year, args.with_text)
+    elif args.command == "status":
+        for row in store.status_counts(args.court_name, args.start_year, args.end_year).to_pylist():
+            print(f"{row['court']} ({row['year']}) {row['status']}: {row['doc_id_count']}")
+    elif args.command == "missing":
+        for row in store.missing_summaries(args.court_name, args.start_year, args.end_year).to_pylist():
+            print(f"{row['court']} ({row['year']}) {row['doc_id']} {row['pdf_path'] or ''}")
+    elif args.command == "compact":
+        store.compact(args.court_name, args.start_year, args.end_year)
+    else:
+        store.export_parquet(args.output, args.court_name, args.start_year, args.end_year)
+        print(f"Exported to {args.output}")
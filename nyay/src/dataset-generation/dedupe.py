@@ -0,0 +1,223 @@
+import os
+import re
+import zlib
+import hashlib
+import sqlite3
+import argparse
+import numpy as np
+from corpus import load_doc_ids, doc_id_for, load_summary
+from pdf_text import COURT_DIR, extract_texts, file_signature, list_pdfs
+
+DEDUPE_DB = "../data/dedupe.db"
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+# 16 bands of 8 rows make documents above ~0.7 Jaccard similarity likely to share a band
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# Estimated Jaccard similarity above which a candidate counts as a duplicate
+THRESHOLD = 0.8
+SEED = 1
+SHINGLE_BASE = 1000003
+# Shingles hashed per block, bounding the (NUM_PERM x block) intermediate array
+HASH_BLOCK = 8192
+WORD_RE = re.compile(r"\w+")
+
+_rng = np.random.default_rng(SEED)
+PERM_A = _rng.integers(1, 2 ** 63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+PERM_B = _rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+
+
+def shingle_hashes(text, size=SHINGLE_SIZE):
+    """Return the distinct 64-bit hashes of the word size-grams of a text."""
+    words = WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return np.zeros(0, dtype=np.uint64)
+    word_hashes = np.fromiter((zlib.crc32(word.encode("utf-8")) for word in words), dtype=np.uint64,
+                              count=len(words))
+    count = len(words) - size + 1
+    shingles = np.zeros(count, dtype=np.uint64)
+    # Polynomial rolling combination; uint64 arithmetic wraps around
+    for j in range(size):
+        shingles = shingles * np.uint64(SHINGLE_BASE) + word_hashes[j:j + count]
+    return np.unique(shingles)
+
+
+def minhash(shingles):
+    """NUM_PERM-value MinHash signature using multiply-shift hashing, vectorized over shingles."""
+    signature = np.full(NUM_PERM, np.iinfo(np.uint32).max, dtype=np.uint64)
+    for start in range(0, len(shingles), HASH_BLOCK):
+        block = shingles[start:start + HASH_BLOCK]
+        hashed = (PERM_A[:, None] * block[None, :] + PERM_B[:, None]) >> np.uint64(32)
+        np.minimum(signature, hashed.min(axis=1), out=signature)
+    return signature.astype(np.uint32)
+
+
+def band_keys(signature):
+    """One signed 64-bit key per LSH band."""
+    return [int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=8).digest(), "little", signed=True)
+            for band in signature.reshape(BANDS, ROWS)]
+
+
+class DedupeIndex:
+    """Persistent MinHash/LSH index marking every document canonical or a duplicate.
+
+    The first copy of a judgment to be classified is its canonical document.
+    Later copies whose estimated Jaccard similarity to an earlier document is
+    at least THRESHOLD point at that document's canonical doc ID, so their
+    summaries and index entries can be reused instead of recomputed.
+    """
+
+    def __init__(self, path=DEDUPE_DB, threshold=THRESHOLD):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.threshold = threshold
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "doc_id TEXT PRIMARY KEY, court TEXT NOT NULL, year INTEGER NOT NULL, pdf_path TEXT NOT NULL, "
+            "file_signature TEXT NOT NULL, signature BLOB, canonical_id TEXT NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS bands (band INTEGER NOT NULL, key INTEGER NOT NULL, "
+                          "doc_id TEXT NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS bands_key ON bands (band, key)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS bands_doc ON bands (doc_id)")
+        self.counts = {"canonical": 0, "duplicate": 0, "known": 0}
+
+    def close(self):
+        self.conn.close()
+
+    def classify(self, doc_id, court, year, pdf_path, text):
+        """Record a document and return its canonical doc ID (its own if it is canonical)."""
+        current = "{}:{}".format(*file_signature(pdf_path))
+        row = self.conn.execute("SELECT file_signature, canonical_id FROM documents WHERE doc_id = ?",
+                                (doc_id,)).fetchone()
+        if row is not None and row[0] == current:
+            self.counts["known"] += 1
+            return row[1]
+
+        shingles = shingle_hashes(text)
+        signature = minhash(shingles) if len(shingles) else None
+        canonical_id = doc_id
+        keys = []
+        if signature is not None:
+            keys = band_keys(signature)
+            match = self.best_match(doc_id, signature, keys)
+            if match is not None:
+                canonical_id = match
+
+        with self.conn:
+            self.conn.execute("DELETE FROM bands WHERE doc_id = ?", (doc_id,))
+            self.conn.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (doc_id, court, int(year), pdf_path, current,
+                               signature.tobytes() if signature is not None else None, canonical_id))
+            # Documents too short to shingle (e.g. scanned PDFs) stay canonical and out of the LSH tables
+            self.conn.executemany("INSERT INTO bands VALUES (?, ?, ?)",
+                                  [(band, key, doc_id) for band, key in enumerate(keys)])
+        self.counts["duplicate" if canonical_id != doc_id else "canonical"] += 1
+        return canonical_id
+
+    def best_match(self, doc_id, signature, keys):
+        """Return the canonical doc ID of the most similar earlier document above the threshold."""
+        candidates = set()
+        for band, key in enumerate(keys):
+            candidates.update(row[0] for row in self.conn.execute(
+                "SELECT doc_id FROM bands WHERE band = ? AND key = ?", (band, key)))
+        candidates.discard(doc_id)
+        best, best_similarity = None, self.threshold
+        for candidate_id in candidates:
+            blob, canonical_id = self.conn.execute(
+                "SELECT signature, canonical_id FROM documents WHERE doc_id = ?", (candidate_id,)).fetchone()
+            # A duplicate's canonical document may itself have been reclassified; never point at ourselves
+            if canonical_id == doc_id:
+                continue
+            similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = canonical_id, similarity
+        return best
+
+    def location(self, doc_id):
+        """Return (court, year, pdf_path) of a classified document, or None."""
+        return self.conn.execute("SELECT court, year, pdf_path FROM documents WHERE doc_id = ?",
+                                 (doc_id,)).fetchone()
+
+    def canonical_summary(self, canonical_id):
+        """Return the saved summary of a canonical document, or None if it has none yet."""
+        location = self.location(canonical_id)
+        if location is None:
+            return None
+        court, year, pdf_path = location
+        return load_summary(court, year, os.path.basename(pdf_path))
+
+    def print_stats(self):
+        print(f"Dedupe: {self.counts['canonical']} canonical, {self.counts['duplicate']} duplicates, "
+              f"{self.counts['known']} already classified")
+
+
+def split_duplicates(dedupe, court_name, year, texts, doc_ids):
+    """Classify a year's {pdf_path: text}.
+
+    Returns the canonical documents' texts and a (year, pdf_path, canonical_id)
+    tuple for every duplicate.
+    """
+    canonical, duplicates = {}, []
+    for pdf_path, text in texts.items():
+        doc_id = doc_id_for(doc_ids, year, pdf_path)
+        canonical_id = dedupe.classify(doc_id, court_name, year, pdf_path, text)
+        if canonical_id == doc_id:
+            canonical[pdf_path] = text
+        else:
+            duplicates.append((year, pdf_path, canonical_id))
+    return canonical, duplicates
+
+
+def reuse_canonical_summaries(dedupe, court_name, duplicates, save_summary, record=None):
+    """Save each duplicate's canonical summary under the duplicate's own file name.
+
+    record(year, pdf_path, summary) is called for every summary reused.
+    """
+    for year, pdf_path, canonical_id in duplicates:
+        filename = os.path.basename(pdf_path)
+        summary = dedupe.canonical_summary(canonical_id)
+        if summary is None:
+            print(f"Skipped {filename}: its canonical document {canonical_id} has no summary yet")
+            continue
+        save_summary(summary, court_name, year, filename.replace(".pdf", ""))
+        if record is not None:
+            record(year, pdf_path, summary)
+
+
+def classify_year_range(dedupe, court_name, start_year, end_year, workers=None):
+    """Classify every PDF of a court in a year range, printing the duplicates found."""
+    doc_ids = load_doc_ids(court_name)
+    for year in range(start_year, end_year + 1):
+        year_dir = os.path.join(COURT_DIR, court_name, str(year))
+        if not os.path.exists(year_dir):
+            continue
+        texts = extract_texts(list_pdfs(year_dir), workers)
+        for _, pdf_path, canonical_id in split_duplicates(dedupe, court_name, year, texts, doc_ids)[1]:
+            print(f"{court_name} ({year}) {os.path.basename(pdf_path)} duplicates {canonical_id}")
+
+
+def year_bounds(court_name):
+    years = [int(name) for name in os.listdir(os.path.join(COURT_DIR, court_name)) if name.isdigit()]
+    return (min(years), max(years)) if years else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Mark near-duplicate judgments across the Court_PDFs tree.')
+    parser.add_argument('--court-name', type=str, default=None, help='Only this court (default: every court)')
+    parser.add_argument('--start-year', type=int, default=None, help='First year to classify (default: all)')
+    parser.add_argument('--end-year', type=int, default=None, help='Last year to classify (default: all)')
+    parser.add_argument('--dedupe-db', type=str, default=DEDUPE_DB, help='SQLite file holding the LSH index')
+    parser.add_argument('--workers', type=int, default=None, help='Number of text extraction processes')
+    args = parser.parse_args()
+
+    dedupe = DedupeIndex(args.dedupe_db)
+    courts = [args.court_name] if args.court_name else sorted(
+        name for name in os.listdir(COURT_DIR) if os.path.isdir(os.path.join(COURT_DIR, name)))
+    for court in courts:
+        bounds = year_bounds(court)
+        if bounds is None:
+            continue
+        classify_year_range(dedupe, court, args.start_year or bounds[0], args.end_year or bounds[1], args.workers)
+    dedupe.print_stats()
+    dedupe.close()
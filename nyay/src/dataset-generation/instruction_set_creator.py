@@ -1,7 +1,27 @@
-from openai import OpenAI, OpenAIError
+import asyncio
+import argparse
+import hashlib
 import os
 import json
-import time
+from llm_client import LLMClient, MAX_CONCURRENCY, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE
+from response_cache import ResponseCache, LLM_CACHE_PATH
+from json_repair import ParseStats, parse_llm_json
+from corpus_store import CorpusStore, CORPUS_DIR
+
+# Directory containing summary files
+SUMMARY_DIR = "content/"
+TASKS_FILE = "Diverse_Instruction_Set_350.txt"
+OUTPUT_FILE = "output.json"
+LEDGER_FILE = "output.ledger.jsonl"
+MODEL = "gpt-4"
+# Number of tasks run against each summary
+TASK_LIMIT = 80
+# Records buffered before the output and ledger are flushed
+FLUSH_EVERY = 20
+# Tasks answered per request against the same summary (1 sends the original single-task prompt)
+TASKS_PER_REQUEST = 1
+# Requests a task may take part in before it is given up on
+MAX_ATTEMPTS = 3
 
 # Define the system message
 system_msg = """
@@ -50,88 +70,271 @@ def create_prompt(summary, task):
     """
     return template
 
-# Directory containing summary files
-summary_directory = "content/"
 
-# Load tasks from tasks.txt file
-with open("Diverse_Instruction_Set_350.txt", "r") as f:
-    tasks = f.readlines()
+# Prompt asking for several tasks against one summary in a single request
+def create_batch_prompt(summary, tasks):
+    task_list = "\n".join(f"    {task_id}. {task}" for task_id, task in enumerate(tasks, start=1))
+    template = f"""
+    I will Provide you with a court case from Indian law, Think like a lawyer:
+    I will give you {len(tasks)} tasks to perform on the case: Answers should be detailed and have important information,
+    {summary}
+
+    I am making a dataset for instruct tuning Large Language Model. For each task give me one answer object in this format : (Here is an example)
+        {{
+            "task_id": 1,
+            "instruction": "Discuss potential legal reforms suggested by the decision in the provided case.",
+            "input": "The case P.A. Inamdar & Ors vs State Of Maharashtra & Ors, Appeal (civil) 5041 of 2005, Supreme Court of India",
+            "output": "The decision in the P.A. Inamdar case highlights a few key areas that could benefit from legal reform. One area is the precise definition and criteria of 'minorities' in the context of Article 30 of the Constitution, which can create a more clear-cut approach towards minority rights. Secondly, the government might need to formulate clear, transparent, and fair regulations concerning admission processes in both minority and non-minority institutions to avoid disparities and ensure quality education for all."
+        }}
+
+    Make sure you fill all the fields / the instruction/input/output should be high quality and very detailed
+    "task_id" is the number of the task the object answers, "instruction" is Mandatory, "input" is Optional, "output" is Mandatory.
+    Return a JSON array containing exactly {len(tasks)} objects, one per task, in task order. All keys should have one line.
+    Only Return JSON OUTPUT
+    Tasks:-
+{task_list}
+    """
+    return template
+
+
+def load_tasks(path=TASKS_FILE):
+    """Load tasks from the tasks file, one per line."""
+    with open(path, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def tasks_for_summary(summary_name, tasks, task_limit=TASK_LIMIT):
+    """Return the task slice for a summary.
+
+    Each summary starts at an offset derived from its file name, so different
+    summaries cover different tasks, and a summary always gets the same slice
+    regardless of run order or earlier failures.
+    """
+    if task_limit >= len(tasks):
+        return list(tasks)
+    start = int(hashlib.sha1(summary_name.encode("utf-8")).hexdigest(), 16) % len(tasks)
+    return [tasks[(start + i) % len(tasks)] for i in range(task_limit)]
+
+
+def pair_key(summary_name, task):
+    return hashlib.sha1(f"{summary_name}\n{task}".encode("utf-8")).hexdigest()
+
+
+def load_ledger(path=LEDGER_FILE):
+    """Return the keys of (summary, task) pairs already written to the output."""
+    done = set()
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    done.add(json.loads(line)["key"])
+    return done
+
+
+def read_summary_dir(summary_dir):
+    """Yield (file name, summary) for every summary file in a directory."""
+    for summary_filename in sorted(os.listdir(summary_dir)):
+        with open(os.path.join(summary_dir, summary_filename), 'r') as f:
+            yield summary_filename, f.read()
 
-# Initialize a counter for processed tasks
-processed_tasks = 0
 
-# Set the limit for the number of tasks
-task_limit = 80
+def read_store_summaries(court_name=None, start_year=None, end_year=None, store_dir=CORPUS_DIR):
+    """Yield (summary file name, summary) for every summarized document in the corpus store.
 
-# Process summary files from the directory
-for summary_filename in os.listdir(summary_directory):
-    # Read the summary file
-    with open(os.path.join(summary_directory, summary_filename), 'r') as f:
-        summary = f.read()
+    Names match the files save_summary writes, so the ledger is shared with --summary-dir runs.
+    """
+    for row in CorpusStore(store_dir).summaries(court_name, start_year, end_year).to_pylist():
+        stem = os.path.splitext(os.path.basename(row["pdf_path"]))[0] if row["pdf_path"] else row["doc_id"]
+        yield f"{stem}_summary.txt", row["summary"]
+
+
+def build_work_queue(summaries, tasks, task_limit=TASK_LIMIT, done=(), tasks_per_request=TASKS_PER_REQUEST):
+    """Return (summary name, summary, tasks) groups for every pair that has not been completed yet."""
+    work = []
+    for summary_filename, summary in summaries:
+        pending = [task for task in tasks_for_summary(summary_filename, tasks, task_limit)
+                   if pair_key(summary_filename, task) not in done]
+        for start in range(0, len(pending), tasks_per_request):
+            work.append((summary_filename, summary, pending[start:start + tasks_per_request]))
+    return work
+
+
+def is_valid_record(record):
+    """Check a record against the instruction/input/output schema."""
+    return (isinstance(record, dict)
+            and isinstance(record.get("instruction"), str) and record["instruction"].strip() != ""
+            and isinstance(record.get("input", ""), str)
+            and isinstance(record.get("output"), str) and record["output"].strip() != "")
+
+
+class CheckpointedWriter:
+    """Buffered JSONL writer that records each completed pair in a ledger after its record is written."""
+
+    def __init__(self, output_path=OUTPUT_FILE, ledger_path=LEDGER_FILE, flush_every=FLUSH_EVERY):
+        self.output = open(output_path, "a")
+        self.ledger = open(ledger_path, "a")
+        self.flush_every = flush_every
+        self.records = []
+        self.keys = []
+
+    def write(self, record, key):
+        self.records.append(record)
+        self.keys.append(key)
+        if len(self.records) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.records:
+            return
+        self.output.write("".join(json.dumps(record) + "\n" for record in self.records))
+        self.output.flush()
+        os.fsync(self.output.fileno())
+        # The ledger only advances once the records it vouches for are on disk
+        self.ledger.write("".join(json.dumps({"key": key}) + "\n" for key in self.keys))
+        self.ledger.flush()
+        self.records = []
+        self.keys = []
+
+    def close(self):
+        self.flush()
+        self.output.close()
+        self.ledger.close()
+
+
+async def process_group(client, writer, summary_name, summary, tasks, model=MODEL, use_cache=True, stats=None):
+    """Generate records for tasks against one summary and return the tasks that failed."""
+    stats = stats if stats is not None else ParseStats()
+    # Create the user message with the current summary and task(s)
+    user_msg = create_prompt(summary, tasks[0]) if len(tasks) == 1 else create_batch_prompt(summary, tasks)
+    content = await client.chat(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_msg},
+            {"role": "user", "content": user_msg}
+        ],
+        use_cache=use_cache)
+
+    # Extract the JSON objects, repairing fences, prose, trailing commas and raw newlines
+    parsed = parse_llm_json(content, stats)
+    if not parsed:
+        print(f"Failed to decode JSON for {len(tasks)} task(s) of {summary_name}")
+        return list(tasks)
 
-    # Process tasks for each summary file
-    for task in tasks[processed_tasks:processed_tasks+task_limit]:
-        # Create the user message with the current summary and task
-        user_msg = create_prompt(summary, task.strip())
+    records = {}
+    for position, record in enumerate(parsed, start=1):
+        task_id = record.pop("task_id", position)
+        records.setdefault(int(task_id) if str(task_id).isdigit() else position, record)
 
-        # Maximum number of retries
-        max_retries = 5
-        # Initial delay in seconds
-        delay = 1
+    failed = []
+    for task_id, task in enumerate(tasks, start=1):
+        record = records.get(task_id)
+        if is_valid_record(record):
+            writer.write(record, pair_key(summary_name, task))
+        else:
+            stats.counts["invalid_records"] += 1
+            failed.append(task)
+    return failed
 
-        for i in range(max_retries):
+
+async def generate_instruction_set_async(summary_dir=SUMMARY_DIR, tasks_file=TASKS_FILE, output_path=OUTPUT_FILE,
+                                         ledger_path=LEDGER_FILE, model=MODEL, task_limit=TASK_LIMIT,
+                                         workers=MAX_CONCURRENCY, base_url=None, cache_path=LLM_CACHE_PATH,
+                                         requests_per_minute=REQUESTS_PER_MINUTE,
+                                         tokens_per_minute=TOKENS_PER_MINUTE,
+                                         tasks_per_request=TASKS_PER_REQUEST, summaries=None):
+    """Run every missing (summary, task) pair through a pool of async workers.
+
+    summaries, an iterable of (name, summary), replaces the files of summary_dir.
+    """
+    tasks = load_tasks(tasks_file)
+    summaries = summaries if summaries is not None else read_summary_dir(summary_dir)
+    work = build_work_queue(summaries, tasks, task_limit, load_ledger(ledger_path), tasks_per_request)
+    total = sum(len(group) for _, _, group in work)
+    print(f"{total} (summary, task) pairs to process in {len(work)} requests")
+
+    queue = asyncio.Queue()
+    for summary_name, summary, group in work:
+        queue.put_nowait((summary_name, summary, group, 1))
+
+    cache = ResponseCache(cache_path) if cache_path else None
+    client = LLMClient(base_url=base_url, max_concurrency=workers, requests_per_minute=requests_per_minute,
+                       tokens_per_minute=tokens_per_minute, cache=cache)
+    writer = CheckpointedWriter(output_path, ledger_path)
+    progress = {"processed": 0, "failed": 0}
+    stats = ParseStats()
+
+    async def worker():
+        while True:
+            try:
+                summary_name, summary, group, attempt = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
             try:
-                # Generate the content with OpenAI API
-                openai_api_key = ''
-                client = OpenAI(api_key=openai_api_key)
-
-                response = client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": system_msg},
-                        {"role": "user", "content": user_msg}
-                        ])
-                # response = openai.ChatCompletion.create(
-                #     model="gpt-3.5-turbo",
-                #     temperature=0,
-                #     messages=[
-                #         {"role": "system", "content": system_msg},
-                #         {"role": "user", "content": user_msg}
-                #     ]
-                # )
-                # If the API call was successful, break out of the loop
-                break
-            except OpenAIError as e:
-                if 'rate_limit_exceeded' in str(e):
-                    print(f"Rate limit exceeded. Waiting for {delay} seconds before retrying...")
-                    time.sleep(delay)
-                    delay *= 2
-                    continue
-                else:
-                    raise
-
-        # Extract the content
-        content = response.choices[0].message.content
-        # Replace newline characters with spaces
-        content = content.replace("\n", " ")
-        # Print the output
-        print(f"Output: {content}")
-
-        # Convert the content to a JSON object
-        try:
-            data = json.loads(content)
-        except json.JSONDecodeError:
-            print(f"Failed to decode JSON for task: {task}")
-            continue
-
-        with open('output.json', 'a') as f:
-            json.dump(data, f)
-            # Add a newline after each JSON object
-            f.write('\n')
-
-        processed_tasks += 1
-        # Print the progress
-        print(f"Processed tasks: {processed_tasks}/{task_limit}")
-
-print("Output written successfully to output.json file.")
-print("Initiating file download...")
+                # A retried group must not be answered from the cache with the same bad response
+                failed = await process_group(client, writer, summary_name, summary, group, model,
+                                             use_cache=attempt == 1, stats=stats)
+            except Exception as e:
+                print(f"Request failed for {len(group)} task(s) of {summary_name}: {e}")
+                failed = list(group)
+            progress["processed"] += len(group) - len(failed)
+            if failed and attempt < MAX_ATTEMPTS:
+                # Only the tasks that failed go back on the queue
+                queue.put_nowait((summary_name, summary, failed, attempt + 1))
+            else:
+                progress["failed"] += len(failed)
+            # Print the progress
+            print(f"Processed tasks: {progress['processed']}/{total} ({progress['failed']} failed)")
+
+    try:
+        await asyncio.gather(*[worker() for _ in range(workers)])
+    finally:
+        writer.close()
+        await client.close()
+        client.print_usage()
+        stats.print_stats()
+        if cache is not None:
+            cache.close()
+    print(f"Output written successfully to {output_path} file.")
+    return progress
+
+
+def generate_instruction_set(summary_dir=SUMMARY_DIR, tasks_file=TASKS_FILE, output_path=OUTPUT_FILE,
+                             ledger_path=LEDGER_FILE, model=MODEL, task_limit=TASK_LIMIT, workers=MAX_CONCURRENCY,
+                             base_url=None, cache_path=LLM_CACHE_PATH, requests_per_minute=REQUESTS_PER_MINUTE,
+                             tokens_per_minute=TOKENS_PER_MINUTE, tasks_per_request=TASKS_PER_REQUEST,
+                             summaries=None):
+    return asyncio.run(generate_instruction_set_async(summary_dir, tasks_file, output_path, ledger_path, model,
+                                                      task_limit, workers, base_url, cache_path,
+                                                      requests_per_minute, tokens_per_minute, tasks_per_request,
+                                                      summaries))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate an instruction-tuning dataset from case summaries.')
+    parser.add_argument('--summary-dir', type=str, default=SUMMARY_DIR, help='Directory containing summary files')
+    parser.add_argument('--from-store', action='store_true',
+                        help='Read the summaries from the corpus store instead of --summary-dir')
+    parser.add_argument('--court-name', type=str, default=None, help='With --from-store, only this court')
+    parser.add_argument('--start-year', type=int, default=None, help='With --from-store, the first year')
+    parser.add_argument('--end-year', type=int, default=None, help='With --from-store, the last year')
+    parser.add_argument('--tasks-file', type=str, default=TASKS_FILE, help='File with one task per line')
+    parser.add_argument('--output', type=str, default=OUTPUT_FILE, help='JSONL file the records are appended to')
+    parser.add_argument('--ledger', type=str, default=LEDGER_FILE, help='Checkpoint ledger of completed pairs')
+    parser.add_argument('--model', type=str, default=MODEL, help='OpenAI chat model to use')
+    parser.add_argument('--task-limit', type=int, default=TASK_LIMIT, help='Number of tasks per summary')
+    parser.add_argument('--tasks-per-request', type=int, default=TASKS_PER_REQUEST,
+                        help='Tasks answered per request as a JSON array (1 keeps the single-task prompt)')
+    parser.add_argument('--workers', type=int, default=MAX_CONCURRENCY, help='Number of concurrent requests')
+    parser.add_argument('--base-url', type=str, default=None,
+                        help='OpenAI-compatible API endpoint (e.g. a local mock server)')
+    parser.add_argument('--rpm', type=int, default=REQUESTS_PER_MINUTE, help='Requests per minute budget')
+    parser.add_argument('--tpm', type=int, default=TOKENS_PER_MINUTE, help='Tokens per minute budget')
+    parser.add_argument('--cache-path', type=str, default=LLM_CACHE_PATH, help='SQLite file caching API responses')
+    parser.add_argument('--no-cache', action='store_true', help='Always call the API, bypassing the response cache')
+    args = parser.parse_args()
+
+    summaries = read_store_summaries(args.court_name, args.start_year, args.end_year) if args.from_store else None
+    generate_instruction_set(args.summary_dir, args.tasks_file, args.output, args.ledger, args.model,
+                             args.task_limit, args.workers, args.base_url,
+                             None if args.no_cache else args.cache_path, args.rpm, args.tpm,
+                             args.tasks_per_request, summaries)
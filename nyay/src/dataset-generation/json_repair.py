@@ -0,0 +1,131 @@
+import json
+import re
+from collections import Counter
+
+FENCE_RE = re.compile(r"```[A-Za-z]*\s*(.*?)```", re.DOTALL)
+STRING_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+class ParseStats:
+    """Counts how LLM responses fared in the JSON repair stage."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.fixes = Counter()
+
+    def print_stats(self):
+        responses = self.counts["responses"]
+        failed = self.counts["failed"]
+        failure_rate = failed / responses if responses else 0.0
+        print(f"JSON parsing: {responses} responses, {self.counts['clean']} clean, "
+              f"{self.counts['repaired']} repaired, {failed} unparseable ({failure_rate:.1%}), "
+              f"{self.counts['invalid_records']} records failed schema validation")
+        if self.fixes:
+            print("Repairs applied: " + ", ".join(f"{fix} x{count}" for fix, count in self.fixes.most_common()))
+
+
+def strip_fences(text):
+    """Return the contents of ``` fenced blocks, or the text unchanged if there are none."""
+    blocks = FENCE_RE.findall(text)
+    return "\n".join(blocks) if blocks else text
+
+
+def sanitize(text):
+    """Escape raw control characters inside strings and drop trailing commas outside them.
+
+    Returns the cleaned text and the set of fixes that were applied.
+    """
+    out = []
+    fixes = set()
+    in_string = False
+    escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            elif ch in STRING_ESCAPES:
+                out.append(STRING_ESCAPES[ch])
+                fixes.add("control_characters")
+                continue
+        elif ch == '"':
+            in_string = True
+        elif ch in "}]":
+            j = len(out) - 1
+            while j >= 0 and out[j].isspace():
+                j -= 1
+            if j >= 0 and out[j] == ",":
+                del out[j]
+                fixes.add("trailing_commas")
+        out.append(ch)
+    return "".join(out), fixes
+
+
+def iter_json_values(text):
+    """Yield every top-level JSON object or array embedded in text, skipping surrounding prose."""
+    decoder = json.JSONDecoder()
+    pos = 0
+    while True:
+        starts = [i for i in (text.find("{", pos), text.find("[", pos)) if i != -1]
+        if not starts:
+            return
+        start = min(starts)
+        try:
+            value, end = decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            # Not JSON here (e.g. "[Type of Case]" in prose); an enclosing array may still hold valid objects
+            pos = start + 1
+            continue
+        yield value
+        pos = end
+
+
+def flatten_records(values):
+    records = []
+    for value in values:
+        if isinstance(value, dict):
+            records.append(value)
+        elif isinstance(value, list):
+            records.extend(item for item in value if isinstance(item, dict))
+    return records
+
+
+def parse_llm_json(text, stats=None):
+    """Parse the JSON objects out of an LLM response, repairing common defects.
+
+    Handles fenced code blocks, wrapping prose, trailing commas, raw newlines
+    inside strings, several concatenated objects and arrays of objects.
+    Returns a (possibly empty) list of dicts.
+    """
+    stats = stats if stats is not None else ParseStats()
+    stats.counts["responses"] += 1
+    try:
+        records = flatten_records([json.loads(text)])
+        if records:
+            stats.counts["clean"] += 1
+            return records
+    except json.JSONDecodeError:
+        pass
+
+    fixes = set()
+    unfenced = strip_fences(text)
+    if unfenced is not text:
+        fixes.add("code_fence")
+    cleaned, sanitize_fixes = sanitize(unfenced)
+    fixes |= sanitize_fixes
+    values = list(iter_json_values(cleaned))
+    if len(values) > 1:
+        fixes.add("multiple_values")
+    if values and cleaned.strip()[:1] not in "{[":
+        fixes.add("surrounding_text")
+    records = flatten_records(values)
+
+    if not records:
+        stats.counts["failed"] += 1
+        return []
+    stats.counts["repaired"] += 1
+    stats.fixes.update(fixes)
+    return records
@@ -0,0 +1,196 @@
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, RateLimitError
+import asyncio
+import os
+import random
+import re
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from response_cache import ResponseCache
+
+MAX_CONCURRENCY = 8
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 30000
+MAX_RETRIES = 6
+# Completion tokens reserved against the tokens/min budget before a response arrives
+EXPECTED_COMPLETION_TOKENS = 1500
+
+
+def parse_reset(value):
+    """Parse a rate-limit reset header such as '1s', '6m0s' or '20ms' into seconds."""
+    if not value:
+        return 0.0
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header given as seconds or an HTTP-date into seconds, or None if it is neither."""
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class MinuteBudget:
+    """Token bucket refilled continuously up to a per-minute limit."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.available = float(per_minute)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` can be spent (0 if it can be spent now)."""
+        self.refill()
+        blocked = max(0.0, self.blocked_until - time.monotonic())
+        # Requests larger than the whole budget only need a full bucket
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return blocked
+        return max(blocked, (amount - self.available) / self.rate)
+
+    def spend(self, amount):
+        self.refill()
+        self.available -= amount
+
+    def sync(self, remaining, reset_after):
+        """Clamp the local budget to what the server reports is left."""
+        self.refill()
+        self.available = min(self.available, float(remaining))
+        if remaining <= 0:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + reset_after)
+
+
+class RateLimitScheduler:
+    """Admits requests against requests/min and tokens/min budgets, following the server's rate-limit headers."""
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        self.requests = MinuteBudget(requests_per_minute)
+        self.tokens = MinuteBudget(tokens_per_minute)
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens):
+        async with self.lock:
+            while True:
+                delay = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if delay <= 0:
+                    self.requests.spend(1)
+                    self.tokens.spend(tokens)
+                    return
+                await asyncio.sleep(delay)
+
+    def settle(self, reserved, used):
+        """Charge the difference between the tokens reserved and those actually used."""
+        self.tokens.spend(used - reserved)
+
+    def update(self, headers):
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        if remaining_requests is not None:
+            self.requests.sync(int(remaining_requests), parse_reset(headers.get("x-ratelimit-reset-requests")))
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_tokens is not None:
+            self.tokens.sync(int(remaining_tokens), parse_reset(headers.get("x-ratelimit-reset-tokens")))
+
+    def backoff(self, seconds):
+        """Pause every request after a 429."""
+        until = time.monotonic() + seconds
+        self.requests.blocked_until = max(self.requests.blocked_until, until)
+
+
+class LLMClient:
+    """One shared AsyncOpenAI client with bounded concurrency, rate-limit scheduling and jittered retries."""
+
+    def __init__(self, base_url=None, api_key=None, max_concurrency=MAX_CONCURRENCY,
+                 requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 max_retries=MAX_RETRIES, cache=None):
+        self.cache = cache
+        # Part of the cache key, so a mock or self-hosted server never shares cached answers with the real API
+        self.base_url = base_url or os.environ.get("OPENAI_BASE_URL")
+        self.client = AsyncOpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY"), base_url=base_url,
+                                  max_retries=0)
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.scheduler = RateLimitScheduler(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.usage = {"requests": 0, "retries": 0, "estimated_prompt_tokens": 0,
+                      "prompt_tokens": 0, "completion_tokens": 0}
+
+    async def close(self):
+        await self.client.close()
+
+    async def chat(self, messages, model, estimated_prompt_tokens=0,
+                   expected_completion_tokens=EXPECTED_COMPLETION_TOKENS, use_cache=True, **kwargs):
+        """Send one chat completion request and return the message content.
+
+        With use_cache=False the cached response is ignored but replaced by the new one.
+        """
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ResponseCache.key(model, messages, self.base_url, **kwargs)
+            cached = self.cache.get(cache_key) if use_cache else None
+            if cached is not None:
+                return cached
+
+        reserved = estimated_prompt_tokens + expected_completion_tokens
+        self.usage["estimated_prompt_tokens"] += estimated_prompt_tokens
+        for attempt in range(self.max_retries + 1):
+            await self.scheduler.acquire(reserved)
+            try:
+                async with self.semaphore:
+                    raw = await self.client.chat.completions.with_raw_response.create(
+                        model=model, messages=messages, **kwargs)
+            except (RateLimitError, APIConnectionError, APIStatusError) as e:
+                self.scheduler.settle(reserved, 0)
+                status = getattr(e, "status_code", None)
+                if attempt == self.max_retries or (status is not None and status != 429 and status < 500):
+                    raise
+                # Exponential backoff with full jitter, or the server's own retry-after hint
+                delay = random.uniform(0, min(60, 2 ** attempt))
+                response = getattr(e, "response", None)
+                if response is not None:
+                    self.scheduler.update(response.headers)
+                    retry_after = parse_retry_after(response.headers.get("retry-after") or "")
+                    if retry_after is not None:
+                        delay = retry_after + random.uniform(0, 1)
+                if status == 429:
+                    self.scheduler.backoff(delay)
+                self.usage["retries"] += 1
+                print(f"Request failed ({e.__class__.__name__}). Retrying in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+                continue
+
+            self.scheduler.update(raw.headers)
+            response = raw.parse()
+            self.usage["requests"] += 1
+            if response.usage is not None:
+                self.usage["prompt_tokens"] += response.usage.prompt_tokens
+                self.usage["completion_tokens"] += response.usage.completion_tokens
+                self.scheduler.settle(reserved, response.usage.total_tokens)
+            content = response.choices[0].message.content
+            if cache_key is not None and content is not None:
+                self.cache.put(cache_key, content)
+            return content
+
+    def print_usage(self):
+        print(f"Requests: {self.usage['requests']} ({self.usage['retries']} retries), "
+              f"estimated prompt tokens: {self.usage['estimated_prompt_tokens']}, "
+              f"billed prompt tokens: {self.usage['prompt_tokens']}, "
+              f"completion tokens: {self.usage['completion_tokens']}")
+        if self.cache is not None:
+            self.cache.print_stats()
@@ -0,0 +1,171 @@
+import fitz
+import json
+import os
+import argparse
+import zstandard
+from concurrent.futures import ProcessPoolExecutor
+
+COURT_DIR = "../data/Court_PDFs"
+TEXT_CACHE_DIR = "../data/Extracted_Text"
+
+
+def extract_text_from_pdf(file_path):
+    """Extract text from a PDF file."""
+    with fitz.open(file_path) as doc:
+        return "".join(page.get_text() for page in doc)
+
+
+def is_pdf(filename):
+    return filename.endswith(".pdf") or filename.endswith(".PDF")
+
+
+def file_signature(file_path):
+    """Return the (mtime, size) pair a cached text is valid for."""
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def shard_path(pdf_path, cache_dir=TEXT_CACHE_DIR):
+    """Map ../data/Court_PDFs/{court}/{year}/x.pdf to {cache_dir}/{court}/{year}.jsonl.zst."""
+    year_dir = os.path.dirname(os.path.abspath(pdf_path))
+    court = os.path.basename(os.path.dirname(year_dir))
+    return os.path.join(cache_dir, court, os.path.basename(year_dir) + ".jsonl.zst")
+
+
+class TextCache:
+    """Extracted PDF text stored as one zstd-compressed JSONL shard per court/year directory."""
+
+    def __init__(self, cache_dir=TEXT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.shards = {}
+        self.dirty = set()
+
+    def _shard(self, path):
+        if path not in self.shards:
+            records = {}
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    # Entries appended by add() are extra frames; a later record for a name replaces an earlier one
+                    data = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True).read()
+                for line in data.decode("utf-8").splitlines():
+                    record = json.loads(line)
+                    records[record["name"]] = record
+            self.shards[path] = records
+        return self.shards[path]
+
+    def get(self, pdf_path):
+        """Return the cached text of a PDF, or None if it is missing or the file has changed."""
+        record = self._shard(shard_path(pdf_path, self.cache_dir)).get(os.path.basename(pdf_path))
+        if record is None:
+            return None
+        if (record["mtime_ns"], record["size"]) != file_signature(pdf_path):
+            return None
+        return record["text"]
+
+    def _record(self, pdf_path, text):
+        mtime_ns, size = file_signature(pdf_path)
+        name = os.path.basename(pdf_path)
+        return {"name": name, "mtime_ns": mtime_ns, "size": size, "text": text}
+
+    def put(self, pdf_path, text):
+        path = shard_path(pdf_path, self.cache_dir)
+        record = self._record(pdf_path, text)
+        self._shard(path)[record["name"]] = record
+        self.dirty.add(path)
+
+    def add(self, pdf_path, text):
+        """Store one text by appending a frame to its shard instead of rewriting the shard."""
+        path = shard_path(pdf_path, self.cache_dir)
+        record = self._record(pdf_path, text)
+        self._shard(path)[record["name"]] = record
+        if path in self.dirty:
+            # The shard is rewritten on save() anyway
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as f:
+            f.write(zstandard.ZstdCompressor(level=10).compress((json.dumps(record) + "\n").encode("utf-8")))
+
+    def save(self):
+        """Rewrite every modified shard atomically."""
+        for path in self.dirty:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            lines = "".join(json.dumps(record) + "\n" for record in self.shards[path].values())
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(zstandard.ZstdCompressor(level=10).compress(lines.encode("utf-8")))
+            os.replace(tmp_path, path)
+        self.dirty.clear()
+
+
+def extract_texts(pdf_paths, workers=None, cache=None):
+    """Return {pdf_path: text}, extracting cache misses across a process pool."""
+    cache = cache if cache is not None else TextCache()
+    texts = {}
+    missing = []
+    for pdf_path in pdf_paths:
+        text = cache.get(pdf_path)
+        if text is None:
+            missing.append(pdf_path)
+        else:
+            texts[pdf_path] = text
+
+    if missing:
+        print(f"Extracting text from {len(missing)} PDFs ({len(texts)} cached)...")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for pdf_path, text in zip(missing, executor.map(extract_text_from_pdf, missing, chunksize=4)):
+                cache.put(pdf_path, text)
+                texts[pdf_path] = text
+        cache.save()
+    return {pdf_path: texts[pdf_path] for pdf_path in pdf_paths}
+
+
+def get_text(pdf_path, cache=None):
+    """Return the text of a single PDF, from the cache when possible, extracting a miss in this process."""
+    cache = cache if cache is not None else TextCache()
+    text = cache.get(pdf_path)
+    if text is None:
+        text = extract_text_from_pdf(pdf_path)
+        cache.add(pdf_path, text)
+    return text
+
+
+def list_pdfs(directory):
+    return [os.path.join(directory, filename) for filename in sorted(os.listdir(directory)) if is_pdf(filename)]
+
+
+def extract_texts_for_year_range(court_name, start_year, end_year, workers=None, store=None):
+    """Populate the extracted-text cache for every PDF of a court in a year range.
+
+    With a CorpusStore the texts are also recorded there.
+    """
+    # corpus imports this module, so it is only imported when needed
+    from corpus import load_doc_ids, record_texts
+    court_dir = os.path.join(COURT_DIR, court_name)
+    cache = TextCache()
+    doc_ids = load_doc_ids(court_name) if store is not None else {}
+    for year in range(start_year, end_year + 1):
+        year_dir = os.path.join(court_dir, str(year))
+        if not os.path.exists(year_dir):
+            print(f"No directory found for {court_name} in {year}")
+            continue
+        texts = extract_texts(list_pdfs(year_dir), workers, cache)
+        if store is not None:
+            record_texts(store, court_name, year, texts, doc_ids)
+            store.flush()
+        print(f"Text ready for {court_name} ({year})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Extract and cache the text of downloaded court PDFs.')
+    parser.add_argument('--court-name', type=str, required=True, help='Name of the court')
+    parser.add_argument('--start-year', type=int, required=True, help='Start year for the range of PDFs to extract')
+    parser.add_argument('--end-year', type=int, required=True, help='End year for the range of PDFs to extract')
+    parser.add_argument('--workers', type=int, default=None, help='Number of extraction processes')
+    parser.add_argument('--no-store', action='store_true', help='Do not record the texts in the corpus store')
+    args = parser.parse_args()
+
+    store = None
+    if not args.no_store:
+        from corpus_store import CorpusStore
+        store = CorpusStore()
+    extract_texts_for_year_range(args.court_name, args.start_year, args.end_year, args.workers, store)
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+LLM_CACHE_PATH = "../data/llm_cache.db"
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+# Evict down to this share of the limit so eviction does not run on every insert
+EVICT_TO_FRACTION = 0.9
+
+
+class ResponseCache:
+    """Content-addressed SQLite cache of LLM responses with size-based LRU eviction."""
+
+    def __init__(self, path=LLM_CACHE_PATH, max_bytes=MAX_CACHE_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model, messages, base_url=None, **params):
+        """Hash everything that determines the response.
+
+        The default API endpoint is left out of the payload so its keys do not depend on how it was configured.
+        """
+        request = {"model": model, "messages": messages, "params": params}
+        if base_url:
+            request["base_url"] = base_url
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the cached response for a key, or None."""
+        row = self.conn.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self.conn:
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key, content):
+        size = len(content.encode("utf-8"))
+        with self.conn:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, content, size, time.time()))
+        self.total_bytes += size - (old[0] if old else 0)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used responses until the cache is back under its size limit."""
+        target = self.max_bytes * EVICT_TO_FRACTION
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY last_used")
+        doomed = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            doomed.append((key,))
+            self.total_bytes -= size
+        with self.conn:
+            self.conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def close(self):
+        self.conn.close()
+
+    def print_stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        print(f"Response cache: {self.hits} hits, {self.misses} misses ({hit_rate:.0%} hit rate), "
+              f"{self.total_bytes / 1024 ** 2:.1f} MiB stored")
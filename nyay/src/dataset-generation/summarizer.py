@@ -1,9 +1,41 @@
-from openai import OpenAI
-import fitz
+import asyncio
 import os
+import re
 import argparse
+import tiktoken
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from itertools import accumulate
+from pdf_text import extract_text_from_pdf, extract_texts, get_text, list_pdfs
+from llm_client import LLMClient, MAX_CONCURRENCY, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE
+from response_cache import ResponseCache, LLM_CACHE_PATH
+from corpus import load_doc_ids, record_summary, drop_summarized
+from corpus_store import CorpusStore, CORPUS_DIR
+from dedupe import DedupeIndex, DEDUPE_DB, split_duplicates, reuse_canonical_summaries
 
 COURT_DIR = "../data/Court_PDFs"
+MODEL = "gpt-4"
+# Context window of each model, in tokens
+MODEL_CONTEXT = {
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-3.5-turbo": 16385,
+}
+# Share of the context a request may fill; the rest is left for the report
+CONTEXT_FRACTION = 0.5
+# Per-message framing tokens added by the chat format
+MESSAGE_OVERHEAD = 4
+# "chunks" writes one report per chunk; "map-reduce" condenses chunk notes into a single report
+MODE = "chunks"
+# Completion cap for the notes produced by each map/merge call
+NOTES_MAX_TOKENS = 800
+# Chunks are cut between these whitespace-led words, preferably after a sentence end
+WORD_RE = re.compile(r"\s*\S+")
+SENTENCE_END_RE = re.compile(r"[.?!][\"')\]]*$")
+
 # Define the system message
 system_msg = """
  You are Lawyer GPT, A Top Quality Lawyer in Indian Law.
@@ -16,78 +48,8 @@ system_msg = """
     However, it's essential to underline the importance of providing accurate information. Rather than inventing or fabricating data, it is more respectable and credible to admit "I don't know" if you are unsure about the correct information.
 """
 
-
-# Function to extract text from a PDF file
-def extract_text_from_pdf(file_path):
-    """Extract text from a PDF file."""
-    text = ""
-    with fitz.open(file_path) as doc:
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            text += page.get_text()
-    return text
-
-
-# Function to call the OpenAI API to summarize the text
-def summarize_text(text, prompt):
-    openai_api_key = ''
-    client = OpenAI(api_key=openai_api_key)
-
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": system_msg},
-            {"role": "user", "content": prompt + "\n\n" + text}
-        ]
-        # max_tokens=600,
-        # n=1,
-        # stop=None,
-        # temperature=0.7
-    )
-    return response.choices[0].message.content
-
-
-def split_text_into_chunks(text, max_tokens=7500):
-    """Split text into chunks that fit within the model's token limit."""
-    words = text.split()
-    chunks = []
-    current_chunk = []
-    current_length = 0
-
-    for word in words:
-        current_length += len(word) + 1  # +1 for the space or tokenization impact
-        if current_length > max_tokens:
-            chunks.append(' '.join(current_chunk))
-            current_chunk = [word]
-            current_length = len(word) + 1
-        else:
-            current_chunk.append(word)
-
-    # Add the last chunk
-    if current_chunk:
-        chunks.append(' '.join(current_chunk))
-
-    return chunks
-
-
-def summarize_text_in_chunks(text, prompt):
-    chunks = split_text_into_chunks(text)
-    summary = ""
-
-    for chunk in chunks:
-        response = summarize_text(chunk, prompt)
-        summary += response + "\n\n"
-
-    return summary
-
-
-# Main function to generate the report
-def generate_legal_report(pdf_path):
-    # Extract text from the PDF
-    text = extract_text_from_pdf(pdf_path)
-
-    # Define the prompt for summarization
-    prompt = """
+# Define the prompt for summarization
+report_prompt = """
     You are an AI Lawyer/LawyerGPT, Carefully analyze the Indian legal document or court case: We need a well-structured, detailed, and accurate report.
     The Report should be accurate, as detailed as possible, and contain all important and relevant details in legal context and more than 3000+ words.
 
@@ -130,8 +92,165 @@ def generate_legal_report(pdf_path):
     The Report should be accurate, as detailed as possible, and contain all important and relevant details in legal context and more than 2000+ words.
     """
 
+# Map step of map-reduce mode: compact notes for one part of a long judgment
+notes_prompt = """
+    You are an AI Lawyer/LawyerGPT. Below is one part of a longer Indian court judgment.
+    Extract concise, factual notes from this part only, as bullet points under these headings (omit a heading if this part says nothing about it):
+    Case Citation and Bench, Parties, Facts, Case History, Legal Issues, Statutes and Provisions, Arguments, Precedents Cited, Holdings, Reasoning, Concurring/Dissenting Opinions.
+    Quote section numbers, citations and names exactly. Do not add information that is not in the text.
+    """
+
+# Intermediate reduce step for very long judgments: merge several sets of notes into one
+merge_notes_prompt = """
+    You are an AI Lawyer/LawyerGPT. Below are notes taken from consecutive parts of one Indian court judgment.
+    Merge them into a single set of bullet-point notes under the same headings, removing repetition but keeping every distinct fact, citation, provision, holding and line of reasoning.
+    """
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model=MODEL):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text, model=MODEL):
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+
+def prompt_overhead(prompt, model=MODEL):
+    """Return the tokens every request spends on the system message and prompt."""
+    return count_tokens(system_msg, model) + count_tokens(prompt + "\n\n", model) + 2 * MESSAGE_OVERHEAD
+
+
+def chunk_token_budget(prompt, model=MODEL, context_fraction=CONTEXT_FRACTION):
+    """Return how many document tokens fit in one request after the system message and prompt."""
+    context = MODEL_CONTEXT.get(model, MODEL_CONTEXT[MODEL])
+    overhead = prompt_overhead(prompt, model)
+    budget = int(context * context_fraction) - overhead
+    if budget <= 0:
+        raise ValueError(f"The prompt alone uses {overhead} tokens, more than {context_fraction:.0%} of {model}'s context")
+    return budget
+
+
+# Function to call the OpenAI API to summarize the text
+async def summarize_text(client, text, prompt, model=MODEL, max_tokens=None):
+    options = {"max_tokens": max_tokens, "expected_completion_tokens": max_tokens} if max_tokens else {}
+    return await client.chat(
+        model=model,
+        messages=[
+            {"role": "system", "content": system_msg},
+            {"role": "user", "content": prompt + "\n\n" + text}
+        ],
+        estimated_prompt_tokens=prompt_overhead(prompt, model) + count_tokens(text, model),
+        **options
+        # n=1,
+        # stop=None,
+        # temperature=0.7
+    )
+
+
+def split_text_into_chunks(text, max_tokens=7500, model=MODEL):
+    """Split text into chunks of at most max_tokens tokens, cut between words.
+
+    Words are encoded in one batched call and chunk ends are found by binary
+    search over the cumulative token counts, as summarizer_bart.chunk_text
+    does for sentences. A chunk ends after a sentence when one falls in its
+    last quarter.
+    """
+    encoding = get_encoding(model)
+    # Each word carries the whitespace before it, matching how tiktoken splits text before merging
+    words = WORD_RE.findall(text)
+    cumulative = [0] + list(accumulate(len(ids) for ids in encoding.encode_ordinary_batch(words)))
+
+    chunks = []
+    start = 0
+    while start < len(words):
+        end = bisect_right(cumulative, cumulative[start] + max_tokens) - 1
+        if end <= start:
+            # A single word longer than the budget is cut by tokens
+            tokens = encoding.encode_ordinary(words[start])
+            chunks.extend(encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens))
+            start += 1
+            continue
+        if end < len(words):
+            floor = max(bisect_left(cumulative, cumulative[start] + max_tokens * 3 // 4), start + 1)
+            end = next((i for i in range(end, floor - 1, -1) if SENTENCE_END_RE.search(words[i - 1])), end)
+        chunks.append("".join(words[start:end]).strip())
+        start = end
+    return chunks
+
+
+async def summarize_text_in_chunks(client, text, prompt, model=MODEL, context_fraction=CONTEXT_FRACTION):
+    budget = chunk_token_budget(prompt, model, context_fraction)
+    chunks = split_text_into_chunks(text, budget, model)
+
+    # Chunks are sent concurrently; gather keeps the report sections in order
+    responses = await asyncio.gather(*[summarize_text(client, chunk, prompt, model) for chunk in chunks])
+    return "".join(response + "\n\n" for response in responses)
+
+
+def pack_notes(notes, max_tokens, model=MODEL):
+    """Group consecutive notes so each group's joined text fits in max_tokens."""
+    groups = []
+    group = []
+    group_tokens = 0
+    for note in notes:
+        note_tokens = count_tokens(note, model) + 2
+        if group and group_tokens + note_tokens > max_tokens:
+            groups.append(group)
+            group = []
+            group_tokens = 0
+        group.append(note)
+        group_tokens += note_tokens
+    if group:
+        groups.append(group)
+    return groups
+
+
+async def summarize_map_reduce(client, text, model=MODEL, context_fraction=CONTEXT_FRACTION):
+    """Write one report from per-chunk notes instead of one report per chunk."""
+    report_budget = chunk_token_budget(report_prompt, model, context_fraction)
+    if count_tokens(text, model) <= report_budget:
+        return await summarize_text(client, text, report_prompt, model)
+    chunks = split_text_into_chunks(text, chunk_token_budget(notes_prompt, model, context_fraction), model)
+
+    # Map: notes for every chunk in parallel
+    notes = await asyncio.gather(*[
+        summarize_text(client, f"Part {i + 1} of {len(chunks)}:\n{chunk}", notes_prompt, model, NOTES_MAX_TOKENS)
+        for i, chunk in enumerate(chunks)])
+
+    # Reduce: merge groups of notes until they fit in a single report request
+    merge_budget = chunk_token_budget(merge_notes_prompt, model, context_fraction)
+    while len(notes) > 1 and sum(count_tokens(note, model) + 2 for note in notes) > report_budget:
+        groups = pack_notes(notes, merge_budget, model)
+        if len(groups) == len(notes):
+            # No two neighbouring notes fit one merge request: merge pairs anyway so the count still halves
+            groups = [notes[i:i + 2] for i in range(0, len(notes), 2)]
+        notes = await asyncio.gather(*[
+            summarize_text(client, "\n\n".join(group), merge_notes_prompt, model, NOTES_MAX_TOKENS)
+            for group in groups])
+
+    chunks = split_text_into_chunks("\n\n".join(notes), report_budget, model)
+    if len(chunks) > 1:
+        print(f"Warning: merged notes exceed the report budget; dropping {len(chunks) - 1} of {len(chunks)} chunks")
+    return await summarize_text(client, chunks[0], report_prompt, model)
+
+
+# Main function to generate the report
+async def generate_legal_report(client, pdf_path, text=None, model=MODEL, context_fraction=CONTEXT_FRACTION,
+                                mode=MODE):
+    # Extract text from the PDF, reusing the extracted-text cache
+    if text is None:
+        text = get_text(pdf_path)
+
+
     # Call the OpenAI API to generate the report
-    report = summarize_text_in_chunks(text, prompt)
+    if mode == "map-reduce":
+        report = await summarize_map_reduce(client, text, model, context_fraction)
+    else:
+        report = await summarize_text_in_chunks(client, text, report_prompt, model, context_fraction)
 
     return report
 
@@ -149,25 +268,80 @@ def save_summary(report, court_name, year, filename):
 
 
 # Function to process PDFs in the given directory structure within a specific year range
-def generate_summaries_for_year_range(court_name, start_year, end_year):
+async def generate_summaries_for_year_range_async(court_name, start_year, end_year, model=MODEL,
+                                                  context_fraction=CONTEXT_FRACTION, base_url=None,
+                                                  max_concurrency=MAX_CONCURRENCY,
+                                                  requests_per_minute=REQUESTS_PER_MINUTE,
+                                                  tokens_per_minute=TOKENS_PER_MINUTE, mode=MODE,
+                                                  cache_path=LLM_CACHE_PATH, dedupe_path=DEDUPE_DB,
+                                                  store_dir=CORPUS_DIR, skip_summarized=False):
     court_dir = os.path.join(COURT_DIR, court_name)
-
-    for year in range(start_year, end_year + 1):
-        year_dir = os.path.join(court_dir, str(year))
-        if not os.path.exists(year_dir):
-            print(f"No directory found for {court_name} in {year}")
-            continue
-
-        for filename in os.listdir(year_dir):
-            if filename.endswith(".pdf") or filename.endswith(".PDF"):
-                pdf_path = os.path.join(year_dir, filename)
-                print(f"Processing {filename} for {court_name} ({year})...")
-
-                # Generate the legal report
-                report = generate_legal_report(pdf_path)
-
-                # Save the summary
-                save_summary(report, court_name, year, filename.replace(".pdf", ""))
+    cache = ResponseCache(cache_path) if cache_path else None
+    # Near-duplicate judgments reuse their canonical document's summary instead of being sent to the API
+    dedupe = DedupeIndex(dedupe_path) if dedupe_path else None
+    store = CorpusStore(store_dir) if store_dir else None
+    doc_ids = load_doc_ids(court_name)
+    duplicates = []
+    client = LLMClient(base_url=base_url, max_concurrency=max_concurrency,
+                       requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute, cache=cache)
+
+    def record(year, pdf_path, report):
+        if store is not None:
+            record_summary(store, court_name, year, pdf_path, report, doc_ids)
+
+    async def process(pdf_path, text, year):
+        filename = os.path.basename(pdf_path)
+        print(f"Processing {filename} for {court_name} ({year})...")
+        try:
+            # Generate the legal report
+            report = await generate_legal_report(client, pdf_path, text, model, context_fraction, mode)
+        except Exception as e:
+            print(f"Failed to summarize {filename}: {e}")
+            return
+        # Save the summary as soon as it is ready
+        save_summary(report, court_name, year, filename.replace(".pdf", ""))
+        record(year, pdf_path, report)
+
+    tasks = []
+    try:
+        for year in range(start_year, end_year + 1):
+            year_dir = os.path.join(court_dir, str(year))
+            if not os.path.exists(year_dir):
+                print(f"No directory found for {court_name} in {year}")
+                continue
+
+            # Extract the next year while requests for earlier years are in flight
+            texts = await asyncio.get_running_loop().run_in_executor(None, extract_texts, list_pdfs(year_dir))
+            if dedupe is not None:
+                texts, year_duplicates = split_duplicates(dedupe, court_name, year, texts, doc_ids)
+                duplicates.extend(year_duplicates)
+            if skip_summarized and store is not None:
+                texts = drop_summarized(store, court_name, year, texts, doc_ids)
+            tasks.extend(asyncio.create_task(process(pdf_path, text, year)) for pdf_path, text in texts.items())
+        await asyncio.gather(*tasks)
+        if dedupe is not None:
+            reuse_canonical_summaries(dedupe, court_name, duplicates, save_summary, record)
+    finally:
+        await client.close()
+        client.print_usage()
+        if cache is not None:
+            cache.close()
+        if dedupe is not None:
+            dedupe.print_stats()
+            dedupe.close()
+        if store is not None:
+            store.close()
+
+
+def generate_summaries_for_year_range(court_name, start_year, end_year, model=MODEL,
+                                      context_fraction=CONTEXT_FRACTION, base_url=None,
+                                      max_concurrency=MAX_CONCURRENCY, requests_per_minute=REQUESTS_PER_MINUTE,
+                                      tokens_per_minute=TOKENS_PER_MINUTE, mode=MODE, cache_path=LLM_CACHE_PATH,
+                                      dedupe_path=DEDUPE_DB, store_dir=CORPUS_DIR, skip_summarized=False):
+    asyncio.run(generate_summaries_for_year_range_async(court_name, start_year, end_year, model, context_fraction,
+                                                        base_url, max_concurrency, requests_per_minute,
+                                                        tokens_per_minute, mode, cache_path, dedupe_path,
+                                                        store_dir, skip_summarized))
 
 
 # Main execution block
@@ -177,7 +351,29 @@ if __name__ == "__main__":
     parser.add_argument('--court-name', type=str, help='Name of the court')
     parser.add_argument('--start-year', type=int, help='Start year for the range of legal documents to summarize')
     parser.add_argument('--end-year', type=int, help='End year for the range of legal documents to summarize')
+    parser.add_argument('--model', type=str, default=MODEL, help='OpenAI chat model to use')
+    parser.add_argument('--context-fraction', type=float, default=CONTEXT_FRACTION,
+                        help='Share of the model context each request may fill')
+    parser.add_argument('--base-url', type=str, default=None,
+                        help='OpenAI-compatible API endpoint (e.g. a local mock server)')
+    parser.add_argument('--concurrency', type=int, default=MAX_CONCURRENCY, help='Maximum requests in flight')
+    parser.add_argument('--rpm', type=int, default=REQUESTS_PER_MINUTE, help='Requests per minute budget')
+    parser.add_argument('--tpm', type=int, default=TOKENS_PER_MINUTE, help='Tokens per minute budget')
+    parser.add_argument('--mode', type=str, default=MODE, choices=["chunks", "map-reduce"],
+                        help='One report per chunk, or one report reduced from per-chunk notes')
+    parser.add_argument('--cache-path', type=str, default=LLM_CACHE_PATH,
+                        help='SQLite file caching API responses')
+    parser.add_argument('--no-cache', action='store_true', help='Always call the API, bypassing the response cache')
+    parser.add_argument('--no-dedupe', action='store_true',
+                        help='Summarize near-duplicate judgments instead of reusing their canonical summary')
+    parser.add_argument('--skip-summarized', action='store_true',
+                        help='Skip documents that already have a summary in the corpus store')
+    parser.add_argument('--no-store', action='store_true', help='Do not record summaries in the corpus store')
     args = parser.parse_args()
 
     # Generate summaries for the provided court name and year range
-    generate_summaries_for_year_range(args.court_name, args.start_year, args.end_year)
+    generate_summaries_for_year_range(args.court_name, args.start_year, args.end_year, args.model,
+                                      args.context_fraction, args.base_url, args.concurrency, args.rpm, args.tpm,
+                                      args.mode, None if args.no_cache else args.cache_path,
+                                      None if args.no_dedupe else DEDUPE_DB, None if args.no_store else CORPUS_DIR,
+                                      args.skip_summarized)
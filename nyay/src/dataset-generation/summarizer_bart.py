@@ -1,81 +1,249 @@
-from transformers import BartForConditionalGeneration, BartTokenizer
-import fitz
 import os
+import sys
+import time
+import hashlib
+from collections import OrderedDict
 import argparse
-import concurrent.futures
-import nltk
+from pdf_text import extract_text_from_pdf, extract_texts, get_text, list_pdfs
+from corpus import load_doc_ids, record_summary, drop_summarized
+from corpus_store import CorpusStore, CORPUS_DIR
+from dedupe import DedupeIndex, DEDUPE_DB, split_duplicates, reuse_canonical_summaries
+import numpy as np
 
 
 COURT_DIR = "../data/Court_PDFs"
-
-# Load the BART model and tokenizer
+BATCH_SIZE = 8
+# Upper bound on padded input tokens per generate() call
+MAX_BATCH_TOKENS = 8192
+# Batches worth of chunks buffered across documents before packing
+SCHEDULER_WINDOW = 4
+# Tokens shared between consecutive chunks
+CHUNK_OVERLAP = 0
+# Documents whose sentence splits are memoized
+SENTENCE_CACHE_SIZE = 256
+
+_sentence_cache = OrderedDict()
+
+# The BART model and tokenizer are loaded on first use, so importing this module stays cheap
 model_name = "facebook/bart-large-cnn"
-tokenizer = BartTokenizer.from_pretrained(model_name)
-model = BartForConditionalGeneration.from_pretrained(model_name)
+_tokenizer = None
+_model = None
+_device = None
+_quantize = False
+
+
+def get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        from transformers import BartTokenizerFast
+        _tokenizer = BartTokenizerFast.from_pretrained(model_name)
+    return _tokenizer
+
+
+def load_model():
+    """Return (model, tokenizer, device), loading the model the first time it is needed."""
+    global _model, _device
+    if _model is None:
+        import torch
+        from transformers import BartForConditionalGeneration
+        start = time.perf_counter()
+        _device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model = BartForConditionalGeneration.from_pretrained(model_name).to(_device).eval()
+        if _quantize:
+            if _device.type != "cpu":
+                print("Dynamic int8 quantization is CPU-only; keeping the full-precision model.")
+            else:
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        _model = model
+        print(f"Loaded {model_name} on {_device} in {time.perf_counter() - start:.1f}s")
+    return _model, get_tokenizer(), _device
+
+
+def configure_model(num_threads=None, quantize=False):
+    """Set torch's CPU thread count and optionally use a dynamic int8 quantized model."""
+    global _model, _quantize
+    if num_threads:
+        import torch
+        torch.set_num_threads(num_threads)
+    if quantize and not _quantize:
+        _quantize = True
+        # Quantize now if the model is already loaded, otherwise when it loads
+        if _model is not None:
+            _model = None
+            load_model()
+
+
+def make_batches(lengths, batch_size=BATCH_SIZE, max_batch_tokens=MAX_BATCH_TOKENS):
+    """Group chunk indices into length-bucketed batches to keep padding low."""
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    batch = []
+    for i in order:
+        # Sorted ascending, so the current chunk sets the padded width of the batch
+        if batch and (len(batch) >= batch_size or (len(batch) + 1) * lengths[i] > max_batch_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def chunk_lengths(chunks):
+    """Return the truncated input token count of each chunk."""
+    tokenizer = get_tokenizer()
+    max_input = tokenizer.model_max_length
+    return [min(len(ids), max_input) for ids in tokenizer(chunks, truncation=True)["input_ids"]]
+
+
+def generate_batch(texts, max_length=1024):
+    """Run one padded generate() call over a batch of texts."""
+    import torch
+    model, tokenizer, device = load_model()
+    inputs = tokenizer(texts, padding=True, truncation=True, return_tensors="pt").to(device)
+    with torch.inference_mode():
+        summary_ids = model.generate(**inputs, max_length=max_length, min_length=100, length_penalty=2.0,
+                                     num_beams=4, early_stopping=True)
+    return tokenizer.batch_decode(summary_ids, skip_special_tokens=True)
+
+
+def summarize_chunks_bart(chunks, max_length=1024, batch_size=BATCH_SIZE, max_batch_tokens=MAX_BATCH_TOKENS):
+    """Summarize chunks in padded batches and return the summaries in chunk order."""
+    if not chunks:
+        return []
+    summaries = [None] * len(chunks)
+
+    start = time.perf_counter()
+    for batch in make_batches(chunk_lengths(chunks), batch_size, max_batch_tokens):
+        for i, summary in zip(batch, generate_batch([chunks[i] for i in batch], max_length)):
+            summaries[i] = summary
+    elapsed = time.perf_counter() - start
+    print(f"Summarized {len(chunks)} chunks in {elapsed:.1f}s ({len(chunks) / elapsed:.2f} chunks/sec)")
+    return summaries
+
+
+def summarize_documents_bart(documents, max_tokens=1024, batch_size=BATCH_SIZE,
+                             max_batch_tokens=MAX_BATCH_TOKENS, window=SCHEDULER_WINDOW, overlap=CHUNK_OVERLAP):
+    """Summarize (key, text) documents through one shared batch queue.
+
+    Chunks from consecutive documents are buffered together and packed into
+    full length-bucketed batches across document boundaries. Yields
+    (key, report) as soon as the last chunk of a document is summarized.
+    """
+    pending = []  # (key, chunk index, chunk, token length)
+    parts = {}
+    remaining = {}
+    total_chunks = 0
+    start = time.perf_counter()
+
+    def run(batches):
+        completed = []
+        for batch in batches:
+            items = [pending[i] for i in batch]
+            for (key, index, _, _), summary in zip(items, generate_batch([item[2] for item in items])):
+                parts[key][index] = summary
+                remaining[key] -= 1
+                if remaining[key] == 0:
+                    del remaining[key]
+                    completed.append((key, "".join(part + "\n\n" for part in parts.pop(key))))
+        return completed
+
+    for key, text in documents:
+        chunks, lengths = chunk_text(text, max_tokens, overlap)
+        if not chunks:
+            yield key, ""
+            continue
+        parts[key] = [None] * len(chunks)
+        remaining[key] = len(chunks)
+        total_chunks += len(chunks)
+        pending.extend((key, i, chunk, length) for i, (chunk, length) in enumerate(zip(chunks, lengths)))
 
+        if len(pending) >= batch_size * window:
+            batches = make_batches([item[3] for item in pending], batch_size, max_batch_tokens)
+            # Hold back the last batch only if later documents could top it up; it holds the longest chunks,
+            # so holding it back when full would delay every document with a full-length chunk to the end
+            last = batches[-1]
+            widest = max(pending[i][3] for i in last)
+            held = [] if len(last) >= batch_size or (len(last) + 1) * widest > max_batch_tokens else last
+            completed = run(batches[:-1] if held else batches)
+            pending = [pending[i] for i in held]
+            yield from completed
 
-# Function to extract text from a PDF file
-def extract_text_from_pdf(file_path):
-    """Extract text from a PDF file."""
-    text = ""
-    with fitz.open(file_path) as doc:
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            text += page.get_text()
-    return text
+    yield from run(make_batches([item[3] for item in pending], batch_size, max_batch_tokens))
+
+    elapsed = time.perf_counter() - start
+    if total_chunks:
+        print(f"Summarized {total_chunks} chunks in {elapsed:.1f}s ({total_chunks / elapsed:.2f} chunks/sec)")
 
 
 # Function to call BART model to summarize the text
 def summarize_text_bart(text, max_length=1024):
-    inputs = tokenizer.encode(text, return_tensors="pt", truncation=True)
-    summary_ids = model.generate(inputs, max_length=max_length, min_length=100, length_penalty=2.0, num_beams=4, early_stopping=True)
-    return tokenizer.decode(summary_ids[0], skip_special_tokens=True)
+    return summarize_chunks_bart([text], max_length)[0]
 
 
-# Split text into chunks based on sentences and token limits
-def split_text_into_chunks(text, max_tokens=1024):
-    """Split text into chunks that fit within the model's token limit."""
+def split_sentences(text):
+    """Split text into sentences, memoized per document hash."""
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    if digest in _sentence_cache:
+        _sentence_cache.move_to_end(digest)
+        return _sentence_cache[digest]
+    import nltk
     sentences = nltk.tokenize.sent_tokenize(text)
-    chunks = []
-    current_chunk = []
-    current_length = 0
+    _sentence_cache[digest] = sentences
+    if len(_sentence_cache) > SENTENCE_CACHE_SIZE:
+        _sentence_cache.popitem(last=False)
+    return sentences
 
-    for sentence in sentences:
-        sentence_length = len(tokenizer.encode(sentence, truncation=True))
 
-        if current_length + sentence_length > max_tokens:
-            chunks.append(' '.join(current_chunk))
-            current_chunk = [sentence]
-            current_length = sentence_length
-        else:
-            current_chunk.append(sentence)
-            current_length += sentence_length
+def chunk_text(text, max_tokens=1024, overlap=CHUNK_OVERLAP):
+    """Split text into sentence-aligned chunks and return (chunks, token lengths).
 
-    # Add the last chunk
-    if current_chunk:
-        chunks.append(' '.join(current_chunk))
+    All sentences are encoded in one batched call, and chunk boundaries are
+    found by binary search over the cumulative token counts. Consecutive
+    chunks share up to `overlap` tokens of whole sentences.
+    """
+    sentences = split_sentences(text)
+    if not sentences:
+        return [], []
+    tokenizer = get_tokenizer()
+    special = tokenizer.num_special_tokens_to_add()
+    budget = max_tokens - special
+    encoded = tokenizer(sentences, add_special_tokens=False)["input_ids"]
+    cumulative = np.concatenate(([0], np.cumsum([len(ids) for ids in encoded])))
 
-    return chunks
+    chunks = []
+    lengths = []
+    start = 0
+    while start < len(sentences):
+        end = int(np.searchsorted(cumulative, cumulative[start] + budget, side="right")) - 1
+        # A single sentence longer than the budget becomes its own (truncated) chunk
+        end = max(end, start + 1)
+        chunks.append(' '.join(sentences[start:end]))
+        lengths.append(min(int(cumulative[end] - cumulative[start]) + special, tokenizer.model_max_length))
+        if end >= len(sentences):
+            break
+        next_start = int(np.searchsorted(cumulative, cumulative[end] - overlap, side="left")) if overlap else end
+        start = min(max(next_start, start + 1), end)
+    return chunks, lengths
 
 
-# Parallelize summarization across chunks
-def summarize_text_in_chunks_bart(text, max_tokens=1024):
-    chunks = split_text_into_chunks(text, max_tokens)
-    summary = ""
+# Split text into chunks based on sentences and token limits
+def split_text_into_chunks(text, max_tokens=1024, overlap=CHUNK_OVERLAP):
+    """Split text into chunks that fit within the model's token limit."""
+    return chunk_text(text, max_tokens, overlap)[0]
 
-    # Use parallel processing to speed up summarization
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(summarize_text_bart, chunk) for chunk in chunks]
-        for future in concurrent.futures.as_completed(futures):
-            summary += future.result() + "\n\n"
 
-    return summary
+# Summarize all chunks of a document in batches, keeping section order
+def summarize_text_in_chunks_bart(text, max_tokens=1024, overlap=CHUNK_OVERLAP):
+    chunks = split_text_into_chunks(text, max_tokens, overlap)
+    return "".join(summary + "\n\n" for summary in summarize_chunks_bart(chunks))
 
 
 # Main function to generate the report
-def generate_legal_report(pdf_path):
-    # Extract text from the PDF
-    text = extract_text_from_pdf(pdf_path)
+def generate_legal_report(pdf_path, text=None):
+    # Extract text from the PDF, reusing the extracted-text cache
+    if text is None:
+        text = get_text(pdf_path)
 
     # Define the prompt for summarization (if using OpenAI, but here replaced by BART)
     prompt = """
@@ -102,25 +270,51 @@ def save_summary(report, court_name, year, filename):
 
 
 # Function to process PDFs in the given directory structure within a specific year range
-def generate_summaries_for_year_range(court_name, start_year, end_year):
+def generate_summaries_for_year_range(court_name, start_year, end_year, overlap=CHUNK_OVERLAP, dedupe_path=DEDUPE_DB,
+                                      store_dir=CORPUS_DIR, skip_summarized=False):
     court_dir = os.path.join(COURT_DIR, court_name)
-
-    for year in range(start_year, end_year + 1):
-        year_dir = os.path.join(court_dir, str(year))
-        if not os.path.exists(year_dir):
-            print(f"No directory found for {court_name} in {year}")
-            continue
-
-        for filename in os.listdir(year_dir):
-            if filename.endswith(".pdf") or filename.endswith(".PDF"):
-                pdf_path = os.path.join(year_dir, filename)
-                print(f"Processing {filename} for {court_name} ({year})...")
-
-                # Generate the legal report
-                report = generate_legal_report(pdf_path)
-
-                # Save the summary
-                save_summary(report, court_name, year, filename.replace(".pdf", ""))
+    # Near-duplicate judgments reuse their canonical document's summary instead of being summarized again
+    dedupe = DedupeIndex(dedupe_path) if dedupe_path else None
+    store = CorpusStore(store_dir) if store_dir else None
+    doc_ids = load_doc_ids(court_name)
+    duplicates = []
+
+    def record(year, pdf_path, report):
+        if store is not None:
+            record_summary(store, court_name, year, pdf_path, report, doc_ids)
+
+    def documents():
+        for year in range(start_year, end_year + 1):
+            year_dir = os.path.join(court_dir, str(year))
+            if not os.path.exists(year_dir):
+                print(f"No directory found for {court_name} in {year}")
+                continue
+
+            # Extract the whole year up front across a process pool
+            texts = extract_texts(list_pdfs(year_dir))
+            if dedupe is not None:
+                texts, year_duplicates = split_duplicates(dedupe, court_name, year, texts, doc_ids)
+                duplicates.extend(year_duplicates)
+            if skip_summarized and store is not None:
+                texts = drop_summarized(store, court_name, year, texts, doc_ids)
+            print(f"Queued {len(texts)} documents for {court_name} ({year})")
+            for pdf_path, text in texts.items():
+                yield (year, pdf_path), text
+
+    try:
+        # Chunks from every document share one inference queue; save each report as it completes
+        for (year, pdf_path), report in summarize_documents_bart(documents(), overlap=overlap):
+            filename = os.path.basename(pdf_path)
+            save_summary(report, court_name, year, filename.replace(".pdf", ""))
+            record(year, pdf_path, report)
+
+        if dedupe is not None:
+            reuse_canonical_summaries(dedupe, court_name, duplicates, save_summary, record)
+            dedupe.print_stats()
+            dedupe.close()
+    finally:
+        if store is not None:
+            store.close()
 
 
 # Main execution block
@@ -130,7 +324,19 @@ if __name__ == "__main__":
     parser.add_argument('--court-name', type=str, help='Name of the court')
     parser.add_argument('--start-year', type=int, help='Start year for the range of legal documents to summarize')
     parser.add_argument('--end-year', type=int, help='End year for the range of legal documents to summarize')
+    parser.add_argument('--num-threads', type=int, default=None, help='Number of torch CPU threads')
+    parser.add_argument('--quantize', action='store_true', help='Use a dynamic int8 quantized model on CPU')
+    parser.add_argument('--overlap', type=int, default=CHUNK_OVERLAP, help='Tokens shared between consecutive chunks')
+    parser.add_argument('--no-dedupe', action='store_true',
+                        help='Summarize near-duplicate judgments instead of reusing their canonical summary')
+    parser.add_argument('--skip-summarized', action='store_true',
+                        help='Skip documents that already have a summary in the corpus store')
+    parser.add_argument('--no-store', action='store_true', help='Do not record summaries in the corpus store')
     args = parser.parse_args()
 
+    configure_model(args.num_threads, args.quantize)
+
     # Generate summaries for the provided court name and year range
-    generate_summaries_for_year_range(args.court_name, args.start_year, args.end_year)
+    generate_summaries_for_year_range(args.court_name, args.start_year, args.end_year, args.overlap,
+                                      None if args.no_dedupe else DEDUPE_DB, None if args.no_store else CORPUS_DIR,
+                                      args.skip_summarized)
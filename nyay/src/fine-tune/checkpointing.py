@@ -0,0 +1,217 @@
+import copy
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from huggingface_hub import split_torch_state_dict_into_shards
+from safetensors.torch import save_file
+from peft import get_peft_model_state_dict
+from transformers import TrainerCallback
+from transformers.training_args import ParallelMode
+
+SAVE_EVERY_MINUTES = 30
+SAVE_TOTAL_LIMIT = 2
+MAX_SHARD_SIZE = "5GB"
+CHECKPOINT_RE = re.compile(r"^checkpoint-(\d+)$")
+
+
+def to_cpu(value):
+    """Recursively copy every tensor in a (nested) state dict to CPU memory."""
+    if torch.is_tensor(value):
+        return value.detach().to("cpu", copy=True)
+    if isinstance(value, dict):
+        return {key: to_cpu(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(to_cpu(item) for item in value)
+    return value
+
+
+def list_checkpoints(output_dir):
+    """Return (step, path) for every finished checkpoint in output_dir, oldest first."""
+    if not os.path.isdir(output_dir):
+        return []
+    checkpoints = []
+    for name in os.listdir(output_dir):
+        match = CHECKPOINT_RE.match(name)
+        if match:
+            checkpoints.append((int(match.group(1)), os.path.join(output_dir, name)))
+    return sorted(checkpoints)
+
+
+def rng_state(distributed):
+    """Capture the RNG states Trainer restores from rng_state.pth when resuming."""
+    states = {"python": random.getstate(), "numpy": np.random.get_state(), "cpu": torch.random.get_rng_state()}
+    if torch.cuda.is_available():
+        # Trainer restores every device's state only for distributed runs
+        states["cuda"] = torch.cuda.random.get_rng_state_all() if distributed else torch.cuda.random.get_rng_state()
+    return states
+
+
+def adapter_config_json(model):
+    """Serialize the active adapter's config as PeftModel.save_pretrained writes adapter_config.json."""
+    config = copy.deepcopy(model.peft_config[model.active_adapter])
+    config.inference_mode = True
+    return json.dumps(config.to_dict(), indent=2, sort_keys=True,
+                      default=lambda value: sorted(value) if isinstance(value, set) else str(value))
+
+
+def model_config_files(model):
+    """Serialize config.json (and generation_config.json) as PreTrainedModel.save_pretrained writes them."""
+    config = copy.deepcopy(model.config)
+    config.architectures = [type(model).__name__]
+    files = {"config.json": config.to_json_string()}
+    if model.can_generate() and getattr(model, "generation_config", None) is not None:
+        files["generation_config.json"] = model.generation_config.to_json_string()
+    return files
+
+
+def tokenizer_files(tokenizer):
+    """Read back the files tokenizer.save_pretrained writes so every checkpoint can reuse the bytes."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tokenizer.save_pretrained(tmp_dir)
+        files = {}
+        for name in os.listdir(tmp_dir):
+            with open(os.path.join(tmp_dir, name), "rb") as f:
+                files[name] = f.read()
+    return files
+
+
+class AsyncCheckpointer(TrainerCallback):
+    """Save checkpoints on a time or step budget without stalling training.
+
+    At a save point the weights (only the trainable ones for PEFT models),
+    optimizer and scheduler state are copied to CPU, and the model or
+    adapter config, trainer state and RNG states are serialized. That
+    snapshot is the only part that blocks a training step; nothing reads
+    the live model after it. A background thread then writes the sharded
+    safetensors, optimizer.pt, scheduler.pt, rng_state.pth and JSON files
+    into a temporary directory and renames it to checkpoint-{step}, so
+    Trainer can resume from it. Only the newest save_total_limit checkpoints
+    are kept. If the previous checkpoint is still being written when the
+    next one is due, the save is deferred until the writer is free.
+
+    Register this callback before ThroughputCallback so the snapshot is not
+    counted as dataloader wait.
+    """
+
+    def __init__(self, output_dir, save_every_minutes=SAVE_EVERY_MINUTES, save_every_steps=None,
+                 save_total_limit=SAVE_TOTAL_LIMIT, max_shard_size=MAX_SHARD_SIZE, save_optimizer=True):
+        self.output_dir = output_dir
+        self.save_every_seconds = save_every_minutes * 60 if save_every_minutes else None
+        self.save_every_steps = save_every_steps
+        self.save_total_limit = save_total_limit
+        self.max_shard_size = max_shard_size
+        self.save_optimizer = save_optimizer
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self.pending = None
+        self.tokenizer_files = None
+        self.last_save_time = None
+        self.last_save_step = 0
+        self.saves = 0
+        self.deferred = 0
+        self.blocking_seconds = 0.0
+        self.write_seconds = 0.0
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.last_save_time = time.monotonic()
+        self.last_save_step = state.global_step
+
+    def is_due(self, step):
+        if self.save_every_steps and step - self.last_save_step >= self.save_every_steps:
+            return True
+        return bool(self.save_every_seconds) and time.monotonic() - self.last_save_time >= self.save_every_seconds
+
+    def on_step_end(self, args, state, control, model=None, tokenizer=None, optimizer=None, lr_scheduler=None,
+                    **kwargs):
+        if self.pending is not None and self.pending.done():
+            # Surface write failures (e.g. a full disk) instead of training on without checkpoints
+            self.pending.result()
+            self.pending = None
+        if not state.is_world_process_zero or not self.is_due(state.global_step):
+            return
+        if self.pending is not None:
+            self.deferred += 1
+            return
+
+        start_time = time.perf_counter()
+        files = {"trainer_state.json": state.to_json_string()}
+        if getattr(model, "peft_config", None):
+            weights = {name: to_cpu(param) for name, param in model.named_parameters() if param.requires_grad}
+            shards = {"adapter_model.safetensors": get_peft_model_state_dict(model, state_dict=weights)}
+            files["adapter_config.json"] = adapter_config_json(model)
+        else:
+            weights = to_cpu(model.state_dict())
+            split = split_torch_state_dict_into_shards(weights, max_shard_size=self.max_shard_size)
+            shards = {name: {key: weights[key] for key in keys} for name, keys in split.filename_to_tensors.items()}
+            if split.is_sharded:
+                files["model.safetensors.index.json"] = json.dumps(
+                    {"metadata": split.metadata, "weight_map": split.tensor_to_filename}, indent=2, sort_keys=True)
+            files.update(model_config_files(model))
+        if tokenizer is not None:
+            if self.tokenizer_files is None:
+                self.tokenizer_files = tokenizer_files(tokenizer)
+            files.update(self.tokenizer_files)
+        optimizer_state = to_cpu(optimizer.state_dict()) if self.save_optimizer and optimizer is not None else None
+        scheduler_state = lr_scheduler.state_dict() if lr_scheduler is not None else None
+        rng_states = rng_state(args.parallel_mode == ParallelMode.DISTRIBUTED)
+        rng_name = "rng_state.pth" if args.world_size <= 1 else f"rng_state_{args.process_index}.pth"
+        self.blocking_seconds += time.perf_counter() - start_time
+
+        self.pending = self.executor.submit(self.write, state.global_step, shards, files, optimizer_state,
+                                            scheduler_state, {rng_name: rng_states})
+        self.last_save_time = time.monotonic()
+        self.last_save_step = state.global_step
+        self.saves += 1
+
+    def write(self, step, shards, files, optimizer_state, scheduler_state, rng_states):
+        start_time = time.perf_counter()
+        final_dir = os.path.join(self.output_dir, f"checkpoint-{step}")
+        tmp_dir = final_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        # Everything was snapshotted and serialized at the save point; only bytes are written here
+        for name, tensors in shards.items():
+            save_file(tensors, os.path.join(tmp_dir, name), metadata={"format": "pt"})
+        for name, content in files.items():
+            with open(os.path.join(tmp_dir, name), "wb") as f:
+                f.write(content.encode("utf-8") if isinstance(content, str) else content)
+        if optimizer_state is not None:
+            torch.save(optimizer_state, os.path.join(tmp_dir, "optimizer.pt"))
+        if scheduler_state is not None:
+            torch.save(scheduler_state, os.path.join(tmp_dir, "scheduler.pt"))
+        for name, states in rng_states.items():
+            torch.save(states, os.path.join(tmp_dir, name))
+
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(tmp_dir, final_dir)
+        self.rotate()
+        self.write_seconds += time.perf_counter() - start_time
+        print(f"Saved checkpoint-{step} in the background ({time.perf_counter() - start_time:.1f}s)")
+
+    def rotate(self):
+        """Delete the oldest checkpoints beyond save_total_limit."""
+        if not self.save_total_limit:
+            return
+        checkpoints = list_checkpoints(self.output_dir)
+        for _, path in checkpoints[:-self.save_total_limit]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def wait(self):
+        """Block until the checkpoint being written, if any, is on disk."""
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self.wait()
+        self.executor.shutdown()
+        if state.is_world_process_zero and self.saves:
+            print(f"Checkpoints: {self.saves} saved ({self.deferred} steps deferred while writing), "
+                  f"{self.blocking_seconds:.1f}s blocking snapshot, {self.write_seconds:.1f}s background writes")
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import torch
+from datasets import load_dataset, load_from_disk
+
+TOKENIZED_CACHE_DIR = "./tokenized"
+MAX_LENGTH = 512
+
+
+def dataset_fingerprint(dataset_path, tokenizer, max_length, packing):
+    """Key a tokenized dataset by its source file, tokenizer and packing settings."""
+    stat = os.stat(dataset_path)
+    payload = json.dumps({
+        "dataset": os.path.abspath(dataset_path),
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "tokenizer": tokenizer.name_or_path,
+        "vocab_size": len(tokenizer),
+        "max_length": max_length,
+        "packing": packing,
+    }, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def tokenize_batch(examples, tokenizer, max_length):
+    """Tokenize without padding, ending every example with EOS."""
+    encoded = tokenizer(examples["text"], truncation=True, max_length=max_length - 1)
+    input_ids = [ids + [tokenizer.eos_token_id] for ids in encoded["input_ids"]]
+    return {"input_ids": input_ids, "length": [len(ids) for ids in input_ids]}
+
+
+def pack_batch(examples, max_length):
+    """Concatenate consecutive examples into sequences of at most max_length tokens.
+
+    position_ids restart at 0 for every example so attention can be confined
+    to each example, and the first token of every example is not used as a
+    label for the last token of the one before it.
+    """
+    packed = {"input_ids": [], "position_ids": [], "labels": [], "length": []}
+    input_ids, position_ids, labels = [], [], []
+    for ids in examples["input_ids"]:
+        if input_ids and len(input_ids) + len(ids) > max_length:
+            packed["input_ids"].append(input_ids)
+            packed["position_ids"].append(position_ids)
+            packed["labels"].append(labels)
+            packed["length"].append(len(input_ids))
+            input_ids, position_ids, labels = [], [], []
+        input_ids.extend(ids)
+        position_ids.extend(range(len(ids)))
+        labels.append(-100)
+        labels.extend(ids[1:])
+    if input_ids:
+        packed["input_ids"].append(input_ids)
+        packed["position_ids"].append(position_ids)
+        packed["labels"].append(labels)
+        packed["length"].append(len(input_ids))
+    return packed
+
+
+def load_tokenized_dataset(dataset_path, tokenizer, max_length=MAX_LENGTH, packing=False, num_proc=None,
+                           cache_dir=TOKENIZED_CACHE_DIR):
+    """Return the tokenized (and optionally packed) dataset, memory-mapped from disk when already built."""
+    path = os.path.join(cache_dir, dataset_fingerprint(dataset_path, tokenizer, max_length, packing))
+    if os.path.exists(path):
+        print(f"Loading tokenized dataset from {path}")
+        return load_from_disk(path)
+
+    dataset = load_dataset('json', data_files=dataset_path, split='train')
+    tokenized = dataset.map(tokenize_batch, batched=True, num_proc=num_proc, remove_columns=dataset.column_names,
+                            fn_kwargs={"tokenizer": tokenizer, "max_length": max_length})
+    if packing:
+        tokenized = tokenized.map(pack_batch, batched=True, batch_size=1000, num_proc=num_proc,
+                                  remove_columns=tokenized.column_names, fn_kwargs={"max_length": max_length})
+    tokenized.save_to_disk(path)
+    print(f"Saved tokenized dataset to {path}")
+    # Reload so training reads the memory-mapped Arrow files rather than in-memory tables
+    return load_from_disk(path)
+
+
+class PaddedCollator:
+    """Pad unpacked examples to the longest in the batch and mask labels by length.
+
+    Masking by length rather than by pad_token_id keeps the trailing EOS a trained label
+    even when the tokenizer pads with its EOS token.
+    """
+
+    def __init__(self, pad_token_id):
+        self.pad_token_id = pad_token_id
+
+    def __call__(self, features):
+        width = max(len(f["input_ids"]) for f in features)
+        input_ids = torch.full((len(features), width), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(features), width), dtype=torch.long)
+        labels = torch.full((len(features), width), -100, dtype=torch.long)
+        for row, f in enumerate(features):
+            n = len(f["input_ids"])
+            input_ids[row, :n] = torch.tensor(f["input_ids"])
+            attention_mask[row, :n] = 1
+            labels[row, :n] = input_ids[row, :n]
+        return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
+
+
+class PackedCollator:
+    """Pad packed sequences and keep attention inside each example.
+
+    With flash attention the restarting position_ids mark the boundaries.
+    Otherwise a block-diagonal causal 4D mask is built per sequence.
+    """
+
+    def __init__(self, pad_token_id, flash_attention=False, dtype=torch.float32):
+        self.pad_token_id = pad_token_id
+        self.flash_attention = flash_attention
+        self.dtype = dtype
+
+    def __call__(self, features):
+        width = max(len(f["input_ids"]) for f in features)
+        input_ids = torch.full((len(features), width), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((len(features), width), -100, dtype=torch.long)
+        # Padding trails the last example: causality hides it from real tokens and its labels are ignored
+        position_ids = torch.arange(width).repeat(len(features), 1)
+        for row, f in enumerate(features):
+            n = len(f["input_ids"])
+            input_ids[row, :n] = torch.tensor(f["input_ids"])
+            labels[row, :n] = torch.tensor(f["labels"])
+            position_ids[row, :n] = torch.tensor(f["position_ids"])
+        batch = {"input_ids": input_ids, "labels": labels, "position_ids": position_ids}
+        if not self.flash_attention:
+            batch["attention_mask"] = block_causal_mask(position_ids, self.dtype)
+        return batch
+
+
+def block_causal_mask(position_ids, dtype=torch.float32):
+    """Additive (batch, 1, L, L) mask letting tokens attend only to earlier tokens of their own example."""
+    segment_ids = torch.cumsum((position_ids == 0).long(), dim=1)
+    same_segment = segment_ids.unsqueeze(2) == segment_ids.unsqueeze(1)
+    causal = torch.ones(position_ids.shape[1], position_ids.shape[1], dtype=torch.bool).tril()
+    allowed = same_segment & causal
+    mask = torch.zeros(allowed.shape, dtype=dtype)
+    mask.masked_fill_(~allowed, torch.finfo(dtype).min)
+    return mask.unsqueeze(1)
+
+
+def count_tokens(dataset):
+    """Total non-padding tokens in a tokenized dataset."""
+    return int(sum(dataset["length"]))
@@ -3,18 +3,26 @@ import torch
 import transformers
 import datasets
 import argparse
-from transformers import LlamaTokenizer, LlamaForCausalLM, Trainer, TrainingArguments
-from transformers import DataCollatorForLanguageModeling
-from datasets import load_dataset
+import json
+import tempfile
+import time
+from transformers import LlamaTokenizer, LlamaForCausalLM, Trainer, TrainingArguments, BitsAndBytesConfig
+from transformers.utils import is_flash_attn_2_available
 import bitsandbytes as bnb
 import wandb
+from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
+from data_pipeline import (load_tokenized_dataset, PaddedCollator, PackedCollator, count_tokens, MAX_LENGTH,
+                           TOKENIZED_CACHE_DIR)
+from checkpointing import AsyncCheckpointer, SAVE_EVERY_MINUTES, SAVE_TOTAL_LIMIT, MAX_SHARD_SIZE
+from training_metrics import (TokenMeter, MeteredCollator, ThroughputCallback, tiny_llama_config,
+                              write_benchmark_records, compare_to_baseline)
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Fine-tune a Llama model on custom data.")
     parser.add_argument("--model_name", type=str, default="facebook/llama-2",
                         help="Model name or path to pretrained model")
-    parser.add_argument("--dataset_path", type=str, required=True, help="Path to the training dataset")
+    parser.add_argument("--dataset_path", type=str, help="Path to the training dataset")
     parser.add_argument("--output_dir", type=str, default="./output", help="Directory to save the fine-tuned model")
     parser.add_argument("--num_train_epochs", type=int, default=3, help="Number of training epochs")
     parser.add_argument("--batch_size", type=int, default=8, help="Training batch size")
@@ -22,11 +30,155 @@ def parse_args():
     parser.add_argument("--weight_decay", type=float, default=0.01, help="Weight decay")
     parser.add_argument("--warmup_steps", type=int, default=500, help="Number of warmup steps")
     parser.add_argument("--logging_dir", type=str, default="./logs", help="Directory for storing logs")
+    parser.add_argument("--logging_steps", type=int, default=50, help="Log every N steps")
+    parser.add_argument("--save_every_minutes", type=float, default=SAVE_EVERY_MINUTES,
+                        help="Save a checkpoint after this many minutes of training (0 to disable)")
+    parser.add_argument("--save_every_steps", type=int, default=None,
+                        help="Also save a checkpoint every N steps")
+    parser.add_argument("--save_total_limit", type=int, default=SAVE_TOTAL_LIMIT,
+                        help="Number of most recent checkpoints to keep")
+    parser.add_argument("--max_shard_size", type=str, default=MAX_SHARD_SIZE,
+                        help="Maximum size of each safetensors shard in a checkpoint")
+    parser.add_argument("--resume_from_checkpoint", type=str, default=None,
+                        help="Checkpoint directory to resume training from")
     parser.add_argument("--use_wandb", action="store_true", help="Use Weights & Biases for logging")
+    parser.add_argument("--max_length", type=int, default=MAX_LENGTH, help="Maximum sequence length in tokens")
+    parser.add_argument("--packing", action="store_true",
+                        help="Pack several examples into each sequence, keeping attention within each example")
+    parser.add_argument("--group_by_length", action="store_true",
+                        help="Batch examples of similar length together (used when not packing)")
+    parser.add_argument("--num_proc", type=int, default=os.cpu_count(), help="Processes used for tokenization")
+    parser.add_argument("--tokenized_cache_dir", type=str, default=TOKENIZED_CACHE_DIR,
+                        help="Directory where tokenized datasets are saved and reused")
+    parser.add_argument("--peft", action="store_true", help="Train LoRA adapters instead of the full model")
+    parser.add_argument("--load_in_4bit", action="store_true", help="Load the base model in 4-bit NF4 (QLoRA)")
+    parser.add_argument("--load_in_8bit", action="store_true", help="Load the base model in 8-bit")
+    parser.add_argument("--lora_r", type=int, default=16, help="LoRA rank")
+    parser.add_argument("--lora_alpha", type=int, default=32, help="LoRA scaling factor")
+    parser.add_argument("--lora_dropout", type=float, default=0.05, help="LoRA dropout")
+    parser.add_argument("--lora_target_modules", type=str, default="q_proj,k_proj,v_proj,o_proj",
+                        help="Comma-separated module names to attach LoRA adapters to")
+    parser.add_argument("--gradient_checkpointing", action="store_true",
+                        help="Recompute activations in the backward pass to save memory")
+    parser.add_argument("--optim", type=str, default=None,
+                        help="Optimizer name (defaults to paged_adamw_8bit with --peft, adamw_torch otherwise)")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Train a tiny Llama on CPU for a few steps and report data pipeline throughput")
+    parser.add_argument("--benchmark_records", type=int, default=256,
+                        help="Records to sample from --dataset_path, or to synthesize when it is not given")
+    parser.add_argument("--benchmark_steps", type=int, default=20, help="Training steps in benchmark mode")
+    parser.add_argument("--benchmark_output", type=str, default=None, help="Write benchmark metrics to this JSON file")
+    parser.add_argument("--benchmark_baseline", type=str, default=None,
+                        help="Compare benchmark metrics against a JSON file from an earlier run")
     args = parser.parse_args()
+    if not args.dataset_path and not args.benchmark:
+        parser.error("--dataset_path is required unless --benchmark is set")
+    if (args.load_in_4bit or args.load_in_8bit) and not args.peft:
+        parser.error("--load_in_4bit/--load_in_8bit require --peft")
+    if args.load_in_4bit and args.load_in_8bit:
+        parser.error("--load_in_4bit and --load_in_8bit are mutually exclusive")
     return args
 
 
+def load_model(args, flash_attention=False):
+    """Load the base model, quantized and wrapped in LoRA adapters when --peft is set."""
+    model_kwargs = {"attn_implementation": "flash_attention_2"} if flash_attention else {}
+    if args.load_in_4bit or args.load_in_8bit:
+        model_kwargs["quantization_config"] = BitsAndBytesConfig(
+            load_in_4bit=args.load_in_4bit,
+            load_in_8bit=args.load_in_8bit,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_use_double_quant=True,
+            bnb_4bit_compute_dtype=torch.float16,
+        )
+        model_kwargs["torch_dtype"] = torch.float16
+        model_kwargs["device_map"] = "auto"
+    model = LlamaForCausalLM.from_pretrained(args.model_name, **model_kwargs)
+
+    if args.peft:
+        if args.load_in_4bit or args.load_in_8bit:
+            model = prepare_model_for_kbit_training(model, use_gradient_checkpointing=args.gradient_checkpointing)
+        elif args.gradient_checkpointing:
+            # The frozen embeddings' outputs need grads or checkpointed blocks pass none back to the adapters
+            model.enable_input_require_grads()
+        lora_config = LoraConfig(
+            r=args.lora_r,
+            lora_alpha=args.lora_alpha,
+            lora_dropout=args.lora_dropout,
+            target_modules=[name.strip() for name in args.lora_target_modules.split(",") if name.strip()],
+            bias="none",
+            task_type="CAUSAL_LM",
+        )
+        model = get_peft_model(model, lora_config)
+        model.print_trainable_parameters()
+    return model
+
+
+def report_resources(result, start_time, peft):
+    """Print peak memory and step time so PEFT and full fine-tuning runs can be compared."""
+    steps = max(result.global_step, 1)
+    wall = time.perf_counter() - start_time
+    mode = "LoRA" if peft else "full fine-tuning"
+    print(f"[{mode}] {steps} steps, {wall / steps:.3f}s/step")
+    if torch.cuda.is_available():
+        print(f"[{mode}] peak GPU memory: {torch.cuda.max_memory_allocated() / 1024 ** 3:.2f} GiB")
+
+
+def make_collator(args, tokenizer, flash_attention=False):
+    if args.packing:
+        return PackedCollator(tokenizer.pad_token_id, flash_attention)
+    # Pad each batch only to its longest example; labels are masked by length so EOS is still learned
+    return PaddedCollator(tokenizer.pad_token_id)
+
+
+def run_benchmark(args, tokenizer):
+    """Train a tiny Llama on CPU with the real data pipeline and report its throughput metrics."""
+    torch.manual_seed(0)
+    with tempfile.TemporaryDirectory() as workdir:
+        records_path = os.path.join(workdir, "records.jsonl")
+        write_benchmark_records(records_path, args.benchmark_records, args.dataset_path)
+        # A fresh cache directory so tokenization and packing are measured, not reloaded
+        start_time = time.perf_counter()
+        dataset = load_tokenized_dataset(records_path, tokenizer, args.max_length, args.packing, args.num_proc,
+                                         os.path.join(workdir, "tokenized"))
+        tokenize_seconds = time.perf_counter() - start_time
+
+        model = LlamaForCausalLM(tiny_llama_config(tokenizer, args.max_length))
+        meter = TokenMeter()
+        checkpointer = AsyncCheckpointer(os.path.join(workdir, "checkpoints"), save_every_minutes=None,
+                                         save_every_steps=max(args.benchmark_steps // 2, 1), save_total_limit=1,
+                                         max_shard_size=args.max_shard_size)
+        callback = ThroughputCallback(meter, checkpointer)
+        training_args = TrainingArguments(
+            output_dir=os.path.join(workdir, "checkpoints"),
+            max_steps=args.benchmark_steps,
+            per_device_train_batch_size=args.batch_size,
+            learning_rate=args.learning_rate,
+            logging_steps=max(args.benchmark_steps // 4, 1),
+            save_strategy="no",
+            group_by_length=args.group_by_length and not args.packing,
+            length_column_name="length",
+            use_cpu=True,
+            optim="adamw_torch",
+            report_to="none",
+        )
+        trainer = Trainer(
+            model=model,
+            args=training_args,
+            train_dataset=dataset,
+            data_collator=MeteredCollator(make_collator(args, tokenizer), meter),
+            callbacks=[checkpointer, callback],
+        )
+        trainer.train()
+
+    metrics = {"tokenize_seconds": round(tokenize_seconds, 3), **callback.summary()}
+    if args.benchmark_output:
+        with open(args.benchmark_output, "w", encoding="utf-8") as f:
+            json.dump(metrics, f, indent=2)
+    if args.benchmark_baseline:
+        compare_to_baseline(metrics, args.benchmark_baseline)
+
+
 def main():
     args = parse_args()
 
@@ -35,19 +187,26 @@ def main():
 
     # Load tokenizer and model
     tokenizer = LlamaTokenizer.from_pretrained(args.model_name)
-    model = LlamaForCausalLM.from_pretrained(args.model_name)
-
-    # Load dataset
-    dataset = load_dataset('json', data_files=args.dataset_path, split='train')
-
-    # Tokenize dataset
-    def tokenize_function(examples):
-        return tokenizer(examples["text"], padding="max_length", truncation=True, max_length=512)
-
-    tokenized_dataset = dataset.map(tokenize_function, batched=True)
-
-    # Data collator for language modeling
-    data_collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    if args.benchmark:
+        run_benchmark(args, tokenizer)
+        return
+
+    # Flash attention reads example boundaries from position_ids; other kernels get a block-diagonal mask
+    flash_attention = args.packing and is_flash_attn_2_available()
+    model = load_model(args, flash_attention)
+
+    # Tokenize (or load the memory-mapped tokenized copy of) the dataset
+    tokenized_dataset = load_tokenized_dataset(args.dataset_path, tokenizer, args.max_length, args.packing,
+                                               args.num_proc, args.tokenized_cache_dir)
+    total_tokens = count_tokens(tokenized_dataset)
+    print(f"{len(tokenized_dataset)} sequences, {total_tokens} tokens")
+
+    meter = TokenMeter()
+    data_collator = MeteredCollator(make_collator(args, tokenizer, flash_attention), meter)
+    checkpointer = AsyncCheckpointer(args.output_dir, args.save_every_minutes, args.save_every_steps,
+                                     args.save_total_limit, args.max_shard_size)
 
     # Training arguments
     training_args = TrainingArguments(
@@ -59,10 +218,14 @@ def main():
         weight_decay=args.weight_decay,
         warmup_steps=args.warmup_steps,
         logging_dir=args.logging_dir,
-        logging_steps=10,
-        save_steps=10,
-        save_total_limit=2,
+        logging_steps=args.logging_steps,
+        # Checkpoints are written in the background by AsyncCheckpointer
+        save_strategy="no",
         fp16=True,  # Enable mixed precision training
+        group_by_length=args.group_by_length and not args.packing,
+        length_column_name="length",
+        gradient_checkpointing=args.gradient_checkpointing,
+        optim=args.optim or ("paged_adamw_8bit" if args.peft else "adamw_torch"),
         report_to="wandb" if args.use_wandb else None
     )
 
@@ -73,12 +236,15 @@ def main():
         train_dataset=tokenized_dataset,
         data_collator=data_collator,
         tokenizer=tokenizer,
+        callbacks=[checkpointer, ThroughputCallback(meter, checkpointer)],
     )
 
     # Train the model
-    trainer.train()
+    start_time = time.perf_counter()
+    result = trainer.train(resume_from_checkpoint=args.resume_from_checkpoint)
+    report_resources(result, start_time, args.peft)
 
-    # Save the final model
+    # Save the final model (only the adapter weights with --peft; merge them with merge_adapter.py)
     trainer.save_model(args.output_dir)
 
 
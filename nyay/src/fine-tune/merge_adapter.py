@@ -0,0 +1,32 @@
+import argparse
+import torch
+from transformers import LlamaTokenizer, LlamaForCausalLM
+from peft import PeftModel
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Merge trained LoRA adapters into their base Llama model.")
+    parser.add_argument("--model_name", type=str, default="facebook/llama-2",
+                        help="Model name or path of the base model the adapters were trained on")
+    parser.add_argument("--adapter_dir", type=str, required=True, help="Directory with the saved adapter weights")
+    parser.add_argument("--output_dir", type=str, required=True, help="Directory to save the merged model")
+    parser.add_argument("--fp16", action="store_true", help="Load and save the merged model in float16")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # Adapters are merged into a full-precision (or fp16) copy of the base model, never a quantized one
+    dtype = torch.float16 if args.fp16 else torch.float32
+    model = LlamaForCausalLM.from_pretrained(args.model_name, torch_dtype=dtype)
+    model = PeftModel.from_pretrained(model, args.adapter_dir)
+    model = model.merge_and_unload()
+
+    model.save_pretrained(args.output_dir, safe_serialization=True)
+    LlamaTokenizer.from_pretrained(args.adapter_dir).save_pretrained(args.output_dir)
+    print(f"Merged model saved to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import json
+import random
+import resource
+import sys
+import time
+from transformers import LlamaConfig, TrainerCallback
+
+SYNTHETIC_WORDS = (
+    "the court held that appellant respondent petition appeal order judgment section act evidence "
+    "high supreme bench learned counsel submitted argued dismissed allowed accused trial witness "
+    "statement contract property tax constitution article right liberty procedure code criminal civil"
+).split()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+class TokenMeter:
+    """Counts real and padded tokens in the batches handed to the model."""
+
+    def __init__(self):
+        self.real_tokens = 0
+        self.padded_tokens = 0
+
+    @property
+    def padding_ratio(self):
+        return 1 - self.real_tokens / self.padded_tokens if self.padded_tokens else 0.0
+
+
+class MeteredCollator:
+    """Wrap a data collator to count real vs padded tokens.
+
+    The counts live in this process, so the collator must run in the main
+    process (dataloader_num_workers=0, the Trainer default).
+    """
+
+    def __init__(self, collator, meter):
+        self.collator = collator
+        self.meter = meter
+
+    def __call__(self, features):
+        batch = self.collator(features)
+        self.meter.real_tokens += sum(len(f["input_ids"]) for f in features)
+        self.meter.padded_tokens += batch["input_ids"].numel()
+        return batch
+
+
+class ThroughputCallback(TrainerCallback):
+    """Report tokens/sec, padding ratio, dataloader wait, peak RSS and checkpoint save time.
+
+    Dataloader wait is the time between the end of one step and the start of
+    the next, excluding checkpoint saves, which is where the next batch is
+    fetched and collated. With an AsyncCheckpointer the save time reported is
+    the time its snapshots blocked training.
+    """
+
+    def __init__(self, meter, checkpointer=None):
+        self.meter = meter
+        self.checkpointer = checkpointer
+        self.train_start = None
+        self.train_end = None
+        self.mark = None
+        self.dataloader_wait = 0.0
+        self.save_time = 0.0
+        self.saves = 0
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.train_start = time.perf_counter()
+        self.mark = self.train_start
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        now = time.perf_counter()
+        self.dataloader_wait += now - self.mark
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self.mark = time.perf_counter()
+
+    def on_save(self, args, state, control, **kwargs):
+        now = time.perf_counter()
+        self.save_time += now - self.mark
+        self.saves += 1
+        self.mark = now
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        self.mark = time.perf_counter()
+        if state.is_world_process_zero:
+            metrics = self.summary()
+            print(f"[throughput] step {state.global_step}: {metrics['tokens_per_second']:.0f} tokens/sec, "
+                  f"padding {metrics['padding_ratio']:.1%}, dataloader wait {metrics['dataloader_wait_fraction']:.1%}, "
+                  f"peak RSS {metrics['peak_rss_mb']:.0f} MiB")
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self.train_end = time.perf_counter()
+        if state.is_world_process_zero:
+            print("[throughput] " + json.dumps(self.summary()))
+
+    def summary(self):
+        if self.train_start is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self.train_end or time.perf_counter()) - self.train_start
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "real_tokens": self.meter.real_tokens,
+            "padded_tokens": self.meter.padded_tokens,
+            "tokens_per_second": self.meter.real_tokens / elapsed if elapsed else 0.0,
+            "padding_ratio": self.meter.padding_ratio,
+            "dataloader_wait_seconds": round(self.dataloader_wait, 3),
+            "dataloader_wait_fraction": self.dataloader_wait / elapsed if elapsed else 0.0,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "checkpoint_saves": self.checkpointer.saves if self.checkpointer else self.saves,
+            "checkpoint_save_seconds": round(self.checkpointer.blocking_seconds if self.checkpointer
+                                             else self.save_time, 3),
+        }
+
+
+def tiny_llama_config(tokenizer, max_length):
+    """A Llama small enough to train a few steps on CPU in seconds."""
+    return LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=64,
+        intermediate_size=172,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=4,
+        max_position_embeddings=max_length,
+        pad_token_id=tokenizer.pad_token_id,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+
+
+def write_benchmark_records(path, num_records, dataset_path=None, max_words=400, seed=0):
+    """Write num_records {"text": ...} lines to path, sampled from dataset_path or synthesized.
+
+    Synthetic records have uniformly random lengths so padding and packing
+    behave as they would on real data of mixed length.
+    """
+    rng = random.Random(seed)
+    if dataset_path:
+        with open(dataset_path, encoding="utf-8") as f:
+            lines = [line for line in f if line.strip()]
+        records = [json.loads(line) for line in rng.sample(lines, min(num_records, len(lines)))]
+    else:
+        records = [{"text": " ".join(rng.choices(SYNTHETIC_WORDS, k=rng.randint(8, max_words)))}
+                   for _ in range(num_records)]
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def compare_to_baseline(metrics, baseline_path):
+    """Print each metric next to a baseline saved by an earlier --benchmark_output run."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    for name, value in metrics.items():
+        if name in baseline and isinstance(value, (int, float)) and baseline[name]:
+            change = (value - baseline[name]) / baseline[name]
+            print(f"{name}: {value:.4g} (baseline {baseline[name]:.4g}, {change:+.1%})")
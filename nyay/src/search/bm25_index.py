@@ -0,0 +1,479 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+from collections import defaultdict
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dataset-generation"))
+from corpus import iter_documents  # noqa: E402
+from pdf_text import file_signature  # noqa: E402
+from dedupe import DedupeIndex, DEDUPE_DB  # noqa: E402
+
+BM25_INDEX_DIR = "../data/Search_Index/bm25"
+K1 = 1.2
+B = 0.75
+# Merge the smallest segments once there are more than this many
+MERGE_FACTOR = 8
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+QUERY_RE = re.compile(r'"([^"]+)"|(\S+)')
+STREAMS = ("docs", "freqs", "positions")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def parse_query(query):
+    """Split a query into loose terms and quoted phrases ("section 302")."""
+    terms, phrases = [], []
+    for phrase, word in QUERY_RE.findall(query):
+        tokens = tokenize(phrase or word)
+        if phrase and len(tokens) > 1:
+            phrases.append(tokens)
+        else:
+            terms.extend(tokens)
+    return terms, phrases
+
+
+def encode_varints(values):
+    """LEB128-encode non-negative integers.
+
+    Returns the encoded bytes and the number of bytes used by each value.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        nbytes += rest > 0
+        rest >>= np.uint64(7)
+    ends = np.cumsum(nbytes)
+    starts = ends - nbytes
+    out = np.empty(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    for k in range(int(nbytes.max()) if len(nbytes) else 0):
+        has = nbytes > k
+        group = ((values[has] >> np.uint64(7 * k)) & np.uint64(0x7F)).astype(np.uint8)
+        more = (nbytes[has] > k + 1).astype(np.uint8) << 7
+        out[starts[has] + k] = group | more
+    return out, nbytes
+
+
+def decode_varints(buf):
+    """Decode a run of LEB128 integers into an int64 array."""
+    buf = np.asarray(buf, dtype=np.uint8)
+    if not len(buf):
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero((buf & 0x80) == 0)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shift = (np.arange(len(buf)) - np.repeat(starts, ends - starts + 1)) * 7
+    return np.add.reduceat((buf & 0x7F).astype(np.int64) << shift, starts)
+
+
+def delta_encode(values, group_sizes=None):
+    """Gaps between consecutive values, restarting at the start of every group."""
+    deltas = np.diff(values, prepend=0)
+    if group_sizes is not None and len(values):
+        starts = np.concatenate(([0], np.cumsum(group_sizes)[:-1]))
+        deltas[starts] = values[starts]
+    return deltas
+
+
+def delta_decode(deltas, group_sizes=None):
+    values = np.cumsum(deltas)
+    if group_sizes is not None and len(values):
+        starts = np.concatenate(([0], np.cumsum(group_sizes)[:-1]))
+        values -= np.repeat(values[starts] - deltas[starts], group_sizes)
+    return values
+
+
+def bm25(tf, doc_lengths, df, num_docs, avg_length):
+    idf = np.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+    return idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * doc_lengths / avg_length))
+
+
+def build_postings(texts):
+    """Return ({term: (docs, freqs, positions)}, doc_lengths) for a batch of documents."""
+    lists = defaultdict(lambda: ([], [], []))
+    lengths = []
+    for local_id, text in enumerate(texts):
+        tokens = tokenize(text)
+        lengths.append(len(tokens))
+        positions = defaultdict(list)
+        for position, token in enumerate(tokens):
+            positions[token].append(position)
+        for token, token_positions in positions.items():
+            docs, freqs, all_positions = lists[token]
+            docs.append(local_id)
+            freqs.append(len(token_positions))
+            all_positions.extend(token_positions)
+    postings = {term: tuple(np.array(values, dtype=np.int64) for values in entry) for term, entry in lists.items()}
+    return postings, lengths
+
+
+def write_segment(path, doc_ids, courts, years, lengths, postings):
+    """Write an immutable segment directory.
+
+    Each term's doc IDs (gaps), term frequencies and positions (gaps within
+    each document) are varint-encoded into docs.bin, freqs.bin and
+    positions.bin. term_offsets.npy holds each term's byte range in the three
+    files, and the term list itself is terms.txt in sorted order.
+    """
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    court_names = sorted(set(courts))
+    court_codes = {court: code for code, court in enumerate(court_names)}
+
+    terms = sorted(postings)
+    streams = {name: [] for name in STREAMS}
+    counts = {name: [] for name in STREAMS}
+    for term in terms:
+        docs, freqs, positions = postings[term]
+        streams["docs"].append(delta_encode(docs))
+        streams["freqs"].append(freqs)
+        streams["positions"].append(delta_encode(positions, freqs))
+        counts["docs"].append(len(docs))
+        counts["freqs"].append(len(freqs))
+        counts["positions"].append(len(positions))
+
+    offsets = np.zeros((len(terms) + 1, len(STREAMS)), dtype=np.int64)
+    for column, name in enumerate(STREAMS):
+        values = np.concatenate(streams[name]) if terms else np.zeros(0, dtype=np.int64)
+        encoded, nbytes = encode_varints(values)
+        encoded.tofile(os.path.join(tmp_path, f"{name}.bin"))
+        byte_ends = np.concatenate(([0], np.cumsum(nbytes)))
+        offsets[1:, column] = byte_ends[np.cumsum(counts[name], dtype=np.int64)]
+
+    np.save(os.path.join(tmp_path, "term_offsets.npy"), offsets)
+    np.save(os.path.join(tmp_path, "term_df.npy"), np.array(counts["docs"], dtype=np.int32))
+    with open(os.path.join(tmp_path, "terms.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(terms))
+    np.save(os.path.join(tmp_path, "doc_lengths.npy"), np.array(lengths, dtype=np.int32))
+    np.save(os.path.join(tmp_path, "doc_courts.npy"), np.array([court_codes[c] for c in courts], dtype=np.int16))
+    np.save(os.path.join(tmp_path, "doc_years.npy"), np.array(years, dtype=np.int16))
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"doc_ids": list(doc_ids), "courts": court_names}, f)
+    os.replace(tmp_path, path)
+
+
+def map_bytes(path):
+    """Memory-map a binary file read-only (an empty array for an empty file)."""
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+class Segment:
+    """A read-only, memory-mapped segment plus its mutable deletion bitmap."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.doc_ids = meta["doc_ids"]
+        self.courts = meta["courts"]
+        with open(os.path.join(path, "terms.txt"), encoding="utf-8") as f:
+            self.terms = {term: i for i, term in enumerate(f.read().split("\n")) if term}
+        self.offsets = np.load(os.path.join(path, "term_offsets.npy"), mmap_mode="r")
+        self.df = np.load(os.path.join(path, "term_df.npy"), mmap_mode="r")
+        self.lengths = np.load(os.path.join(path, "doc_lengths.npy"), mmap_mode="r")
+        self.doc_courts = np.load(os.path.join(path, "doc_courts.npy"), mmap_mode="r")
+        self.doc_years = np.load(os.path.join(path, "doc_years.npy"), mmap_mode="r")
+        self.streams = {name: map_bytes(os.path.join(path, f"{name}.bin")) for name in STREAMS}
+        deleted_path = os.path.join(path, "deleted.npy")
+        self.deleted = np.load(deleted_path) if os.path.exists(deleted_path) else np.zeros(len(self.doc_ids), bool)
+
+    @property
+    def num_docs(self):
+        return len(self.doc_ids)
+
+    @property
+    def live_docs(self):
+        return int(self.num_docs - self.deleted.sum())
+
+    def delete(self, local_ids):
+        self.deleted[local_ids] = True
+        tmp_path = os.path.join(self.path, "deleted.tmp.npy")
+        np.save(tmp_path, self.deleted)
+        os.replace(tmp_path, os.path.join(self.path, "deleted.npy"))
+
+    def doc_frequency(self, term):
+        i = self.terms.get(term)
+        return 0 if i is None else int(self.df[i])
+
+    def _stream(self, name, i):
+        column = STREAMS.index(name)
+        return decode_varints(self.streams[name][self.offsets[i, column]:self.offsets[i + 1, column]])
+
+    def postings(self, term, with_positions=False):
+        """Return (docs, freqs[, positions]) for a term, or None if the segment lacks it."""
+        i = self.terms.get(term)
+        if i is None:
+            return None
+        docs = np.cumsum(self._stream("docs", i))
+        freqs = self._stream("freqs", i)
+        if not with_positions:
+            return docs, freqs
+        return docs, freqs, delta_decode(self._stream("positions", i), freqs)
+
+    def phrase_matches(self, tokens):
+        """Return (docs, counts) of documents containing the tokens consecutively."""
+        keys = None
+        for offset, token in enumerate(tokens):
+            postings = self.postings(token, with_positions=True)
+            if postings is None:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+            docs, freqs, positions = postings
+            # Align every token on the phrase start: key = (doc, position - offset)
+            starts = positions - offset
+            valid = starts >= 0
+            token_keys = (np.repeat(docs, freqs)[valid] << 32) | starts[valid]
+            keys = token_keys if keys is None else np.intersect1d(keys, token_keys, assume_unique=True)
+            if not len(keys):
+                break
+        return np.unique(keys >> 32, return_counts=True)
+
+    def filter_mask(self, court=None, start_year=None, end_year=None):
+        mask = ~self.deleted
+        if court is not None:
+            if court not in self.courts:
+                return np.zeros(self.num_docs, dtype=bool)
+            mask &= self.doc_courts == self.courts.index(court)
+        if start_year is not None:
+            mask &= self.doc_years >= start_year
+        if end_year is not None:
+            mask &= self.doc_years <= end_year
+        return mask
+
+
+class BM25Index:
+    """An inverted index of log-structured segments with BM25 ranking.
+
+    Every add writes a new segment, and re-added (changed) documents are
+    tombstoned in their old segment. When there are more than MERGE_FACTOR
+    segments the smallest ones are merged, dropping deleted documents.
+    documents.db maps each doc ID to its segment and local ID.
+    """
+
+    def __init__(self, index_dir=BM25_INDEX_DIR, merge_factor=MERGE_FACTOR):
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_dir = index_dir
+        self.merge_factor = merge_factor
+        self.manifest_path = os.path.join(index_dir, "manifest.json")
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"segments": [], "next_segment": 0}
+        self.segments = [Segment(os.path.join(index_dir, name)) for name in self.manifest["segments"]]
+        self.conn = sqlite3.connect(os.path.join(index_dir, "documents.db"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "doc_id TEXT PRIMARY KEY, segment TEXT NOT NULL, local_id INTEGER NOT NULL, signature TEXT NOT NULL)")
+        self.update_stats()
+
+    def close(self):
+        self.conn.close()
+
+    def update_stats(self):
+        self.num_docs = sum(segment.live_docs for segment in self.segments)
+        total_length = sum(int(segment.lengths[~segment.deleted].sum()) for segment in self.segments)
+        self.avg_length = total_length / self.num_docs if self.num_docs else 1.0
+
+    def save_manifest(self):
+        self.manifest["segments"] = [segment.name for segment in self.segments]
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def new_segment_path(self):
+        name = f"seg-{self.manifest['next_segment']:06d}"
+        self.manifest["next_segment"] += 1
+        return os.path.join(self.index_dir, name)
+
+    def add_documents(self, documents):
+        """Index (doc_id, court, year, signature, text) tuples that are new or changed.
+
+        Returns the number of documents added.
+        """
+        new = []
+        replaced = defaultdict(list)
+        # A doc ID listed twice keeps its last version
+        latest = {document[0]: document for document in documents}
+        for doc_id, court, year, signature, text in latest.values():
+            row = self.conn.execute("SELECT segment, local_id, signature FROM documents WHERE doc_id = ?",
+                                    (doc_id,)).fetchone()
+            if row is not None:
+                if row[2] == signature:
+                    continue
+                replaced[row[0]].append(row[1])
+            new.append((doc_id, court, year, signature, text))
+        if not new:
+            return 0
+
+        postings, lengths = build_postings([text for _, _, _, _, text in new])
+        path = self.new_segment_path()
+        write_segment(path, [d[0] for d in new], [d[1] for d in new], [d[2] for d in new], lengths, postings)
+        for segment in self.segments:
+            if segment.name in replaced:
+                segment.delete(replaced[segment.name])
+        segment = Segment(path)
+        self.segments.append(segment)
+        self.save_manifest()
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)",
+                                  [(doc_id, segment.name, local_id, signature)
+                                   for local_id, (doc_id, _, _, signature, _) in enumerate(new)])
+        self.maybe_merge()
+        self.update_stats()
+        return len(new)
+
+    def maybe_merge(self):
+        while len(self.segments) > self.merge_factor:
+            smallest = sorted(self.segments, key=lambda segment: segment.live_docs)[:self.merge_factor]
+            self.merge(smallest)
+
+    def merge(self, segments):
+        """Merge segments into one, dropping deleted documents."""
+        start_time = time.perf_counter()
+        doc_ids, courts, years, lengths = [], [], [], []
+        remaps = []
+        for segment in segments:
+            live = ~segment.deleted
+            remap = np.full(segment.num_docs, -1, dtype=np.int64)
+            remap[live] = np.arange(len(doc_ids), len(doc_ids) + int(live.sum()))
+            remaps.append(remap)
+            for local_id in np.flatnonzero(live):
+                doc_ids.append(segment.doc_ids[local_id])
+                courts.append(segment.courts[segment.doc_courts[local_id]])
+                years.append(int(segment.doc_years[local_id]))
+                lengths.append(int(segment.lengths[local_id]))
+
+        postings = {}
+        for term in sorted(set().union(*(segment.terms for segment in segments))):
+            parts = []
+            for segment, remap in zip(segments, remaps):
+                entry = segment.postings(term, with_positions=True)
+                if entry is None:
+                    continue
+                docs, freqs, positions = entry
+                keep = remap[docs] >= 0
+                parts.append((remap[docs[keep]], freqs[keep], positions[np.repeat(keep, freqs)]))
+            if parts and any(len(docs) for docs, _, _ in parts):
+                postings[term] = tuple(np.concatenate(column) for column in zip(*parts))
+
+        path = self.new_segment_path()
+        write_segment(path, doc_ids, courts, years, lengths, postings)
+        merged = Segment(path)
+        names = {segment.name for segment in segments}
+        self.segments = [segment for segment in self.segments if segment.name not in names] + [merged]
+        self.save_manifest()
+        with self.conn:
+            self.conn.executemany("UPDATE documents SET segment = ?, local_id = ? WHERE doc_id = ?",
+                                  [(merged.name, local_id, doc_id) for local_id, doc_id in enumerate(doc_ids)])
+        for segment in segments:
+            shutil.rmtree(segment.path, ignore_errors=True)
+        print(f"Merged {len(segments)} segments into {merged.name} ({len(doc_ids)} documents) "
+              f"in {time.perf_counter() - start_time:.1f}s")
+
+    def optimize(self):
+        """Merge every segment into one."""
+        if len(self.segments) > 1:
+            self.merge(list(self.segments))
+            self.update_stats()
+
+    def search(self, query, k=10, court=None, start_year=None, end_year=None):
+        """Return the top-k documents for a query as dicts, best first.
+
+        Loose terms are scored with BM25 and any of them may match. Quoted
+        phrases must all appear and are scored as single terms.
+        """
+        terms, phrases = parse_query(query)
+        if not terms and not phrases or not self.num_docs:
+            return []
+        term_df = {term: sum(segment.doc_frequency(term) for segment in self.segments) for term in set(terms)}
+        phrase_hits = [[segment.phrase_matches(tokens) for tokens in phrases] for segment in self.segments]
+        phrase_df = [sum(len(hits[p][0]) for hits in phrase_hits) for p in range(len(phrases))]
+
+        candidates = []
+        for segment, hits in zip(self.segments, phrase_hits):
+            mask = segment.filter_mask(court, start_year, end_year)
+            scores = np.zeros(segment.num_docs, dtype=np.float64)
+            lengths = np.asarray(segment.lengths, dtype=np.float64)
+            for term in terms:
+                postings = segment.postings(term)
+                if postings is not None:
+                    docs, freqs = postings
+                    scores[docs] += bm25(freqs, lengths[docs], term_df[term], self.num_docs, self.avg_length)
+            for (docs, counts), df in zip(hits, phrase_df):
+                required = np.zeros(segment.num_docs, dtype=bool)
+                required[docs] = True
+                mask &= required
+                scores[docs] += bm25(counts, lengths[docs], df, self.num_docs, self.avg_length)
+            scores[~mask] = 0
+            matched = np.flatnonzero(scores > 0)
+            if len(matched) > k:
+                matched = matched[np.argpartition(-scores[matched], k)[:k]]
+            candidates.extend((float(scores[local_id]), segment, int(local_id)) for local_id in matched)
+
+        candidates.sort(key=lambda candidate: -candidate[0])
+        return [{"doc_id": segment.doc_ids[local_id], "court": segment.courts[segment.doc_courts[local_id]],
+                 "year": int(segment.doc_years[local_id]), "score": score}
+                for score, segment, local_id in candidates[:k]]
+
+
+def index_year_range(index, court_name, start_year, end_year, dedupe=None):
+    """Add a court's extracted judgments to the index, one segment per year.
+
+    With a DedupeIndex, near-duplicate judgments are left out; searches find their canonical copy.
+    """
+    for year in range(start_year, end_year + 1):
+        documents = [(document.doc_id, court_name, year, "{}:{}".format(*file_signature(document.pdf_path)),
+                      document.text)
+                     for document in iter_documents(court_name, year, year, dedupe=dedupe)]
+        if documents:
+            added = index.add_documents(documents)
+            print(f"Indexed {added} documents for {court_name} ({year}), {index.num_docs} in total")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build and query a BM25 full-text index of court judgments.')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_parser = subparsers.add_parser("add", help="Index a court's judgments for a year range")
+    add_parser.add_argument('--court-name', type=str, required=True, help='Name of the court')
+    add_parser.add_argument('--start-year', type=int, required=True, help='Start year of the documents to index')
+    add_parser.add_argument('--end-year', type=int, required=True, help='End year of the documents to index')
+    add_parser.add_argument('--no-dedupe', action='store_true', help='Also index near-duplicate judgments')
+    search_parser = subparsers.add_parser("search", help='Search, e.g. \'"section 302" ipc murder\'')
+    search_parser.add_argument('query', type=str, help='Search query; quote phrases')
+    search_parser.add_argument('-k', type=int, default=10, help='Number of documents to return')
+    search_parser.add_argument('--court-name', type=str, default=None, help='Only return documents from this court')
+    search_parser.add_argument('--start-year', type=int, default=None, help='Only return documents from this year on')
+    search_parser.add_argument('--end-year', type=int, default=None, help='Only return documents up to this year')
+    subparsers.add_parser("optimize", help="Merge all segments into one")
+    for sub in subparsers.choices.values():
+        sub.add_argument('--index-dir', type=str, default=BM25_INDEX_DIR, help='Directory holding the index')
+    args = parser.parse_args()
+
+    index = BM25Index(args.index_dir)
+    if args.command == "add":
+        dedupe = None if args.no_dedupe else DedupeIndex(DEDUPE_DB)
+        index_year_range(index, args.court_name, args.start_year, args.end_year, dedupe)
+        if dedupe is not None:
+            dedupe.close()
+    elif args.command == "optimize":
+        index.optimize()
+    else:
+        start_time = time.perf_counter()
+        results = index.search(args.query, args.k, args.court_name, args.start_year, args.end_year)
+        print(f"{len(results)} results in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+        for result in results:
+            print(f"[{result['score']:.2f}] {result['court']} {result['year']} doc {result['doc_id']}")
+    index.close()
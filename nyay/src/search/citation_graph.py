@@ -0,0 +1,443 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dataset-generation"))
+from corpus import iter_documents  # noqa: E402
+from pdf_text import COURT_DIR  # noqa: E402
+from dedupe import DedupeIndex, DEDUPE_DB, year_bounds  # noqa: E402
+
+CITATION_GRAPH_DIR = "../data/Search_Index/citations"
+# Lines at the top of an Indian Kanoon PDF searched for its title and equivalent citations
+HEADER_LINES = 30
+HEADER_CHARS = 4000
+# Words either side of a "v." tried as party names
+PARTY_WORDS = 8
+# Search results fetched per requested result when reranking by precedent
+RERANK_DEPTH = 3
+EXTRACT_CHUNKSIZE = 8
+
+YEAR = r"(?:18|19|20)\d{2}"
+# Every citation form in one alternation, so each text is scanned once; the outer group names the form.
+# The lookahead rejects most positions with one character test before any branch is tried.
+CITATION_RE = re.compile(rf"""
+  (?=[AS(\[\d]|art|s(?:ec|s?\.)|\sv)
+  (?:
+    (?P<air>\bAIR\s*(?P<air_year>{YEAR})\s+(?P<air_court>[A-Z][A-Za-z]*)\s+(?P<air_page>\d+))
+  | (?P<air_ik>\b(?P<air_ik_year>{YEAR})\s+AIR\s+(?P<air_ik_page>\d+))
+  | (?P<scc>\((?P<scc_year>{YEAR})\)\s*(?P<scc_vol>\d+)\s+SCC\s+(?P<scc_page>\d+))
+  | (?P<scc_ik>\b(?P<scc_ik_year>{YEAR})\s+SCC\s+\((?P<scc_ik_vol>\d+)\)\s+(?P<scc_ik_page>\d+))
+  | (?P<scr>\[(?P<scr_year>{YEAR})\]\s*(?:(?P<scr_vol>\d+)\s+)?S\.?\s?C\.?\s?R\.?\s+(?P<scr_page>\d+))
+  | (?P<scr_ik>\b(?P<scr_ik_year>{YEAR})\s+SCR\s+(?:\((?P<scr_ik_vol>\d+)\)\s+)?(?P<scr_ik_page>\d+))
+  | (?P<article>\b[Aa]rt(?:icles?|s?\.)\s*(?P<article_no>\d+[A-Z]?)(?:\s*\(\w{{1,4}}\))*\s+of\s+the\s+Constitution)
+  | (?P<section>\b(?:[Ss]ections?|[Ss]ec\.|[Ss]s?\.)\s*(?P<section_no>\d+[A-Z]?)(?:\s*\(\w{{1,4}}\))*,?\s+
+        (?:of\s+the\s+(?P<section_act>Code\s+of\s+(?:Criminal|Civil)\s+Procedure
+                                     |(?:[A-Z][A-Za-z.()]*\s+){{0,6}}?(?:Act|Code))(?:,?\s+{YEAR})?
+          |(?P<section_abbr>I\.?\s?P\.?\s?C\b\.?|Cr\.?\s?P\.?\s?C\b\.?|C\.?\s?P\.?\s?C\b\.?)))
+  | (?P<versus>\s(?:v\.|vs\.?|versus)\s)
+  )
+""", re.VERBOSE)
+TITLE_RE = re.compile(r"^(?P<first>.+?)\s+(?:vs\.?|v\.|versus)\s+(?P<second>.+?)"
+                      r"\s+on\s+\d{1,2}\s+[A-Z][a-z]+,?\s+\d{4}\s*$", re.MULTILINE)
+EQUIVALENT_RE = re.compile(r"Equivalent citations?:\s*(?P<citations>[^\n]+)")
+WORD_RE = re.compile(r"[A-Za-z0-9&]+")
+ACT_ABBREVIATIONS = {"ipc": "indian penal code", "crpc": "code of criminal procedure", "cpc": "code of civil procedure"}
+
+Header = namedtuple("Header", ["title", "own", "own_span"])
+Extraction = namedtuple("Extraction", ["cited", "case_names", "statutes"])
+
+# Set in each extraction process by init_worker
+_titles = {}
+_first_parties = set()
+
+
+def party_key(words):
+    """Normalize a party name so "A. K. Gopalan" and "A.K. Gopalan" compare equal."""
+    words = [word.lower() for word in words]
+    if words and words[0] == "the":
+        words = words[1:]
+    return "".join(words)
+
+
+def citation_key(match):
+    """Canonical key of a reporter citation, e.g. "AIR 1950 SC 27", or None for other matches."""
+    kind = match.lastgroup
+    if kind == "air":
+        return f"AIR {match['air_year']} {match['air_court'].upper()} {match['air_page']}"
+    if kind == "air_ik":
+        # Indian Kanoon's "1950 AIR 27" is AIR 1950 SC 27
+        return f"AIR {match['air_ik_year']} SC {match['air_ik_page']}"
+    if kind == "scc":
+        return f"SCC {match['scc_year']} {match['scc_vol']} {match['scc_page']}"
+    if kind == "scc_ik":
+        return f"SCC {match['scc_ik_year']} {match['scc_ik_vol']} {match['scc_ik_page']}"
+    if kind == "scr":
+        parts = ("SCR", match["scr_year"], match["scr_vol"], match["scr_page"])
+        return " ".join(part for part in parts if part)
+    if kind == "scr_ik":
+        parts = ("SCR", match["scr_ik_year"], match["scr_ik_vol"], match["scr_ik_page"])
+        return " ".join(part for part in parts if part)
+    return None
+
+
+def statute_key(match):
+    """Canonical key of a statute reference, e.g. "indian penal code s. 302", or None for other matches."""
+    if match.lastgroup == "article":
+        return f"constitution art. {match['article_no']}"
+    if match.lastgroup != "section":
+        return None
+    if match["section_abbr"]:
+        act = ACT_ABBREVIATIONS[re.sub(r"[^a-z]", "", match["section_abbr"].lower())]
+    else:
+        act = " ".join(re.sub(r"[^a-z ]", " ", match["section_act"].lower()).split())
+    return f"{act} s. {match['section_no']}"
+
+
+def read_header(text):
+    """Return a judgment's own title (as party keys), its equivalent citations and where they are listed."""
+    header = "\n".join(text[:HEADER_CHARS].split("\n", HEADER_LINES)[:HEADER_LINES])
+    title = TITLE_RE.search(header)
+    if title is not None:
+        title = (party_key(WORD_RE.findall(title["first"])), party_key(WORD_RE.findall(title["second"])))
+    equivalent = EQUIVALENT_RE.search(header)
+    if equivalent is None:
+        return Header(title, [], (0, 0))
+    own = {citation_key(match) for match in CITATION_RE.finditer(equivalent["citations"])}
+    own.discard(None)
+    return Header(title, sorted(own), equivalent.span())
+
+
+def init_worker(titles):
+    """Give an extraction process the {(first party, second party): doc_id} map of unambiguous titles."""
+    global _titles, _first_parties
+    _titles = titles
+    _first_parties = {first for first, _ in titles}
+
+
+def match_case_name(text, match):
+    """Return the doc ID of a known judgment named around a "v.", trying longer party names in turn."""
+    left = WORD_RE.findall(text[max(0, match.start() - 20 * PARTY_WORDS):match.start()])[-PARTY_WORDS:]
+    right = WORD_RE.findall(text[match.end():match.end() + 20 * PARTY_WORDS])[:PARTY_WORDS]
+    for n in range(1, len(left) + 1):
+        first = party_key(left[-n:])
+        if first in _first_parties:
+            for m in range(1, len(right) + 1):
+                doc_id = _titles.get((first, party_key(right[:m])))
+                if doc_id is not None:
+                    return doc_id
+    return None
+
+
+def extract_citations(text):
+    """Scan a judgment once for the reporter citations, known case names and statutes it cites."""
+    own_start, own_end = read_header(text).own_span
+    cited, case_names, statutes = set(), set(), set()
+    for match in CITATION_RE.finditer(text):
+        kind = match.lastgroup
+        if kind == "versus":
+            if _first_parties:
+                doc_id = match_case_name(text, match)
+                if doc_id is not None:
+                    case_names.add(doc_id)
+            continue
+        key = citation_key(match)
+        if key is not None:
+            # The equivalent citations in the header are the judgment's own
+            if not own_start <= match.start() < own_end:
+                cited.add(key)
+            continue
+        key = statute_key(match)
+        if key is not None:
+            statutes.add(key)
+    return Extraction(sorted(cited), sorted(case_names), sorted(statutes))
+
+
+def build_csr(src, dst, num_rows, num_cols):
+    """Return (indptr, indices) of the deduplicated edges src -> dst, with each row's targets sorted."""
+    edges = np.unique(src * max(num_cols, 1) + dst)
+    src, dst = edges // max(num_cols, 1), edges % max(num_cols, 1)
+    indptr = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=num_rows), out=indptr[1:])
+    return indptr, dst.astype(np.int32)
+
+
+class CitationGraphBuilder:
+    """Resolve citations to nodes, merging near-duplicate copies of a judgment into one node.
+
+    Every header is added before any citations, so citations resolve to
+    judgments from any court or year.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.courts = []
+        self.years = []
+        self.own = {}
+        self.titles = {}
+        self.src, self.dst = [], []
+        self.statute_src, self.statute_dst = [], []
+        self.statute_ids = {}
+        self.unresolved = 0
+
+    def add_header(self, doc_id, court, year, header):
+        node = self.nodes.get(doc_id)
+        if node is None:
+            node = self.nodes[doc_id] = len(self.courts)
+            self.courts.append(court)
+            self.years.append(year)
+        for key in header.own:
+            self.own.setdefault(key, node)
+        if header.title is not None:
+            # A title shared by different judgments cannot be resolved
+            previous = self.titles.setdefault(header.title, doc_id)
+            if previous != doc_id:
+                self.titles[header.title] = None
+
+    def unambiguous_titles(self):
+        return {title: doc_id for title, doc_id in self.titles.items() if doc_id is not None}
+
+    def add_citations(self, doc_id, extraction):
+        node = self.nodes[doc_id]
+        targets = {self.nodes[cited_id] for cited_id in extraction.case_names}
+        for key in extraction.cited:
+            target = self.own.get(key)
+            if target is None:
+                self.unresolved += 1
+            else:
+                targets.add(target)
+        targets.discard(node)
+        self.src.extend([node] * len(targets))
+        self.dst.extend(targets)
+        for statute in extraction.statutes:
+            self.statute_src.append(node)
+            self.statute_dst.append(self.statute_ids.setdefault(statute, len(self.statute_ids)))
+
+    def save(self, graph_dir):
+        """Write the graph as CSR arrays, replacing any earlier build."""
+        num_nodes = len(self.courts)
+        src, dst = np.array(self.src, dtype=np.int64), np.array(self.dst, dtype=np.int64)
+        statute_src = np.array(self.statute_src, dtype=np.int64)
+        statute_dst = np.array(self.statute_dst, dtype=np.int64)
+        court_names = sorted(set(self.courts))
+        court_codes = {court: i for i, court in enumerate(court_names)}
+
+        tmp_path = graph_dir + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        arrays = {
+            "cites": build_csr(src, dst, num_nodes, num_nodes),
+            "cited_by": build_csr(dst, src, num_nodes, num_nodes),
+            "statutes": build_csr(statute_src, statute_dst, num_nodes, len(self.statute_ids)),
+            "statute_docs": build_csr(statute_dst, statute_src, len(self.statute_ids), num_nodes),
+        }
+        for name, (indptr, indices) in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}_indptr.npy"), indptr)
+            np.save(os.path.join(tmp_path, f"{name}.npy"), indices)
+        np.save(os.path.join(tmp_path, "doc_courts.npy"), np.array([court_codes[c] for c in self.courts], np.int16))
+        np.save(os.path.join(tmp_path, "doc_years.npy"), np.array(self.years, dtype=np.int16))
+        stats = {"documents": num_nodes, "edges": len(arrays["cites"][1]), "unresolved": self.unresolved}
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"doc_ids": list(self.nodes), "courts": court_names, "statutes": list(self.statute_ids),
+                       "built_at": time.time(), "stats": stats}, f)
+        old_path = graph_dir + ".old"
+        if os.path.exists(graph_dir):
+            os.replace(graph_dir, old_path)
+        os.replace(tmp_path, graph_dir)
+        shutil.rmtree(old_path, ignore_errors=True)
+        return stats
+
+
+def iter_corpus(courts, start_year=None, end_year=None, workers=None, dedupe=None):
+    """Yield (canonical doc ID, Document) for every judgment of the given courts, grouped by court and year."""
+    for court in courts:
+        bounds = year_bounds(court)
+        if bounds is None:
+            continue
+        for document in iter_documents(court, start_year or bounds[0], end_year or bounds[1], workers):
+            doc_id = document.doc_id
+            if dedupe is not None:
+                doc_id = dedupe.classify(doc_id, court, document.year, document.pdf_path, document.text)
+            yield doc_id, document
+
+
+def build_graph(graph_dir, courts, start_year=None, end_year=None, workers=None, dedupe=None):
+    """Extract citations from every judgment of the given courts and write the graph.
+
+    A first pass reads each judgment's title and equivalent citations; the
+    second scans the full texts across a process pool and resolves what they
+    cite. With a DedupeIndex, near-duplicate copies share their canonical node.
+    """
+    builder = CitationGraphBuilder()
+    for doc_id, document in iter_corpus(courts, start_year, end_year, workers, dedupe):
+        builder.add_header(doc_id, document.court, document.year, read_header(document.text))
+    print(f"Read the headers of {len(builder.nodes)} judgments, {len(builder.own)} reporter citations")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(builder.unambiguous_titles(),)) as executor:
+        documents = iter_corpus(courts, start_year, end_year, workers, dedupe)
+        for (court, year), group in groupby(documents, key=lambda item: (item[1].court, item[1].year)):
+            group = list(group)
+            start_time = time.perf_counter()
+            extractions = executor.map(extract_citations, [document.text for _, document in group],
+                                       chunksize=EXTRACT_CHUNKSIZE)
+            for (doc_id, _), extraction in zip(group, extractions):
+                builder.add_citations(doc_id, extraction)
+            print(f"Extracted citations from {len(group)} judgments for {court} ({year}) "
+                  f"in {time.perf_counter() - start_time:.1f}s")
+    return builder.save(graph_dir)
+
+
+class CitationGraph:
+    """Read-only, memory-mapped citation graph in CSR form, in both directions."""
+
+    def __init__(self, graph_dir=CITATION_GRAPH_DIR):
+        self.path = graph_dir
+        with open(os.path.join(graph_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.doc_ids = meta["doc_ids"]
+        self.courts = meta["courts"]
+        self.statute_names = meta["statutes"]
+        self.stats = meta["stats"]
+        self.nodes = {doc_id: i for i, doc_id in enumerate(self.doc_ids)}
+        self.statute_ids = {statute: i for i, statute in enumerate(self.statute_names)}
+        for name in ("cites", "cited_by", "statutes", "statute_docs"):
+            setattr(self, f"{name}_indptr", np.load(os.path.join(graph_dir, f"{name}_indptr.npy"), mmap_mode="r"))
+            setattr(self, f"{name}_indices", np.load(os.path.join(graph_dir, f"{name}.npy"), mmap_mode="r"))
+        self.doc_courts = np.load(os.path.join(graph_dir, "doc_courts.npy"), mmap_mode="r")
+        self.doc_years = np.load(os.path.join(graph_dir, "doc_years.npy"), mmap_mode="r")
+        self.counts = np.diff(self.cited_by_indptr)
+
+    def _neighbours(self, indptr, indices, doc_id, limit=None):
+        """Neighbour nodes of a document, most cited first."""
+        node = self.nodes.get(doc_id)
+        if node is None:
+            return np.zeros(0, dtype=np.int32)
+        neighbours = np.asarray(indices[indptr[node]:indptr[node + 1]])
+        order = np.argsort(-self.counts[neighbours], kind="stable")
+        return neighbours[order[:limit]]
+
+    def describe(self, nodes):
+        return [{"doc_id": self.doc_ids[node], "court": self.courts[self.doc_courts[node]],
+                 "year": int(self.doc_years[node]), "cited_by": int(self.counts[node])} for node in nodes]
+
+    def cites(self, doc_id, limit=None):
+        """The judgments a document cites, most cited first."""
+        return self.describe(self._neighbours(self.cites_indptr, self.cites_indices, doc_id, limit))
+
+    def cited_by(self, doc_id, limit=None):
+        """The judgments citing a document, most cited first."""
+        return self.describe(self._neighbours(self.cited_by_indptr, self.cited_by_indices, doc_id, limit))
+
+    def citation_count(self, doc_id):
+        node = self.nodes.get(doc_id)
+        return 0 if node is None else int(self.counts[node])
+
+    def citation_counts(self, doc_ids):
+        """Times each of several documents is cited, as an array."""
+        nodes = np.array([self.nodes.get(doc_id, -1) for doc_id in doc_ids], dtype=np.int64)
+        if not len(self.counts):
+            return np.zeros(len(nodes), dtype=np.int64)
+        return np.where(nodes >= 0, self.counts[np.maximum(nodes, 0)], 0)
+
+    def statutes(self, doc_id):
+        node = self.nodes.get(doc_id)
+        if node is None:
+            return []
+        return [self.statute_names[i] for i in self.statutes_indices[self.statutes_indptr[node]:
+                                                                      self.statutes_indptr[node + 1]]]
+
+    def citing_statute(self, statute, limit=None):
+        """The judgments referring to a statute key such as "indian penal code s. 302", most cited first."""
+        i = self.statute_ids.get(statute)
+        if i is None:
+            return []
+        nodes = np.asarray(self.statute_docs_indices[self.statute_docs_indptr[i]:self.statute_docs_indptr[i + 1]])
+        return self.describe(nodes[np.argsort(-self.counts[nodes], kind="stable")[:limit]])
+
+    def most_cited(self, k=10, court=None, start_year=None, end_year=None):
+        mask = np.ones(len(self.counts), dtype=bool)
+        if court is not None:
+            mask &= np.asarray(self.doc_courts) == (self.courts.index(court) if court in self.courts else -1)
+        if start_year is not None:
+            mask &= np.asarray(self.doc_years) >= start_year
+        if end_year is not None:
+            mask &= np.asarray(self.doc_years) <= end_year
+        nodes = np.flatnonzero(mask)
+        return self.describe(nodes[np.argsort(-self.counts[nodes], kind="stable")[:k]])
+
+    def rerank(self, results, weight):
+        """Boost search results by precedent: score * (1 + weight * log(1 + times cited)).
+
+        Inner-product scores can be negative, where scaling up would push a result down, so the
+        boost is applied to scores measured from the lowest one when any is below zero.
+        """
+        counts = self.citation_counts([result["doc_id"] for result in results])
+        floor = min([0.0] + [result["score"] for result in results])
+        for result, count in zip(results, counts):
+            result["cited_by"] = int(count)
+            result["score"] = floor + (result["score"] - floor) * (1 + weight * float(np.log1p(count)))
+        return sorted(results, key=lambda result: -result["score"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build and query the citation graph of court judgments.')
+    parser.add_argument('--graph-dir', type=str, default=CITATION_GRAPH_DIR, help='Directory holding the graph')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Extract citations and rebuild the graph")
+    build_parser.add_argument('--court-name', type=str, default=None, help='Only this court (default: every court)')
+    build_parser.add_argument('--start-year', type=int, default=None, help='First year (default: all)')
+    build_parser.add_argument('--end-year', type=int, default=None, help='Last year (default: all)')
+    build_parser.add_argument('--workers', type=int, default=None, help='Number of extraction processes')
+    build_parser.add_argument('--no-dedupe', action='store_true',
+                              help='Keep near-duplicate judgments as separate nodes')
+    for name, help_text in [("cites", "Judgments a document cites"), ("cited-by", "Judgments citing a document")]:
+        query_parser = subparsers.add_parser(name, help=help_text)
+        query_parser.add_argument('doc_id', type=str, help='Indian Kanoon doc ID')
+        query_parser.add_argument('-k', type=int, default=20, help='Number of judgments to list')
+    count_parser = subparsers.add_parser("count", help="Times each document is cited")
+    count_parser.add_argument('doc_ids', type=str, nargs="+", help='Indian Kanoon doc IDs')
+    statute_parser = subparsers.add_parser("statute", help='Judgments referring to e.g. "indian penal code s. 302"')
+    statute_parser.add_argument('statute', type=str, help='Statute key')
+    statute_parser.add_argument('-k', type=int, default=20, help='Number of judgments to list')
+    top_parser = subparsers.add_parser("top", help="Most cited judgments")
+    top_parser.add_argument('-k', type=int, default=20, help='Number of judgments to list')
+    top_parser.add_argument('--court-name', type=str, default=None, help='Only judgments of this court')
+    top_parser.add_argument('--start-year', type=int, default=None, help='Only judgments from this year on')
+    top_parser.add_argument('--end-year', type=int, default=None, help='Only judgments up to this year')
+    args = parser.parse_args()
+
+    if args.command == "build":
+        courts = [args.court_name] if args.court_name else sorted(
+            name for name in os.listdir(COURT_DIR) if os.path.isdir(os.path.join(COURT_DIR, name)))
+        dedupe = None if args.no_dedupe else DedupeIndex(DEDUPE_DB)
+        stats = build_graph(args.graph_dir, courts, args.start_year, args.end_year, args.workers, dedupe)
+        if dedupe is not None:
+            dedupe.close()
+        print(f"{stats['documents']} documents, {stats['edges']} citation edges, "
+              f"{stats['unresolved']} reporter citations to judgments outside the corpus")
+    else:
+        graph = CitationGraph(args.graph_dir)
+        start_time = time.perf_counter()
+        if args.command == "count":
+            results = [{"doc_id": doc_id, "cited_by": int(count)}
+                       for doc_id, count in zip(args.doc_ids, graph.citation_counts(args.doc_ids))]
+        elif args.command == "cites":
+            results = graph.cites(args.doc_id, args.k)
+        elif args.command == "cited-by":
+            results = graph.cited_by(args.doc_id, args.k)
+        elif args.command == "statute":
+            results = graph.citing_statute(args.statute, args.k)
+        else:
+            results = graph.most_cited(args.k, args.court_name, args.start_year, args.end_year)
+        print(f"{len(results)} results in {(time.perf_counter() - start_time) * 1000:.2f} ms")
+        for result in results:
+            location = f"{result['court']} {result['year']} " if "court" in result else ""
+            print(f"{location}doc {result['doc_id']}: cited by {result['cited_by']}")
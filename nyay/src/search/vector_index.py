@@ -0,0 +1,344 @@
+import os
+import sys
+import json
+import hashlib
+import math
+import time
+import sqlite3
+import argparse
+import numpy as np
+import faiss
+import torch
+from transformers import AutoTokenizer, AutoModel
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dataset-generation"))
+from corpus import iter_documents, load_summary  # noqa: E402
+from pdf_text import file_signature  # noqa: E402
+from dedupe import DedupeIndex, DEDUPE_DB  # noqa: E402
+
+VECTOR_INDEX_DIR = "../data/Search_Index/vector"
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_BATCH_SIZE = 64
+EMBED_MAX_TOKENS = 256
+CHUNK_WORDS = 150
+CHUNK_OVERLAP_WORDS = 30
+INDEX_TYPE = "ivf"
+NLIST = 1024
+HNSW_M = 32
+# IVF needs this many training vectors per list for stable centroids
+TRAIN_POINTS_PER_LIST = 39
+# FAISS samples at most this many training vectors per list
+MAX_TRAIN_POINTS_PER_LIST = 256
+# PQ trains 256 centroids per sub-quantizer
+PQ_MIN_TRAIN = 256
+NPROBE = 16
+EF_SEARCH = 64
+
+
+class Embedder:
+    """Mean-pooled, L2-normalized sentence embeddings from a local transformer on CPU."""
+
+    def __init__(self, model_name=EMBEDDING_MODEL, batch_size=EMBED_BATCH_SIZE, max_tokens=EMBED_MAX_TOKENS):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+
+    @property
+    def dim(self):
+        return self.model.config.hidden_size
+
+    def embed(self, texts):
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        # Sort by length so each batch pads to a similar size
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                inputs = self.tokenizer([texts[i] for i in batch], padding=True, truncation=True,
+                                        max_length=self.max_tokens, return_tensors="pt")
+                hidden = self.model(**inputs).last_hidden_state
+                mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+                vectors[batch] = torch.nn.functional.normalize(pooled, dim=1).numpy()
+        return vectors
+
+
+def chunk_words(text, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP_WORDS):
+    """Split text into overlapping windows of words."""
+    words = text.split()
+    step = max(chunk_words - overlap, 1)
+    return [" ".join(words[start:start + chunk_words])
+            for start in range(0, max(len(words) - overlap, 1), step) if words[start:start + chunk_words]]
+
+
+def factory_string(index_type, nlist, pq_m):
+    if index_type == "ivf":
+        return f"IVF{nlist},PQ{pq_m}" if pq_m else f"IVF{nlist},Flat"
+    if index_type == "hnsw":
+        return f"HNSW{HNSW_M}_PQ{pq_m}" if pq_m else f"HNSW{HNSW_M},Flat"
+    return "Flat"
+
+
+class VectorIndex:
+    """A persisted FAISS index of passage embeddings with an SQLite metadata store.
+
+    Passage i in the metadata table is vector i in the FAISS index. Metadata
+    is committed only after the index file has been replaced, so a crash
+    leaves at most vectors without metadata, which searches skip.
+
+    An IVF or PQ index is only trained once enough passages exist to train
+    it at its configured size; until then passages are staged in a flat
+    index, which is searched exactly. Filters are resolved to passage IDs in
+    the metadata store and applied inside the FAISS search.
+    """
+
+    def __init__(self, index_dir=VECTOR_INDEX_DIR, embedder=None, index_type=INDEX_TYPE, nlist=NLIST, pq_m=None):
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_path = os.path.join(index_dir, "passages.faiss")
+        self.config_path = os.path.join(index_dir, "index.json")
+        self.embedder = embedder or Embedder()
+        self.conn = sqlite3.connect(os.path.join(index_dir, "metadata.db"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS passages ("
+            "id INTEGER PRIMARY KEY, doc_id TEXT NOT NULL, court TEXT NOT NULL, year INTEGER NOT NULL, "
+            "source TEXT NOT NULL, chunk INTEGER NOT NULL, text TEXT NOT NULL)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "doc_id TEXT NOT NULL, source TEXT NOT NULL, signature TEXT NOT NULL, PRIMARY KEY (doc_id, source))")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS passages_court_year ON passages (court, year)")
+
+        if os.path.exists(self.index_path):
+            self.index = faiss.read_index(self.index_path)
+            with open(self.config_path) as f:
+                self.config = json.load(f)
+            if self.config["model"] != self.embedder.model_name:
+                raise ValueError(f"Index was built with {self.config['model']}, not {self.embedder.model_name}")
+        else:
+            self.index = None
+            self.config = {"model": self.embedder.model_name, "dim": self.embedder.dim,
+                           "index_type": index_type, "nlist": nlist, "pq_m": pq_m}
+        self.configure_search()
+
+    def close(self):
+        self.conn.close()
+
+    def configure_search(self, nprobe=NPROBE, ef_search=EF_SEARCH):
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        if self.index is None or self.config.get("staged"):
+            return
+        params = faiss.ParameterSpace()
+        if self.config["index_type"] == "ivf":
+            params.set_index_parameter(self.index, "nprobe", nprobe)
+        elif self.config["index_type"] == "hnsw":
+            params.set_index_parameter(self.index, "efSearch", ef_search)
+
+    def training_size(self):
+        """Passages needed to train the configured index; 0 if it needs no training."""
+        needed = self.config["nlist"] * TRAIN_POINTS_PER_LIST if self.config["index_type"] == "ivf" else 0
+        return max(needed, PQ_MIN_TRAIN) if self.config["pq_m"] else needed
+
+    def create_index(self, vectors):
+        """Build and train the configured index, or a flat staging index until there are enough vectors."""
+        if len(vectors) < self.training_size():
+            self.index = faiss.IndexFlatIP(self.config["dim"])
+            self.config["staged"] = True
+            return
+        index = faiss.index_factory(self.config["dim"],
+                                    factory_string(self.config["index_type"], self.config["nlist"],
+                                                   self.config["pq_m"]),
+                                    faiss.METRIC_INNER_PRODUCT)
+        if not index.is_trained:
+            limit = self.config["nlist"] * MAX_TRAIN_POINTS_PER_LIST
+            sample = vectors
+            if len(vectors) > limit:
+                # A random sample rather than the first passages, which all come from the same documents
+                sample = vectors[np.random.default_rng(0).choice(len(vectors), limit, replace=False)]
+            index.train(sample)
+        self.index = index
+        self.config["staged"] = False
+        self.configure_search()
+
+    def train_staged(self):
+        """Move the staged vectors into the configured index once there are enough to train it."""
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        self.create_index(vectors)
+        self.index.add(vectors)
+        print(f"Trained the {self.config['index_type']} index on {len(vectors)} staged passages")
+
+    def is_indexed(self, doc_id, source, signature):
+        row = self.conn.execute("SELECT signature FROM documents WHERE doc_id = ? AND source = ?",
+                                (doc_id, source)).fetchone()
+        return row is not None and row[0] == signature
+
+    def add_documents(self, documents):
+        """Embed and add (doc_id, court, year, source, signature, text) tuples that are new or changed.
+
+        Returns the number of passages added. Passages of a changed document are
+        replaced in the metadata; their old vectors stay in the index but no
+        longer resolve to a passage.
+        """
+        rows = []
+        for doc_id, court, year, source, signature, text in documents:
+            if self.is_indexed(doc_id, source, signature):
+                continue
+            rows.extend((doc_id, court, year, source, chunk, passage, signature)
+                        for chunk, passage in enumerate(chunk_words(text)))
+        if not rows:
+            return 0
+
+        vectors = self.embedder.embed([row[5] for row in rows])
+        if self.index is None:
+            self.create_index(vectors)
+        first_id = self.index.ntotal
+        self.index.add(vectors)
+        if self.config.get("staged") and self.index.ntotal >= self.training_size():
+            self.train_staged()
+
+        with self.conn:
+            keys = {(row[0], row[3]) for row in rows}
+            self.conn.executemany("DELETE FROM passages WHERE doc_id = ? AND source = ?", keys)
+            self.conn.executemany(
+                "INSERT INTO passages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(first_id + i, doc_id, court, year, source, chunk, passage)
+                 for i, (doc_id, court, year, source, chunk, passage, _) in enumerate(rows)])
+            self.conn.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?, ?)",
+                                  {(row[0], row[3], row[6]) for row in rows})
+            # Persist the index before the metadata transaction commits
+            self.save()
+        return len(rows)
+
+    def save(self):
+        tmp_path = self.index_path + ".tmp"
+        faiss.write_index(self.index, tmp_path)
+        os.replace(tmp_path, self.index_path)
+        with open(self.config_path + ".tmp", "w") as f:
+            json.dump(self.config, f)
+        os.replace(self.config_path + ".tmp", self.config_path)
+
+    def filtered_ids(self, court=None, start_year=None, end_year=None, source=None):
+        """Return the IDs of the current passages matching the filters."""
+        clauses, params = [], []
+        for clause, value in [("court = ?", court), ("year >= ?", start_year), ("year <= ?", end_year),
+                              ("source = ?", source)]:
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        rows = self.conn.execute(f"SELECT id FROM passages WHERE {' AND '.join(clauses)}", params)
+        return np.fromiter((row[0] for row in rows), dtype=np.int64)
+
+    def search_parameters(self, ids):
+        """Restrict a FAISS search to a set of IDs, probing wider the fewer of the vectors they cover."""
+        selector = faiss.IDSelectorBatch(ids)
+        widen = self.index.ntotal / len(ids)
+        if self.config.get("staged") or self.config["index_type"] == "flat":
+            return faiss.SearchParameters(sel=selector), selector
+        if self.config["index_type"] == "ivf":
+            nprobe = min(self.config["nlist"], math.ceil(self.nprobe * widen))
+            return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe), selector
+        ef_search = min(self.index.ntotal, math.ceil(self.ef_search * widen))
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search), selector
+
+    def search(self, query, k=10, court=None, start_year=None, end_year=None, source=None):
+        """Return the top-k passages for a query as dicts, best first, optionally filtered."""
+        if self.index is None or self.index.ntotal == 0:
+            return []
+        vector = self.embedder.embed([query])
+        if court is None and start_year is None and end_year is None and source is None:
+            scores, ids = self.index.search(vector, min(k, self.index.ntotal))
+        else:
+            filtered = self.filtered_ids(court, start_year, end_year, source)
+            if len(filtered) == 0:
+                return []
+            # The selector must outlive the search, so it is returned alongside the parameters
+            params, _selector = self.search_parameters(filtered)
+            scores, ids = self.index.search(vector, min(k, len(filtered)), params=params)
+        ids = [int(i) for i in ids[0] if i >= 0]
+        if not ids:
+            return []
+        placeholders = ",".join("?" * len(ids))
+        rows = self.conn.execute(
+            f"SELECT id, doc_id, court, year, source, chunk, text FROM passages WHERE id IN ({placeholders})",
+            ids).fetchall()
+        by_id = {row[0]: row for row in rows}
+        results = []
+        for passage_id, score in zip(ids, scores[0]):
+            row = by_id.get(passage_id)
+            if row is None:
+                continue
+            _, doc_id, row_court, row_year, row_source, chunk, text = row
+            results.append({"doc_id": doc_id, "court": row_court, "year": row_year, "source": row_source,
+                            "chunk": chunk, "score": float(score), "text": text})
+        return results
+
+
+def index_year_range(index, court_name, start_year, end_year, include_text=True, include_summaries=True,
+                     dedupe=None):
+    """Add the extracted text and summaries of a court's PDFs to the index, one year at a time.
+
+    With a DedupeIndex, near-duplicate judgments are left out; searches find their canonical copy.
+    """
+    for year in range(start_year, end_year + 1):
+        documents = []
+        for document in iter_documents(court_name, year, year, dedupe=dedupe):
+            filename = os.path.basename(document.pdf_path)
+            if include_text:
+                signature = "{}:{}".format(*file_signature(document.pdf_path))
+                documents.append((document.doc_id, court_name, year, "text", signature, document.text))
+            summary = load_summary(court_name, year, filename) if include_summaries else None
+            if summary:
+                signature = hashlib.sha1(summary.encode("utf-8")).hexdigest()
+                documents.append((document.doc_id, court_name, year, "summary", signature, summary))
+        if documents:
+            added = index.add_documents(documents)
+            if added:
+                print(f"Indexed {added} passages for {court_name} ({year}), {index.index.ntotal} vectors in total")
+            else:
+                print(f"{court_name} ({year}) is already indexed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build and query a vector index of court judgments and summaries.')
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_parser = subparsers.add_parser("add", help="Embed and index a court's documents for a year range")
+    add_parser.add_argument('--court-name', type=str, required=True, help='Name of the court')
+    add_parser.add_argument('--start-year', type=int, required=True, help='Start year of the documents to index')
+    add_parser.add_argument('--end-year', type=int, required=True, help='End year of the documents to index')
+    add_parser.add_argument('--index-type', type=str, default=INDEX_TYPE, choices=["ivf", "hnsw", "flat"],
+                            help='FAISS index structure, fixed when the index is first built')
+    add_parser.add_argument('--nlist', type=int, default=NLIST, help='Number of IVF lists')
+    add_parser.add_argument('--pq', type=int, default=None,
+                            help='Compress vectors with product quantization into this many sub-quantizers')
+    add_parser.add_argument('--no-text', action='store_true', help='Index summaries only')
+    add_parser.add_argument('--no-summaries', action='store_true', help='Index extracted text only')
+    add_parser.add_argument('--no-dedupe', action='store_true', help='Also index near-duplicate judgments')
+    search_parser = subparsers.add_parser("search", help="Print the passages closest to a query")
+    search_parser.add_argument('query', type=str, help='Search query')
+    search_parser.add_argument('-k', type=int, default=10, help='Number of passages to return')
+    search_parser.add_argument('--court-name', type=str, default=None, help='Only return passages from this court')
+    search_parser.add_argument('--start-year', type=int, default=None, help='Only return passages from this year on')
+    search_parser.add_argument('--end-year', type=int, default=None, help='Only return passages up to this year')
+    for sub in (add_parser, search_parser):
+        sub.add_argument('--index-dir', type=str, default=VECTOR_INDEX_DIR, help='Directory holding the index')
+        sub.add_argument('--model', type=str, default=EMBEDDING_MODEL, help='Local embedding model')
+    args = parser.parse_args()
+
+    if args.command == "add":
+        index = VectorIndex(args.index_dir, Embedder(args.model), args.index_type, args.nlist, args.pq)
+        dedupe = None if args.no_dedupe else DedupeIndex(DEDUPE_DB)
+        index_year_range(index, args.court_name, args.start_year, args.end_year,
+                         not args.no_text, not args.no_summaries, dedupe)
+        if dedupe is not None:
+            dedupe.close()
+    else:
+        index = VectorIndex(args.index_dir, Embedder(args.model))
+        start_time = time.perf_counter()
+        results = index.search(args.query, args.k, args.court_name, args.start_year, args.end_year)
+        print(f"{len(results)} results in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+        for result in results:
+            print(f"[{result['score']:.3f}] {result['court']} {result['year']} doc {result['doc_id']} "
+                  f"({result['source']} #{result['chunk']}): {result['text'][:200]}")
+    index.close()